@@ -62,10 +62,11 @@ class PrefixInfixSymbol(SymbolBase):
         if(sdata.getMetaData().id == '+'):
             return sdata.operand0
         elif(sdata.getMetaData().id == '-'):
-            if(sdata.operand0.getMetaData().id != 'NUMBER'):
-                raise SyntaxError('- sign can be followed only by a number')
-            sdata.operand0.value = str(-1 * float(sdata.operand0.value))
-            return sdata.operand0
+            # Numbers are negated here, other operands by the evaluator
+            # (operand1 is None for the prefix form)
+            if(sdata.operand0.getMetaData().id == 'NUMBER'):
+                sdata.operand0.value = str(-1 * float(sdata.operand0.value))
+                return sdata.operand0
         return sdata
 
     def procInfix(self, sdata, left):
@@ -124,14 +125,40 @@ class PairedSymbol(SymbolBase):
         validateNext(self.endChar)
         return sdata
 
+# Items of the list symbol e.g. [1, 2] or the tuple (1, 2), None otherwise
+def getListItems(sdata):
+    if(isinstance(sdata.operand0, list)):
+        return sdata.operand0
+    if(sdata.getMetaData().id == '(' and sdata.operand0 == None and \
+        isinstance(sdata.operand1, list)):
+        return sdata.operand1
+    return None
+
 class ParenthesisSymbol(PairedSymbol):
     def __init__(self, id, precedence = 0):
         super(ParenthesisSymbol, self).__init__(id, precedence, \
             '(', ')', 'input')
 
+    # Tuple e.g. vector (1, 2, x) has the items as operand1 and no operand0
+    # (unlike function call)
+    def procPrefix(self, sdata):
+        retVal = super(ParenthesisSymbol, self).procPrefix(sdata)
+        if(retVal == sdata):
+            sdata.operand1 = sdata.operand0
+            sdata.operand0 = None
+        return retVal
+
     def procInfix(self, sdata, left):
         retVal = super(ParenthesisSymbol, self).procInfix(sdata, left)
         sdata.operand0.isFn = True
+        # Keyword arguments e.g. prnbsdf(Roughness = r)
+        for i, arg in enumerate(sdata.operand1):
+            if(arg != None and arg.getMetaData().id == '='):
+                if(arg.operand0.getMetaData().id != 'NAME' or \
+                    arg.operand0.sockIdx != None):
+                    raise SyntaxError('Keyword argument should be a name')
+                arg.operand1.argName = arg.operand0.value
+                sdata.operand1[i] = arg.operand1
         return retVal
 
 class BracketSymbol(PairedSymbol):
@@ -161,6 +188,16 @@ class BraceSymbol(PairedSymbol):
         sdata.operand0.isGroup = True
         return retVal
 
+# Member access e.g. swizzle v.x, the name is the value of the symbol
+class DotSymbol(SymbolBase):
+    def procInfix(self, sdata, left):
+        if(_gNextData.getMetaData().id != 'NAME'):
+            raise SyntaxError('. should be followed by a name')
+        sdata.operand0 = left
+        sdata.value = _gNextData.value
+        validateNext()
+        return sdata
+
 class DollarSymbol(InfixSymbol):
     def __init__(self, id, precedence = 0):
         super(DollarSymbol, self).__init__(id, precedence)
@@ -182,13 +219,15 @@ class DollarSymbol(InfixSymbol):
         if(sdata.operand1.symbolType in {'input', 'output'}):
             op1 = [sdata.operand1]
         else:
-            op1 = sdata.operand1.operand0
+            op1 = getListItems(sdata.operand1)
         for op in op1:
-            if(isinstance(op.operand0, list)):
+            if(op == None): # Blank e.g. $(, 1), value is not changed
+                sdata.value.append(None)
+            elif(getListItems(op) != None):
                 newVal = []
                 sdata.value.append(newVal)
-                for innerOp in op.operand0:
-                    newVal.append(innerOp.value)
+                for innerOp in getListItems(op):
+                    newVal.append(innerOp.value if innerOp != None else None)
             else:
                 sdata.value.append(op.value)
 
@@ -207,48 +246,21 @@ class EqualsSymbol(InfixSymbol):
         # ~ sdata.operand0 = None
         return retVal
 
+# Token: symbol (parse behavior and binding power), the operators of the
+# script language are added by the registry module (see registerOperator)
 symbolTable = {}
+
+def registerSymbol(symbol):
+    symbolTable[symbol.id] = symbol
+
+def unregisterSymbol(id):
+    symbolTable.pop(id, None)
+
 def getSymbolMeta(id):
-    c = symbolTable.get(id)
-    if(c == None):
-        if(id == '='):
-            c = EqualsSymbol(id, 100)
-        elif(id == '+'):
-            c = PrefixInfixSymbol(id, 110, 130)
-        elif(id == '-'):
-            c = PrefixInfixSymbol(id, 110, 130)
-        elif(id == '*'):
-            c = InfixSymbol(id, 120)
-        elif(id == '**'):
-            c = InfixSymbol(id, 140)
-        elif(id == '%'):
-            c = InfixSymbol(id, 120)
-        elif(id == '/'):
-            c = InfixSymbol(id, 120)
-        elif(id == '$'):
-            c = DollarSymbol(id, 160)
-        elif(id == '('):
-            c = ParenthesisSymbol(id, 150)
-        elif(id == '['):
-            c = BracketSymbol(id, 150)
-        elif(id == '{'):
-            c = BraceSymbol(id, 150)
-        elif(id == 'NAME'):
-            c = NameSymbol(id, 0)
-        elif(id == 'NUMBER'):
-            c = NumberSymbol(id, 0)
-        elif(id == 'END'):
-            c = SymbolBase(id, 0)
-        elif(id == ')'):
-            c = SymbolBase(id, 0)
-        elif(id == ']'):
-            c = SymbolBase(id, 0)
-        elif(id == '}'):
-            c = SymbolBase(id, 0)
-        elif(id == ','):
-            c = SymbolBase(id, 0)
-        symbolTable[id] = c
-    return c
+    return symbolTable.get(id)
+
+for id in ['END', ')', ']', '}', ',']:
+    registerSymbol(SymbolBase(id, 0))
 
 def getToken(expression, dataclass):
     TYPE_MAP = {tokenize.NUMBER: 'NUMBER', tokenize.STRING: 'STRING', \
@@ -8,7 +8,13 @@
 # License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
 #
 
-from . xnodifyui import register, unregister
+try:
+    import bpy
+except ImportError: # Outside Blender (e.g. python -m xnodify), no UI
+    bpy = None
+
+if(bpy != None):
+    from . xnodifyui import register, unregister
 
 bl_info = {
     "name": "XNodify",
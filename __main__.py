@@ -0,0 +1,124 @@
+#
+# Command line entry point of XNodify (python -m xnodify).
+# Compiles .edf scripts to serialized node graphs outside Blender
+# (or decompiles the graphs back to scripts with -d)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import argparse, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+from .compiler import compileFile, decompileFile, collectScripts, SCRIPT_EXT
+from .main import CompileOptions
+from . import schema, graphformat, oslgen
+
+def parseArgs(args):
+    argParser = argparse.ArgumentParser(prog = 'python -m xnodify', \
+        description = 'Validate and compile XNodify scripts (.edf) ' + \
+            'to serialized node graphs.')
+    argParser.add_argument('paths', nargs = '+', \
+        help = 'Script files or directories (searched recursively)')
+    argParser.add_argument('-o', '--output-dir', default = None, \
+        help = 'Output directory (default: next to the scripts)')
+    argParser.add_argument('-c', '--check', action = 'store_true', \
+        help = 'Only validate, do not write output files')
+    argParser.add_argument('-j', '--jobs', type = int, \
+        default = os.cpu_count(), help = 'Number of worker processes')
+    argParser.add_argument('-O', '--optimize', action = 'store_true', \
+        help = 'Optimize the generated graphs (e.g. use vector math nodes)')
+    argParser.add_argument('-i', '--inline', action = 'store_true', \
+        help = 'Set the numbers given to operators and functions as ' + \
+            'input values instead of creating Value nodes')
+    argParser.add_argument('-B', '--balance', action = 'store_true', \
+        help = 'Arrange long chains of +, *, min, max as balanced trees ' + \
+            '(float results can differ slightly)')
+    argParser.add_argument('--osl', nargs = '?', const = '', default = None, \
+        metavar = 'GROUPS', help = 'Compile connected math nodes to OSL ' + \
+            'Script nodes (Cycles), of the whole script or of the given ' + \
+                'comma separated groups')
+    argParser.add_argument('-r', '--render-cost', action = 'store_true', \
+        help = 'Estimate the render cost of the generated materials')
+    argParser.add_argument('--budget', type = float, default = None, \
+        help = 'Warn if the estimated render cost is more than this ' + \
+            '(implies --render-cost)')
+    argParser.add_argument('-b', '--blender-version', default = None, \
+        help = 'Blender version of the socket schema e.g. 2.90 ' + \
+            '(default: latest available)')
+    argParser.add_argument('-q', '--quiet', action = 'store_true', \
+        help = 'Print only errors and the summary')
+    argParser.add_argument('-d', '--decompile', action = 'store_true', \
+        help = 'Decompile node graphs (' + graphformat.GRAPH_EXT + \
+            ') to scripts instead')
+    return argParser.parse_args(args)
+
+def main(args = None):
+    params = parseArgs(args)
+    if(params.blender_version != None): # Inherited by the worker processes
+        os.environ[schema.VERSION_ENV] = params.blender_version
+    if(params.decompile):
+        scripts = collectScripts(params.paths, params.output_dir, \
+            graphformat.GRAPH_EXT, SCRIPT_EXT)
+        fn, args = decompileFile, []
+    else:
+        scripts = collectScripts(params.paths, params.output_dir)
+        osl = oslgen.parseSelection(params.osl) \
+            if params.osl != None else None
+        fn, args = compileFile, \
+            [[CompileOptions(optimize = params.optimize, \
+                inline = params.inline, rebalance = params.balance, \
+                    osl = osl, estimateCost = params.render_cost, \
+                        costBudget = params.budget)] * len(scripts)]
+    filePaths = [s[0] for s in scripts]
+    outPaths = [None if params.check else s[1] for s in scripts]
+
+    start = time.perf_counter()
+    if(params.jobs <= 1 or len(scripts) <= 1):
+        results = list(map(fn, filePaths, outPaths, *args))
+    else:
+        chunkSize = max(1, len(scripts) // (params.jobs * 4))
+        with ProcessPoolExecutor(max_workers = params.jobs) as executor:
+            results = list(executor.map(fn, filePaths, outPaths, *args, \
+                chunksize = chunkSize))
+    elapsed = time.perf_counter() - start
+
+    errCnt = 0
+    for result in results:
+        if(result['error'] != None):
+            errCnt += 1
+            print('%s: %s' % (result['path'], result['error']), \
+                file = sys.stderr)
+        elif(params.decompile):
+            if(not params.quiet):
+                print('%s: %d nodes to %d lines (%.1f ms)' % (result['path'], \
+                    result['nodes'], result['lines'], result['time'] * 1000))
+                for warning in result['warnings']: print('    ' + warning)
+        elif(not params.quiet):
+            print('%s: %d nodes, %d links, %d groups (%.1f ms)' % \
+                (result['path'], result['nodes'], result['links'], \
+                    result['groups'], result['time'] * 1000))
+            for lineNo, warnings in result['warnings'].items():
+                print('    Line %s: %s' % (lineNo, '; '.join(warnings)))
+            optCounters = result['optCounters']
+            if(len(optCounters) > 0):
+                print('    Nodes saved: ' + ', '.join(name + ': ' + \
+                    str(optCounters[name]) for name in sorted(optCounters)))
+            renderCost = result['renderCost']
+            if(renderCost != None):
+                print('    Render cost: %.1f, depth: %d, most expensive: %s' \
+                    % (renderCost['total'], renderCost['depth'], \
+                        ', '.join('%s (%.1f)' % tuple(subgraph) \
+                            for subgraph in renderCost['subgraphs'])))
+
+    print('%d files (%d failed), %d lines, %d nodes, %d links in %.2fs ' \
+        '(%.1f files/s)' % (len(results), errCnt, \
+            sum(r['lines'] for r in results), \
+                sum(r['nodes'] for r in results), \
+                    sum(r['links'] for r in results), elapsed, \
+                        len(results) / elapsed if elapsed > 0 else 0))
+    return 1 if errCnt > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
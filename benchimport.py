@@ -0,0 +1,131 @@
+#
+# Import time benchmark of the add-on registration (outside Blender).
+# Imports and registers the add-on with python -X importtime against a
+# minimal stub of bpy and reports the time of the add-on modules.
+# Compiler modules are expected to be loaded only on the first operator call.
+# Run from the parent directory of the add-on folder:
+#   python xnodify/benchimport.py [-r runs]
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import argparse, ast, os, subprocess, sys, tempfile
+
+# Modules imported at registration and the development / command line
+# scripts, all the other modules of the add-on are compiler modules
+REGISTRATION_MODULES = {'__init__', 'xnodifyui', 'lookups'}
+SCRIPT_MODULES = {'__main__', 'benchimport', 'extractschema'}
+
+STUB_FILES = {
+    'bpy/__init__.py': 'from . import props, types, utils, path, data\n',
+    'bpy/props.py': '\n'.join('def %s(**kwargs): return (%r, kwargs)' % \
+        (name, name) for name in ('StringProperty', 'FloatProperty', \
+            'EnumProperty', 'BoolProperty', 'IntProperty', \
+                'PointerProperty')) + '\n',
+    'bpy/types.py': ''.join('class %s: pass\n' % name for name in \
+        ('PropertyGroup', 'Operator', 'Panel', 'WindowManager')),
+    'bpy/utils.py': 'def register_class(cls): pass\n' + \
+        'def unregister_class(cls): pass\n',
+    'bpy/path.py': 'def abspath(path): return path\n',
+    'bpy/data.py': 'texts = []\nnode_groups = []\nmaterials = []\n',
+    'bpy_extras/__init__.py': '',
+    'bpy_extras/io_utils.py': 'class ExportHelper: pass\n',
+    'mathutils.py': 'class Vector(tuple): pass\n',
+}
+
+def writeStubs(stubDir):
+    for relPath, content in STUB_FILES.items():
+        path = os.path.join(stubDir, relPath)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+# Registration should not import these (parser is the same as Parser on
+# case insensitive file systems)
+def getCompilerModules(addonDir):
+    names = set(os.path.splitext(f)[0] for f in os.listdir(addonDir) \
+        if f.endswith('.py'))
+    return sorted(names - REGISTRATION_MODULES - SCRIPT_MODULES - {'parser'})
+
+# Modules reloaded in debug mode (xnodifyui.COMPILER_MODULES, read from the
+# source since xnodifyui needs bpy)
+def getReloadModules(addonDir):
+    with open(os.path.join(addonDir, 'xnodifyui.py')) as f:
+        tree = ast.parse(f.read())
+    for stmt in tree.body:
+        if(isinstance(stmt, ast.Assign) and \
+            any(getattr(t, 'id', None) == 'COMPILER_MODULES' \
+                for t in stmt.targets)):
+            return ast.literal_eval(stmt.value)
+    return []
+
+# Returns {module name: (self us, cumulative us)} of the add-on modules,
+# modules: compiler modules imported after the registration (first call)
+def runImport(stubDir, addonDir, modules = []):
+    package = os.path.basename(addonDir)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([stubDir, os.path.dirname(addonDir)])
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = 'import %s as a; a.register()' % package + \
+        ''.join('; import %s.%s' % (package, name) for name in modules)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], \
+        env = env, stderr = subprocess.PIPE, universal_newlines = True)
+    if(proc.returncode != 0):
+        raise RuntimeError(proc.stderr)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if(not line.startswith('import time:')): continue
+        parts = line[len('import time:'):].split('|')
+        name = parts[2].strip()
+        if(name == package or name.startswith(package + '.')):
+            try: times[name] = (int(parts[0]), int(parts[1]))
+            except ValueError: pass # Header line
+    return times
+
+def main():
+    argParser = argparse.ArgumentParser(prog = 'benchimport.py', \
+        description = 'Import time of the add-on registration (stub bpy)')
+    argParser.add_argument('-r', '--runs', type = int, default = 5, \
+        help = 'Number of runs (best one is reported)')
+    args = argParser.parse_args()
+
+    addonDir = os.path.dirname(os.path.abspath(__file__))
+    package = os.path.basename(addonDir)
+    compilerModules = getCompilerModules(addonDir)
+    with tempfile.TemporaryDirectory() as stubDir:
+        writeStubs(stubDir)
+        runImport(stubDir, addonDir, compilerModules) # Byte compile
+        results = [runImport(stubDir, addonDir) for i in range(args.runs)]
+        firstCalls = [runImport(stubDir, addonDir, compilerModules) \
+            for i in range(args.runs)]
+    best = min(results, key = lambda t: t.get(package, (0, 0))[1])
+
+    for name in sorted(best, key = lambda n: -best[n][0]):
+        print('%8.2f ms  %s' % (best[name][0] / 1000, name))
+    print('Total (cumulative): %.2f ms' % (best[package][1] / 1000))
+
+    # Cost of the compiler modules, paid on the first operator call
+    compilerTimes = [sum(times[name][0] for name in times \
+        if name.split('.')[-1] in compilerModules) for times in firstCalls]
+    print('Compiler modules (first call): %.2f ms' % \
+        (min(compilerTimes) / 1000))
+
+    result = 0
+    loaded = sorted(name for name in best \
+        if name.split('.')[-1] in compilerModules)
+    if(len(loaded) > 0):
+        print('Compiler modules imported at registration: ' + \
+            ', '.join(loaded))
+        result = 1
+    notReloaded = sorted(set(compilerModules) - \
+        set(getReloadModules(addonDir)))
+    if(len(notReloaded) > 0):
+        print('Compiler modules missing in xnodifyui.COMPILER_MODULES: ' + \
+            ', '.join(notReloaded))
+        result = 1
+    return result
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+#
+# Semantic checks of parsed XNodify scripts.
+# The whole program is checked before any node is created, using the arity
+# and socket counts from lookups and the socket names from schema
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import tokenize
+
+from .lookups import fnMap, mathFnMap, vmathFnMap, mathPrefix, vmathPrefix
+from .lookups import getCombinedMap
+from .schema import getFnSchema
+from .registry import getOperator
+from .evaluator import VECTOR_COMPONENTS, COLOR_COMPONENTS, BraceEvaluator
+
+VECTOR_FN = 'comxyz' # Node of vector literal e.g. (1, x, 0)
+
+def getErrorMessage(e):
+    if(isinstance(e, StopIteration)): return 'Incomplete expression'
+    if(isinstance(e, tokenize.TokenError)): return 'Syntax error, ' + e.args[0]
+    msg = str(e)
+    return msg if msg != '' else type(e).__name__
+
+# Key of fnMap, mathFnMap or vmathFnMap for the symbol name
+def getCustomName(name):
+    if(fnMap.get(name) != None): return name
+    if(mathFnMap.get(mathPrefix + name) != None): return mathPrefix + name
+    if(vmathFnMap.get(vmathPrefix + name) != None): return vmathPrefix + name
+    return None
+
+# (custom name, output index) of the separate node of the swizzle e.g. .x
+def getSwizzleFn(component):
+    if(component in VECTOR_COMPONENTS):
+        return 'sepxyz', VECTOR_COMPONENTS[component]
+    return 'seprgb', COLOR_COMPONENTS.get(component)
+
+class ProgramChecker:
+    def __init__(self):
+        self.errors = []
+        self.lineNo = None
+        self.fnInfos = getCombinedMap()
+        # Variable name: (custom name of the node, bound output index)
+        # custom name is None if not known (e.g. group)
+        self.varTypes = {}
+        self.outerVarTypes = [] # Of the trees enclosing the group body
+
+    def addError(self, msg):
+        self.errors.append((self.lineNo, msg))
+
+    def checkProgram(self, program):
+        for lineNo, dataTree in program:
+            self.lineNo = lineNo
+            self.checkLine(dataTree)
+        return self.errors
+
+    def checkLine(self, dataTree):
+        self.assignCnt = 0
+        self.checkSymbol(dataTree, False)
+
+    # Group bodies can have any number of assignments (local variables)
+    def checkAssignment(self, data, inGroup):
+        if(not inGroup):
+            self.assignCnt += 1
+            if(self.assignCnt > 1):
+                self.addError('Only one assignment allowed in a line.')
+                return
+        lhs, rhs = data.operand0, data.operand1
+        if(lhs == None or rhs == None):
+            self.addError('Values needed on both sides of =')
+            return
+        if(lhs.getMetaData().id != 'NAME'):
+            self.addError('LHS must be a variable or the output node')
+            return
+        if(lhs.value != 'output' and getCustomName(lhs.value) != None):
+            self.addError('LHS cannot refer to a node other than output')
+            return
+        if(lhs.value == 'output' and inGroup):
+            self.addError('Groups cannot contain output')
+            return
+        self.checkSymbol(rhs, inGroup)
+        if(lhs.value != 'output'):
+            self.varTypes[lhs.value] = self.getNodeType(rhs)
+
+    # Returns (custom name, output index) of the node the symbol evaluates to
+    def getNodeType(self, data):
+        id = data.getMetaData().id
+        if(id == '('):
+            if(data.operand0 == None): return VECTOR_FN, data.sockIdx
+            return getCustomName(data.operand0.value), data.sockIdx
+        elif(id == '.'): # Bound to the output of the component
+            return getSwizzleFn(data.value)
+        elif(id == 'NAME'):
+            customName = getCustomName(data.value)
+            if(customName != None): return customName, data.sockIdx
+            varType = self.varTypes.get(data.value)
+            if(varType != None): return varType
+        elif(id == '$'):
+            return self.getNodeType(data.operand0)
+        elif(id == 'NUMBER'):
+            return 'value', data.sockIdx
+        opInfo = getOperator(id)
+        if(opInfo != None and opInfo.customName != None):
+            return opInfo.customName, data.sockIdx
+        return None, data.sockIdx
+
+    def checkSockIdx(self, data, customName):
+        if(data.sockIdx == None or customName == None): return
+        try: sockIdx = int(data.sockIdx)
+        except ValueError:
+            if(not str(data.sockIdx).isidentifier()):
+                self.addError('Invalid output index: ' + str(data.sockIdx))
+            else: self.checkSockName(data.sockIdx, customName, True)
+            return
+        opCnt = self.fnInfos[customName][4]
+        if(sockIdx < 0 or sockIdx >= opCnt):
+            self.addError('Output index %d out of range for %s ' \
+                '(%d output%s)' % (sockIdx, customName, opCnt, \
+                    's' if opCnt != 1 else ''))
+
+    # Without schema (unknown node or version) names are checked when the
+    # node is created
+    def checkSockName(self, name, customName, isOutput):
+        nodeSchema, operation = getFnSchema(customName)
+        if(nodeSchema != None and \
+            nodeSchema.getSocket(name, isOutput, operation) == None):
+            self.addError('Unknown %s: %s (%s)' % ('output' if isOutput \
+                else 'input', name, customName))
+
+    def checkOperands(self, operands, inGroup):
+        for op in operands:
+            if(op != None): self.checkSymbol(op, inGroup)
+
+    def checkSymbol(self, data, inGroup):
+        id = data.getMetaData().id
+        if(id == 'NAME'):
+            self.checkName(data, inGroup)
+        elif(id == '('):
+            self.checkCall(data, inGroup)
+        elif(id == '{'):
+            self.checkGroup(data, inGroup)
+        elif(id == '$'):
+            op = data.operand0
+            if(op == None or op.getMetaData().id == 'NUMBER'):
+                self.addError('$ should be preceded by value node name')
+            else:
+                self.checkSymbol(op, inGroup)
+        elif(id == '='):
+            self.checkAssignment(data, inGroup)
+        elif(id == '.'):
+            self.checkSwizzle(data, inGroup)
+        else:
+            opInfo = getOperator(id)
+            if(opInfo == None or opInfo.customName == None): return
+            if(data.operand0 == None or \
+                (data.operand1 == None and not opInfo.isUnary)):
+                self.addError('Operands needed on both sides of ' + id)
+                return
+            self.checkSymbol(data.operand0, inGroup)
+            if(data.operand1 != None):
+                self.checkSymbol(data.operand1, inGroup)
+            self.checkSockIdx(data, opInfo.customName)
+
+    def checkName(self, data, inGroup):
+        name = data.value
+        customName = getCustomName(name)
+        if(customName != None):
+            self.checkSockIdx(data, customName)
+            return
+        if(data.isGroup): return # Name of the group
+        if(name not in self.varTypes and \
+            any(name in varTypes for varTypes in self.outerVarTypes)):
+            self.addError('Groups cannot contain variables (' + name + \
+                '), pass them as parameters e.g. grp(' + name + '){...}')
+            return
+        varType = self.varTypes.get(name)
+        if(varType == None): # Creates a value node
+            varType = ('value', None)
+            self.varTypes[name] = varType
+        if(varType[1] == None): # Output index bound in definition wins
+            self.checkSockIdx(data, varType[0])
+
+    # Parameters are checked in the enclosing tree, the body has its own
+    # variables: parameters and the ones assigned or created in it
+    def checkGroup(self, data, inGroup):
+        paramNames = []
+        for param in BraceEvaluator.getParams(data):
+            if(param == None or (param.argName == None and \
+                (param.getMetaData().id != 'NAME' or param.isFn))):
+                self.addError('Group parameters should be names or ' + \
+                    'keyword arguments e.g. grp(a, k = 2){...}')
+                continue
+            self.checkSymbol(param, inGroup)
+            name = BraceEvaluator.getParamName(param)
+            if(name in paramNames or getCustomName(name) != None):
+                self.addError('Invalid or repeated group parameter: ' + name)
+            paramNames.append(name)
+        self.outerVarTypes.append(self.varTypes)
+        self.varTypes = {name: ('value', None) for name in paramNames}
+        for op in data.operand1:
+            if(op != None): self.checkSymbol(op, True)
+        self.varTypes = self.outerVarTypes.pop()
+
+    def checkVector(self, data, inGroup):
+        items = data.operand1
+        if(len(items) != 3 or None in items):
+            self.addError('Vector needs 3 components e.g. (1, x, 0)')
+            return
+        self.checkOperands(items, inGroup)
+        self.checkSockIdx(data, VECTOR_FN)
+
+    def checkSwizzle(self, data, inGroup):
+        component = data.value
+        if(component not in VECTOR_COMPONENTS and \
+            component not in COLOR_COMPONENTS):
+            self.addError('Unknown component: ' + component + \
+                ' (x, y, z, r, g or b)')
+            return
+        if(data.sockIdx != None):
+            self.addError('Output index not allowed after .' + component)
+            return
+        self.checkSymbol(data.operand0, inGroup)
+
+    def checkCall(self, data, inGroup):
+        fnData = data.operand0
+        if(fnData == None): # Vector e.g. (1, x, 0)
+            self.checkVector(data, inGroup)
+            return
+        if(not isinstance(fnData, type(data))): # Not a call
+            self.addError('( expression does not evaluate to a node')
+            return
+        fnName = fnData.value
+        customName = getCustomName(fnName) \
+            if fnData.getMetaData().id == 'NAME' else None
+        if(customName == None):
+            self.addError('Unknown Function: ' + str(fnName))
+            self.checkOperands(data.operand1, inGroup)
+            return
+        args = data.operand1
+        argCnt = max([i + 1 for i, a in enumerate(args) \
+            if a != None and a.argName == None] + [0])
+        for arg in args:
+            if(arg != None and arg.argName != None):
+                self.checkSockName(arg.argName, customName, False)
+        ipCnt = self.fnInfos[customName][3]
+        if(argCnt > ipCnt):
+            self.addError('Too many arguments for %s (%d given, at most ' \
+                '%d)' % (fnName, argCnt, ipCnt))
+        self.checkOperands(args, inGroup)
+        self.checkSockIdx(data, customName)
+
+# Returns list of (line no, error message)
+def checkProgram(program):
+    return ProgramChecker().checkProgram(program)
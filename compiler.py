@@ -0,0 +1,156 @@
+#
+# Headless compiler for XNodify scripts.
+# Runs Parser and evaluator against in-memory node trees (nodemodel), so that
+# scripts can be validated and precompiled outside Blender
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import os, time
+
+from .nodemodel import NodeGroups
+from .main import XNodifyContext, NodeLayout, getFileOptions
+from .importer import SCRIPT_EXT
+from . import graphformat, decompiler
+
+def compileLines(lines, name = 'Material', addFrame = True, scale = (1, 1), \
+    alignment = 'TOP', minimized = False, options = None):
+    def feeder():
+        for line in lines:
+            yield line
+        yield None
+
+    nodeGroups = NodeGroups()
+    matNodeTree = nodeGroups.newRootTree(name)
+    displayParams = XNodifyContext().processExpressions(feeder(), \
+        matNodeTree, (0, 0), scale, alignment, addFrame, minimized, \
+            options = options)
+    # Dimensions are never available, lookup values are used for layout
+    NodeLayout.arrangeNodeLines(displayParams, testDimensions = False)
+    return matNodeTree, displayParams
+
+def getGraphStats(matNodeTree):
+    trees = [matNodeTree] + list(matNodeTree.nodeGroups)
+    return {'nodes': sum(len(t.nodes) for t in trees), \
+        'links': sum(len(t.links) for t in trees), \
+            'groups': len(trees) - 1}
+
+# Worker function (also run in the process pool), errors are returned
+# as part of the result instead of being raised
+def compileFile(filePath, outPath = None, options = None):
+    result = {'path': filePath, 'error': None, 'lines': 0, 'nodes': 0, \
+        'links': 0, 'groups': 0, 'warnings': {}, 'optCounters': {}, \
+            'renderCost': None}
+    start = time.perf_counter()
+    try:
+        with open(filePath) as f:
+            lines = f.readlines()
+        result['lines'] = len(lines)
+        name = os.path.splitext(os.path.basename(filePath))[0]
+        matNodeTree, displayParams = compileLines(lines, name, \
+            options = getFileOptions(options, filePath))
+        result.update(getGraphStats(matNodeTree))
+        result['warnings'] = {lineNo: sorted(w) for lineNo, w in \
+            displayParams.warnings.items()}
+        result['optCounters'] = displayParams.optCounters
+        if(displayParams.renderCost != None):
+            result['renderCost'] = displayParams.renderCost.toDict()
+        if(outPath != None):
+            outDir = os.path.dirname(outPath)
+            if(outDir != ''): os.makedirs(outDir, exist_ok = True)
+            with open(outPath, 'w') as f:
+                f.write(graphformat.dumps(matNodeTree))
+    except Exception as e:
+        result['error'] = str(e)
+    result['time'] = time.perf_counter() - start
+    return result
+
+# Decompiles the node graph file (see decompiler), errors are returned
+# as part of the result like in compileFile
+def decompileFile(filePath, outPath = None):
+    result = {'path': filePath, 'error': None, 'lines': 0, 'nodes': 0, \
+        'links': 0, 'groups': 0, 'warnings': []}
+    start = time.perf_counter()
+    try:
+        with open(filePath) as f:
+            text = f.read()
+        matNodeTree = NodeGroups().newRootTree('Material')
+        graphformat.loads(text, matNodeTree)
+        result.update(getGraphStats(matNodeTree))
+        lines, result['warnings'] = decompiler.decompileTree(matNodeTree)
+        result['lines'] = len(lines)
+        if(outPath != None):
+            outDir = os.path.dirname(outPath)
+            if(outDir != ''): os.makedirs(outDir, exist_ok = True)
+            with open(outPath, 'w') as f:
+                f.write(decompiler.getScript(lines, result['warnings']))
+    except Exception as e:
+        result['error'] = str(e)
+    result['time'] = time.perf_counter() - start
+    return result
+
+# Returns list of (script path, output path relative to outDir)
+# ext / outExt: of the input and output files, e.g. graphs to decompile
+def collectScripts(paths, outDir = None, ext = SCRIPT_EXT, \
+    outExt = graphformat.GRAPH_EXT):
+    scripts = []
+    for path in paths:
+        if(os.path.isdir(path)):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fileName in sorted(files):
+                    if(fileName.endswith(ext)):
+                        filePath = os.path.join(root, fileName)
+                        scripts.append((filePath, \
+                            os.path.relpath(filePath, path)))
+        else:
+            scripts.append((path, os.path.basename(path)))
+    return [(filePath, getOutputPath(filePath, relPath, outDir, ext, outExt)) \
+        for filePath, relPath in scripts]
+
+def getOutputPath(filePath, relPath, outDir, ext = SCRIPT_EXT, \
+    outExt = graphformat.GRAPH_EXT):
+    if(outDir == None): outPath = filePath
+    else: outPath = os.path.join(outDir, relPath)
+    if(outPath.endswith(ext)): outPath = outPath[:-len(ext)]
+    else: outPath = os.path.splitext(outPath)[0]
+    return outPath + outExt
+
+# Overrides of $ defaults as {node name: {'in' / 'out': {socket index: value}}}
+# (same as the node entries of graphformat), node names are those of template
+def applyOverrides(templateNodes, nodes, overrides):
+    nodeMap = {t['name']: n for t, n in zip(templateNodes, nodes)}
+    for nodeName, values in overrides.items():
+        node = nodeMap.get(nodeName)
+        if(node == None): raise ValueError('Override for unknown node: ' + \
+            nodeName)
+        for key, sockets in (('in', node.inputs), ('out', node.outputs)):
+            for idx, value in values.get(key, {}).items():
+                graphformat.setSocketValue(sockets[int(idx)], value)
+
+# Batch mode: the script is compiled once (in memory) and the resulting
+# graph is materialized into each of the node trees, group trees are shared
+# getOverrides: optional callback returning overrides for a tree
+def applyToTrees(lines, nodeTrees, location = (0, 0), scale = (1, 1), \
+    alignment = 'TOP', addFrame = True, minimized = False, \
+        getOverrides = None, options = None):
+    start = time.perf_counter()
+    template, displayParams = compileLines(lines, 'Template', addFrame, \
+        scale, alignment, minimized, options)
+    graph = graphformat.dumpGraph(template)
+    compileTime = time.perf_counter() - start
+
+    loadedGroups = {}
+    for nodeTree in nodeTrees:
+        nodes = graphformat.loadGraph(graph, nodeTree, location, loadedGroups)
+        overrides = getOverrides(nodeTree) if getOverrides != None else None
+        if(overrides): applyOverrides(graph['tree']['nodes'], nodes, overrides)
+    totalTime = time.perf_counter() - start
+    # Without batch mode, the script is compiled for each tree separately
+    # (estimate, compiling directly into bpy trees is slower than in memory)
+    return {'trees': len(nodeTrees), 'compileTime': compileTime, \
+        'totalTime': totalTime, 'baselineTime': len(nodeTrees) * compileTime, \
+            'warnings': displayParams.warnings, \
+                'optCounters': displayParams.optCounters}
@@ -0,0 +1,107 @@
+#
+# Cost of each script line: nodes and links created, time spent to parse,
+# evaluate (i.e. create the nodes) and lay out the line and the number of
+# uses of the variable defined by it in the later lines.
+# Collected by XNodifyContext.generateExpressions by line number (the lines
+# of imported scripts count for the import directive), shown in the panel
+# and exported as CSV or JSON
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import csv, json
+from io import StringIO
+
+PHASES = ['parse', 'evaluate', 'layout']
+
+# Columns of the report that it can be sorted by
+SORT_KEYS = ['line', 'nodes', 'links', 'parse', 'evaluate', 'layout', \
+    'total', 'uses']
+
+# Columns of the export (times in milliseconds)
+EXPORT_COLUMNS = ['line', 'expression', 'variable', 'nodes', 'links', \
+    'parse_ms', 'evaluate_ms', 'layout_ms', 'total_ms', 'uses']
+
+class LineCost:
+    def __init__(self, lineNo, expression):
+        self.lineNo = lineNo
+        self.expression = expression
+        self.variable = None # Name of the variable defined by the line
+        self.nodes = 0 # Created by the line (before optimization)
+        self.links = 0 # To the inputs of the created nodes
+        self.times = {phase: 0.0 for phase in PHASES} # Seconds
+        self.uses = 0 # References to the variable in the later lines
+
+    def getTotalTime(self):
+        return sum(self.times.values())
+
+    def getValue(self, key):
+        if(key == 'line'): return self.lineNo
+        if(key == 'total'): return self.getTotalTime()
+        if(key in self.times): return self.times[key]
+        return getattr(self, key)
+
+    def toDict(self):
+        row = {'line': self.lineNo, 'expression': self.expression, \
+            'variable': self.variable, 'nodes': self.nodes, \
+                'links': self.links, 'uses': self.uses}
+        for phase in PHASES + ['total']:
+            row[phase + '_ms'] = round(self.getValue(phase) * 1000, 3)
+        return row
+
+    def __repr__(self):
+        return '<LineCost ' + str(self.lineNo) + ' ' + self.expression + '>'
+
+class CostReport:
+    def __init__(self):
+        self.lineCosts = {} # Line number: LineCost
+
+    def getLineCost(self, lineNo, expression = ''):
+        lineCost = self.lineCosts.get(lineNo)
+        if(lineCost == None):
+            lineCost = LineCost(lineNo, expression)
+            self.lineCosts[lineNo] = lineCost
+        return lineCost
+
+    def addTime(self, lineNo, phase, seconds):
+        self.getLineCost(lineNo).times[phase] += seconds
+
+    # Sum of each column over all the lines
+    def getTotals(self):
+        totals = {key: 0 for key in SORT_KEYS if key != 'line'}
+        for lineCost in self.lineCosts.values():
+            for key in totals: totals[key] += lineCost.getValue(key)
+        return totals
+
+    # Line costs sorted by key (see SORT_KEYS), same values by line number
+    def getSorted(self, key = 'line', descending = False):
+        lineCosts = sorted(self.lineCosts.values(), key = lambda c: c.lineNo)
+        if(key == 'line'):
+            return lineCosts[::-1] if descending else lineCosts
+        return sorted(lineCosts, key = lambda c: c.getValue(key), \
+            reverse = descending)
+
+    def toCSV(self, key = 'line', descending = False):
+        output = StringIO()
+        writer = csv.DictWriter(output, EXPORT_COLUMNS, lineterminator = '\n')
+        writer.writeheader()
+        for lineCost in self.getSorted(key, descending):
+            writer.writerow(lineCost.toDict())
+        return output.getvalue()
+
+    def toJSON(self, key = 'line', descending = False):
+        totals = self.getTotals()
+        for phase in PHASES + ['total']:
+            totals[phase + '_ms'] = round(totals.pop(phase) * 1000, 3)
+        return json.dumps({'lines': [c.toDict() for c in \
+            self.getSorted(key, descending)], 'totals': totals}, indent = 1)
+
+    # Format by the extension of the file: .json or else CSV
+    def write(self, filePath, key = 'line', descending = False):
+        text = self.toJSON(key, descending) \
+            if filePath.lower().endswith('.json') \
+                else self.toCSV(key, descending)
+        with open(filePath, 'w') as f:
+            f.write(text)
@@ -0,0 +1,555 @@
+#
+# Decompiler: generates XNodify script from an existing material or group
+# node tree, e.g. to continue editing hand made materials as script.
+# The tree is walked once from the sinks (nodes without consumers), nodes
+# with more than one consumer become variables and the rest are inlined in
+# the expression of their consumer. Unlinked inputs with non-default values
+# are written as $ defaults. Group nodes with only unlinked inputs become
+# {} groups, in which nodes with more than one consumer become local
+# variables; the others, as well as the groups nested in {}, are flattened
+# (linked inputs aren't written as group parameters). Whatever can't be
+# expressed in the script (e.g. blend_type of Mix RGB) is reported as
+# warnings, written as comments at the top
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import keyword
+
+from .lookups import fnMap, mathFnMap, vmathFnMap, mathPrefix, vmathPrefix
+from .lookups import reverseLookup, SHADER_GROUP, SHADER_VALUE
+from .graphformat import ReferenceDefaults, getNodeKey, getSocketValue
+from .graphformat import VALUE_PRECISION
+
+GROUP_INPUT = 'NodeGroupInput'
+GROUP_OUTPUT = 'NodeGroupOutput'
+NODE_FRAME = 'NodeFrame'
+NODE_REROUTE = 'NodeReroute'
+VIRTUAL_SOCKET = 'NodeSocketVirtual'
+SKIPPED_NODES = {GROUP_INPUT, GROUP_OUTPUT, NODE_FRAME, NODE_REROUTE}
+
+# Longer chains of single use nodes are split with variables (the parser is
+# recursive and such lines are hard to read anyway)
+MAX_INLINE_DEPTH = 16
+
+# Node properties that can't be set in the script, reported if changed
+NODE_PROPS = ['use_clamp', 'blend_type', 'clamp', 'interpolation_type', \
+    'data_type', 'image', 'interpolation', 'projection', \
+        'extension', 'noise_dimensions', 'musgrave_type', \
+            'voronoi_dimensions', 'feature', 'distance', 'wave_type', \
+                'wave_profile', 'bands_direction', 'rings_direction', \
+                    'gradient_type', 'falloff', 'distribution', \
+                        'subsurface_method', 'component', 'space', \
+                            'vector_type', 'convert_from', 'convert_to', \
+                                'invert', 'attribute_name', 'uv_map', \
+                                    'layer_name', 'object', 'from_instancer']
+
+# Input of the group being decompiled as {} body (value is set on the group)
+class GroupInputRef:
+    def __init__(self, idx):
+        self.idx = idx
+
+# Node (in the path ctx of flattened group nodes) to be written in the script
+class DecompItem:
+    def __init__(self, node, ctx):
+        self.node = node
+        self.ctx = ctx
+        self.args = [] # (input index, (source item, output index))
+        self.values = {} # Input index: value of the unlinked inputs
+        self.refCnt = 0 # Number of links to the outputs
+        self.isVisited = False
+        self.text = None # Inline expression or variable name
+        self.depth = 0 # Nesting of the inline expression
+        self.argOrder = [] # (source item, output index) as written
+        self.outPositions = [] # Enabled outputs of the generated node
+        self.inPositions = [] # Enabled inputs of the generated node
+
+# Group tree as {} body: outMap / inputs map the group sockets to the
+# sockets of the generated group, whose interface follows the script order
+class GroupBody:
+    def __init__(self, name, texts, outMap, inputs):
+        self.name = name
+        self.texts = texts
+        self.outMap = outMap # Output index: output position in script
+        self.inputs = inputs # [(GroupInputRef or value, sample value)]
+
+def formatNumber(value):
+    text = ('%.*f' % (VALUE_PRECISION, value)).rstrip('0').rstrip('.')
+    return '0' if text in {'', '-0'} else text
+
+def formatValue(value):
+    if(isinstance(value, list)):
+        return '[' + ', '.join(formatNumber(v) for v in value) + ']'
+    return formatNumber(value)
+
+# $ defaults {socket index: value}, blanks for the unchanged sockets
+def formatDefaults(values, start, end):
+    if(len(values) == 0): return ''
+    return '$' + start + ', '.join(formatValue(values[i]) if i in values \
+        else '' for i in range(max(values) + 1)) + end
+
+# Value converted to the shape of the sample (i.e. the target socket)
+def convertValue(value, sample):
+    if(value == None or sample == None): return value
+    if(isinstance(sample, list)):
+        if(isinstance(value, list)):
+            return (value + sample[len(value):])[:len(sample)]
+        return [value] * 3 + [1.0] * (len(sample) - 3)
+    if(isinstance(value, list)):
+        return round(sum(value[:3]) / len(value[:3]), VALUE_PRECISION)
+    return value
+
+def isFnName(name):
+    return fnMap.get(name) != None or \
+        mathFnMap.get(mathPrefix + name) != None or \
+            vmathFnMap.get(vmathPrefix + name) != None
+
+# Custom name of the function the evaluator resolves fnName to
+# (same order as ParenthesisEvaluator)
+def resolveFnName(fnName):
+    if(fnMap.get(fnName) != None): return fnName
+    if(mathFnMap.get(mathPrefix + fnName) != None): return mathPrefix + fnName
+    if(vmathFnMap.get(vmathPrefix + fnName) != None):
+        return vmathPrefix + fnName
+    return None
+
+# Script function creating the node or None if there isn't one
+# (e.g. wrap of vector math, since wrap is the math node function)
+def getFnName(node):
+    customName = reverseLookup(getNodeKey(node))
+    if(customName == None or customName in {'nodegrp', 'nodeip', 'nodeop'}):
+        return None
+    fnName = customName
+    for prefix in (mathPrefix, vmathPrefix):
+        if(customName.startswith(prefix)):
+            fnName = customName[len(prefix):]
+            break
+    return fnName if resolveFnName(fnName) == customName else None
+
+def getIdentifier(name):
+    name = ''.join(c if c.isalnum() else '_' for c in name.lower())
+    name = '_'.join(part for part in name.split('_') if part != '')
+    if(name == '' or not name[0].isalpha()): name = 'n_' + name
+    return name
+
+# Name of the value node created for an undeclared name or None
+def getInputName(node):
+    name = node.label
+    if(node.bl_idname != SHADER_VALUE or not name.isidentifier() or \
+        isFnName(name) or keyword.iskeyword(name)):
+        return None
+    return name
+
+def getSocketIdx(sockets, socket):
+    for i, s in enumerate(sockets):
+        if(s == socket): return i
+    return None
+
+def isVirtual(socket):
+    return getattr(socket, 'bl_idname', None) == VIRTUAL_SOCKET
+
+def getGroupOutput(nodeTree):
+    gOutput = None
+    for node in nodeTree.nodes:
+        if(node.bl_idname == GROUP_OUTPUT):
+            if(getattr(node, 'is_active_output', True)): return node
+            if(gOutput == None): gOutput = node
+    return gOutput
+
+class Decompiler:
+    # parent: decompiler of the tree containing the group ({} body),
+    # the caches, variable names and warnings are shared with it
+    def __init__(self, refDefaults, parent = None):
+        self.refDefaults = refDefaults
+        self.inBody = (parent != None)
+        self.root = parent.root if parent != None else self
+        if(parent == None):
+            self.links = {} # Tree: {input socket: (from node, from socket)}
+            self.bodies = {} # Group tree: GroupBody
+            self.positions = {} # (node key, is output): enabled indices
+            self.names = set()
+            self.warnings = {} # Ordered, message: None
+        self.items = {} # (ctx, node): DecompItem
+        self.flattened = {} # (ctx, group node): True if flattened
+        self.lines = []
+
+    def addWarning(self, message):
+        self.root.warnings[message] = None
+
+    def getLinks(self, nodeTree):
+        links = self.root.links.get(nodeTree)
+        if(links == None):
+            links = {}
+            for link in nodeTree.links:
+                if(getattr(link, 'is_muted', False) or not link.is_valid):
+                    continue
+                links[link.to_socket] = (link.from_node, link.from_socket)
+            self.root.links[nodeTree] = links
+        return links
+
+    def getItem(self, ctx, node):
+        item = self.items.get((ctx, node))
+        if(item == None):
+            item = DecompItem(node, ctx)
+            self.items[(ctx, node)] = item
+        return item
+
+    # Indices of the enabled sockets i.e. the positions in the script
+    def getPositions(self, node, isOutput):
+        sockets = node.outputs if isOutput else node.inputs
+        if(node.bl_idname == SHADER_GROUP):
+            return [i for i, s in enumerate(sockets) if not isVirtual(s)]
+        key = (getNodeKey(node), isOutput)
+        positions = self.root.positions.get(key)
+        if(positions == None):
+            positions = [i for i, s in enumerate(sockets) if s.enabled]
+            self.root.positions[key] = positions
+        return positions
+
+    # Returns (item, output index) of the node linked to the input socket,
+    # (None, value) for values taken from outside a flattened group
+    # or None if not linked. Reroutes and flattened groups are skipped
+    def getSource(self, ctx, nodeTree, socket):
+        origSocket = socket
+        while(True):
+            fromData = self.getLinks(nodeTree).get(socket)
+            if(fromData == None):
+                if(socket == origSocket): return None
+                return (None, getSocketValue(socket))
+            fromNode, fromSocket = fromData
+            if(fromNode.bl_idname == NODE_REROUTE):
+                socket = fromNode.inputs[0]
+            elif(fromNode.bl_idname == GROUP_INPUT):
+                idx = getSocketIdx(fromNode.outputs, fromSocket)
+                if(len(ctx) == 0):
+                    return (None, GroupInputRef(idx)) if self.inBody else None
+                groupNode = ctx[-1]
+                if(idx >= len(groupNode.inputs)): return None
+                ctx = ctx[:-1]
+                nodeTree = groupNode.id_data
+                socket = groupNode.inputs[idx]
+            elif(fromNode.bl_idname == SHADER_GROUP and \
+                fromNode.node_tree != None and \
+                    self.isFlattened(ctx, fromNode)):
+                idx = getSocketIdx(fromNode.outputs, fromSocket)
+                gOutput = getGroupOutput(fromNode.node_tree)
+                if(gOutput == None or idx >= len(gOutput.inputs)): return None
+                ctx = ctx + (fromNode,)
+                nodeTree = fromNode.node_tree
+                socket = gOutput.inputs[idx]
+            elif(fromNode.bl_idname in SKIPPED_NODES):
+                return None
+            else:
+                idx = getSocketIdx(fromNode.outputs, fromSocket)
+                if(fromNode.bl_idname == SHADER_GROUP and \
+                    self.getBody(fromNode.node_tree).outMap.get(idx) == None):
+                    return None # Not connected inside the group
+                return (self.getItem(ctx, fromNode), idx)
+
+    # Groups with linked inputs are flattened (inside {} all of them)
+    def isFlattened(self, ctx, groupNode):
+        key = (ctx, groupNode)
+        flattened = self.flattened.get(key)
+        if(flattened == None):
+            flattened = self.inBody or getGroupOutput(groupNode.node_tree) \
+                == None
+            for socket in groupNode.inputs:
+                if(flattened): break
+                src = self.getSource(ctx, groupNode.id_data, socket)
+                flattened = (src != None and src[0] != None)
+            self.flattened[key] = flattened
+        return flattened
+
+    def resolveInputs(self, item):
+        node = item.node
+        if(getattr(node, 'mute', False)):
+            self.addWarning(node.name + ': muted, generated unmuted')
+        if(node.bl_idname != SHADER_GROUP and getFnName(node) == None):
+            return # Replaced by a number (see getItemText)
+        for i in self.getPositions(node, False):
+            socket = node.inputs[i]
+            src = self.getSource(item.ctx, node.id_data, socket)
+            if(src == None): item.values[i] = getSocketValue(socket)
+            elif(src[0] == None): item.values[i] = src[1]
+            else:
+                item.args.append((i, src))
+                src[0].refCnt += 1
+
+    # Post order (i.e. sources first) of the items reachable from roots
+    def collect(self, roots):
+        order = []
+        stack = [(item, False) for item in reversed(roots)]
+        while(len(stack) > 0):
+            item, isDone = stack.pop()
+            if(isDone):
+                order.append(item)
+                continue
+            if(item.isVisited): continue
+            item.isVisited = True
+            self.resolveInputs(item)
+            stack.append((item, True))
+            for i, (src, idx) in reversed(item.args):
+                if(not src.isVisited): stack.append((src, False))
+        return order
+
+    def getVarName(self, node):
+        base = getIdentifier(node.label if node.label != '' else node.name)
+        name, i = base, 1
+        while(name in self.root.names or isFnName(name) or \
+            keyword.iskeyword(name)):
+            name = base + '_' + str(i)
+            i += 1
+        self.root.names.add(name)
+        return name
+
+    # Output of the source item as text e.g. n, n[1] or n[Color]
+    def getRefText(self, src):
+        item, idx = src
+        if(item.node.bl_idname == SHADER_GROUP):
+            pos = self.getBody(item.node.node_tree).outMap[idx]
+            return item.text + ('[' + str(pos) + ']' if pos > 0 else '')
+        if(idx not in item.outPositions or idx == item.outPositions[0]):
+            return item.text
+        name = item.node.outputs[idx].name.replace(' ', '')
+        names = [item.node.outputs[i].name.replace(' ', '').lower() \
+            for i in item.outPositions]
+        if(name.isidentifier() and names.count(name.lower()) == 1):
+            return item.text + '[' + name + ']'
+        return item.text + '[' + str(item.outPositions.index(idx)) + ']'
+
+    # Arguments by position, after the first gap as keyword arguments if
+    # the socket names are unique, otherwise with blanks
+    def getArgsText(self, item):
+        node = item.node
+        argTexts = {}
+        sources = {}
+        for i, src in item.args:
+            pos = item.inPositions.index(i)
+            argTexts[pos] = self.getRefText(src)
+            sources[pos] = src
+        pos = 0
+        while(pos in argTexts): pos += 1
+        order = list(range(pos))
+        texts = [argTexts[p] for p in order]
+        rest = sorted(p for p in argTexts if p > pos)
+        names = [node.inputs[i].name.replace(' ', '') \
+            for i in item.inPositions]
+        lowerNames = [name.lower() for name in names]
+        if(all(names[p].isidentifier() and \
+            lowerNames.count(names[p].lower()) == 1 for p in rest)):
+            texts += [names[p] + ' = ' + argTexts[p] for p in rest]
+            order += rest
+        elif(len(rest) > 0):
+            texts += [argTexts.get(p, '') for p in range(pos, rest[-1] + 1)]
+            order += rest
+        item.argOrder = [sources[p] for p in order]
+        return ', '.join(texts)
+
+    # Returns expression creating the node and its nesting depth
+    def getItemText(self, item):
+        node = item.node
+        depth = max([src.depth for i, (src, idx) in item.args] + [0]) + 1
+        if(node.bl_idname == SHADER_GROUP): return self.getGroupText(item)
+        fnName = getFnName(node)
+        if(fnName == None):
+            self.addWarning(node.name + ': ' + getNodeKey(node) + \
+                ' not supported, replaced by 0')
+            item.outPositions = [0]
+            return '0', 1
+        item.outPositions = self.getPositions(node, True)
+        item.inPositions = self.getPositions(node, False)
+        changed = [name for name, value in \
+            self.refDefaults.getProps(node, NODE_PROPS).items() \
+                if getattr(node, name) != value]
+        if(len(changed) > 0):
+            self.addWarning(node.name + ': ' + ', '.join(changed) + \
+                ' not supported in script')
+        refIps, refOps = self.refDefaults.get(node)
+        outValues = {i: v for i, v in \
+            ((i, getSocketValue(s)) for i, s in enumerate(node.outputs)) \
+                if v != None and (i >= len(refOps) or v != refOps[i])}
+        if(node.bl_idname == SHADER_VALUE):
+            return formatNumber(getSocketValue(node.outputs[0])), depth
+        inValues = {i: v for i, v in item.values.items() if v != None and \
+            not isinstance(v, GroupInputRef) and \
+                (i >= len(refIps) or v != refIps[i])}
+        return fnName + '(' + self.getArgsText(item) + ')' + \
+            formatDefaults(inValues, '(', ')') + \
+                formatDefaults(outValues, '[', ']'), depth
+
+    # name{...} with the values of the group inputs as $ defaults
+    def getGroupText(self, item):
+        body = self.getBody(item.node.node_tree)
+        values = {}
+        for pos, (value, sample) in enumerate(body.inputs):
+            if(isinstance(value, GroupInputRef)):
+                value = item.values.get(value.idx)
+            value = convertValue(value, sample)
+            if(value != None): values[pos] = value
+        item.outPositions = list(range(len(item.node.outputs)))
+        return body.name + '{' + ', '.join(body.texts) + '}' + \
+            formatDefaults(values, '(', ')'), 1
+
+    def getBody(self, nodeTree):
+        body = self.root.bodies.get(nodeTree)
+        if(body == None):
+            body = Decompiler(self.refDefaults, self).decompileBody(nodeTree)
+            self.root.bodies[nodeTree] = body
+        return body
+
+    # Group tree as {} body: nodes used more than once (or nested too deep)
+    # become local variables (name = ... items before the outputs), the rest
+    # is inlined in the expressions linked to the group output
+    def decompileBody(self, nodeTree):
+        gOutput = getGroupOutput(nodeTree)
+        roots, sources = [], []
+        for socket in gOutput.inputs:
+            if(isVirtual(socket)): continue
+            src = self.getSource((), nodeTree, socket)
+            if(src != None and src[0] == None):
+                self.addWarning(nodeTree.name + \
+                    ': group input linked to group output not supported')
+                src = None
+            sources.append(src)
+            if(src != None and src[0] not in roots): roots.append(src[0])
+        order = self.collect(roots)
+        rootSet = set(roots)
+        # Outputs linked to the group output and used in the group
+        linked = set(src for item in order for i, src in item.args)
+        sharedSources = set(src for src in sources if src in linked)
+        texts = []
+        localItems = set() # Items referred to by name in the body
+        defined = [] # Items of the name = ... (or name$[...]) items
+        copies = {} # Root item also used in the group: text of its copy
+        for item in order:
+            text, depth = self.getItemText(item)
+            # Value nodes created for undeclared names are local to the body
+            name = getInputName(item.node)
+            if(name != None):
+                if(name in self.root.names): name = self.getVarName(item.node)
+                else: self.root.names.add(name)
+                value = getSocketValue(item.node.outputs[0])
+                if(value != 0):
+                    texts.append(name + formatDefaults({0: value}, '[', ']'))
+                    defined.append(item)
+            elif(item.refCnt > 1 or depth > MAX_INLINE_DEPTH or \
+                (item.refCnt > 0 and item in rootSet)):
+                name = self.getVarName(item.node)
+                texts.append(name + ' = ' + text)
+                defined.append(item)
+            else:
+                item.text, item.depth = text, depth
+                continue
+            if(any(src[0] == item for src in sharedSources)):
+                # The linked output of a node isn't a group output
+                self.addWarning(nodeTree.name + ': ' + item.node.name + \
+                    ' is duplicated (used in the group and as its output)')
+                copies[item] = text
+            item.text, item.depth = name, 1
+            localItems.add(item)
+
+        # Group sockets in the order created by BraceEvaluator: unlinked
+        # outputs, then unlinked inputs of the nodes in script order
+        # (first use of each node, a copy is a separate node)
+        definedSet = set(defined)
+        entries = []
+        visited = set()
+        stack = list(reversed([(item, False) for item in defined] + \
+            [(item, item in copies) for item in roots]))
+        while(len(stack) > 0):
+            entry = stack.pop()
+            if(entry in visited): continue
+            visited.add(entry)
+            entries.append(entry)
+            for src, idx in reversed(entry[0].argOrder):
+                if(src not in definedSet): stack.append((src, False))
+        outPositions = {}
+        outCnt = 0
+        for item, isCopy in entries:
+            for i in item.outPositions:
+                if(not isCopy and (item, i) in linked): continue
+                if(item in rootSet): outPositions.setdefault((item, i), outCnt)
+                outCnt += 1
+        outMap = {}
+        for idx, src in enumerate(sources):
+            if(src != None and outPositions.get(src) != None):
+                outMap[idx] = outPositions[src]
+        inputs = []
+        for item, isCopy in entries:
+            linkedInputs = set(i for i, src in item.args)
+            for i in item.inPositions:
+                if(i not in linkedInputs):
+                    inputs.append((item.values.get(i), \
+                        getSocketValue(item.node.inputs[i])))
+        texts += [copies.get(item, item.text) for item in roots \
+            if item in copies or item not in definedSet]
+        return GroupBody(getIdentifier(nodeTree.name), texts, outMap, inputs)
+
+    def decompile(self, nodeTree):
+        consumed = set(fromNode for fromNode, fromSocket in \
+            self.getLinks(nodeTree).values())
+        candidates = [node for node in nodeTree.nodes \
+            if node.bl_idname not in SKIPPED_NODES and \
+                not (node.bl_idname == SHADER_GROUP and \
+                    (node.node_tree == None or self.isFlattened((), node)))]
+        # Nodes used only by unused reroutes etc. are taken in second pass
+        order = []
+        for roots in ([n for n in candidates if n not in consumed], \
+            candidates):
+            roots = [self.getItem((), n) for n in roots \
+                if not self.getItem((), n).isVisited]
+            order += self.collect(roots)
+        # Value nodes created for undeclared names (e.g. x) keep the names
+        # (with a suffix if already used e.g. by a {} body)
+        inputNames = {}
+        for item in order:
+            if(getInputName(item.node) != None):
+                inputNames[item] = self.getVarName(item.node)
+        for item in order: # Consumers are known for all the items now
+            name = inputNames.get(item)
+            if(name != None):
+                value = getSocketValue(item.node.outputs[0])
+                self.lines.append(name + (formatDefaults({0: value}, '[', \
+                    ']') if value != 0 else ''))
+                item.text = name
+                continue
+            text, depth = self.getItemText(item)
+            if(item.refCnt == 0):
+                self.lines.append(text)
+            elif(item.refCnt > 1 or depth > MAX_INLINE_DEPTH):
+                item.text = self.getVarName(item.node)
+                self.lines.append(item.text + ' = ' + text)
+            else:
+                item.text, item.depth = text, depth
+        return self.lines
+
+# Returns (script lines, warnings) for a material or group tree
+def decompileTree(nodeTree):
+    refDefaults = ReferenceDefaults(nodeTree)
+    try:
+        decompiler = Decompiler(refDefaults)
+        if(getGroupOutput(nodeTree) == None):
+            lines = decompiler.decompile(nodeTree)
+        else:
+            body = decompiler.getBody(nodeTree)
+            values = {}
+            for pos, (value, sample) in enumerate(body.inputs):
+                if(isinstance(value, GroupInputRef)):
+                    value = getSocketValue(nodeTree.inputs[value.idx])
+                value = convertValue(value, sample)
+                if(value != None): values[pos] = value
+            lines = [body.name + '{' + ', '.join(body.texts) + '}' + \
+                formatDefaults(values, '(', ')')]
+        return lines, list(decompiler.warnings)
+    finally:
+        refDefaults.cleanup()
+
+# Script text with the warnings as comments at the top
+def getScript(lines, warnings):
+    return ''.join('# ' + w + '\n' for w in warnings) + \
+        ''.join(line + '\n' for line in lines)
+
+def dumps(nodeTree):
+    return getScript(*decompileTree(nodeTree))
@@ -7,32 +7,55 @@
 # License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
 #
 
-import bpy, traceback
-from mathutils import Vector
+import traceback
+try:
+    import bpy
+    from mathutils import Vector
+except ImportError: # Outside Blender, only in-memory trees (see nodemodel)
+    bpy = None
+    from .nodemodel import Vector
 
 from .lookups import fnMap, mathFnMap, vmathFnMap, mathPrefix, vmathPrefix
 from .lookups import reverseLookup
 from .lookups import SHADER_GROUP, SHADER_MATH, SHADER_VMATH, SHADER_VALUE
+from .lookups import SHADER_SCRIPT, SCRIPT_DIMENSIONS
+from .sockindex import getSocketIndex
+
+# Variables by name: [node, output index, usage count]. The body of each
+# group has its own table (its parameters and variables) with the table of
+# the enclosing tree as parent
+class VarTable(dict):
+    def __init__(self, parent = None):
+        super(VarTable, self).__init__()
+        self.parent = parent
+
+    # Entry of the name in this or the enclosing tables, None if not defined
+    def lookup(self, name):
+        varTable = self
+        while(varTable != None):
+            varInfo = dict.get(varTable, name)
+            if(varInfo != None): return varInfo
+            varTable = varTable.parent
+        return None
 
 class EvaluatorBase:
 
 ###################### Helpers ###############################
+    # Token: evaluator (stateless, shared by the symbols), filled by the
+    # registry module (see registerOperator)
+    evaluators = {}
+
+    @staticmethod
+    def registerEvaluator(id, evaluator):
+        EvaluatorBase.evaluators[id] = evaluator
+
+    @staticmethod
+    def unregisterEvaluator(id):
+        EvaluatorBase.evaluators.pop(id, None)
+
     @staticmethod
     def getEvaluator(id):
-        if(id == '='):      return EqualsEvaluator()
-        elif(id == '+'):        return PlusEvaluator()
-        elif(id == '-'):        return MinusEvaluator()
-        elif(id == '*'):        return MultiplyEvaluator()
-        elif(id == '**'):       return PowerEvaluator()
-        elif(id == '/'):        return DivisionEvaluator()
-        elif(id == '%'):        return ModuloEvaluator()
-        elif(id == '('):        return ParenthesisEvaluator()
-        elif(id == '$'):        return DollarEvaluator()
-        # elif(id == '['):      return BracketSymbol()  # Taken care in parser
-        elif(id == '{'):        return BraceEvaluator()
-        elif(id == 'NAME'):         return VariableEvaluator()
-        elif(id == 'NUMBER'):       return NumberEvaluator()
-        return None
+        return EvaluatorBase.evaluators.get(id)
 
     @staticmethod
     def getNodeDimensions(node, actual = False):
@@ -42,12 +65,14 @@ class EvaluatorBase:
             else: return 1
         if(node.bl_idname in {SHADER_MATH, SHADER_VMATH}): lookupKey = node.bl_idname + '_' + node.operation
         else: lookupKey = node.bl_idname
-        customName = reverseLookup(lookupKey)
-        if(customName.startswith(mathPrefix)): fnInfo = mathFnMap.get(customName)
-        elif(customName.startswith(vmathPrefix)): fnInfo = vmathFnMap.get(customName)
-        else: fnInfo = fnMap.get(customName)
-        dimensions = fnInfo[5]
-        if(node.bl_idname == SHADER_GROUP):
+        if(node.bl_idname == SHADER_SCRIPT): dimensions = SCRIPT_DIMENSIONS
+        else:
+            customName = reverseLookup(lookupKey)
+            if(customName.startswith(mathPrefix)): fnInfo = mathFnMap.get(customName)
+            elif(customName.startswith(vmathPrefix)): fnInfo = vmathFnMap.get(customName)
+            else: fnInfo = fnMap.get(customName)
+            dimensions = fnInfo[5]
+        if(node.bl_idname in {SHADER_GROUP, SHADER_SCRIPT}):
             socketHeight = 22
             opCnts = sum([getCntForType(o) for o in node.outputs if o.enabled == True and o.hide == False])
             ipCnt = sum([getCntForType(i) for i in node.inputs if i.enabled == True and i.hide == False])
@@ -62,14 +87,68 @@ class EvaluatorBase:
         if(name != None): node.name = name
         return node
 
+    # In-memory trees carry their own group collection (bpy.data.node_groups)
+    @staticmethod
+    def getNodeGroups(nodeTree):
+        nodeGroups = getattr(nodeTree, 'nodeGroups', None)
+        return nodeGroups if nodeGroups != None else bpy.data.node_groups
+
+    # Number or vector literal of numbers (e.g. (1, 2, 3)) as socket value
+    @staticmethod
+    def getLiteralValue(data):
+        if(data.getMetaData().id == 'NUMBER'): return float(data.value)
+        return tuple(float(op.value) for op in data.operand1)
+
+    # Sets the literal value to the input socket, False if the socket has no
+    # numeric value (e.g. shader) or a vector is given for a single value
     @staticmethod
-    def getPrimitiveMathNode(nodeTree, operation, label, op0, op1):
-        node = EvaluatorBase.getNode(nodeTree, SHADER_MATH, label)
+    def setLiteralValue(socket, value):
+        default = getattr(socket, 'default_value', None)
+        if(isinstance(default, float)):
+            if(isinstance(value, tuple)): return False
+            socket.default_value = value
+            return True
+        if(default == None or isinstance(default, (str, int)) or \
+            len(default) < 3):
+            return False
+        if(not isinstance(value, tuple)): value = (value,) * 3
+        socket.default_value = value + (1.0,) * (len(default) - 3) # Alpha
+        return True
+
+    # Value or Combine XYZ node with the literal value
+    @staticmethod
+    def getLiteralNode(nodeTree, value):
+        if(not isinstance(value, tuple)):
+            return EvaluatorBase.getNode(nodeTree, SHADER_VALUE, value = value)
+        fnInfo = fnMap['comxyz']
+        node = EvaluatorBase.getNode(nodeTree, fnInfo[1], fnInfo[2])
+        for i, v in enumerate(value): node.inputs[i].default_value = v
+        return node
+
+    @staticmethod
+    def getPrimitiveMathNode(nodeTree, operation, label, op0, op1, \
+        nodeType = SHADER_MATH):
+        node = EvaluatorBase.getNode(nodeTree, nodeType, label)
         node.operation = operation
         nodeTree.links.new(op0, node.inputs[0])
         nodeTree.links.new(op1, node.inputs[1])
         return node
 
+    # Node for infix operator based on the inferred type (see typeinfer)
+    @staticmethod
+    def getOperatorNode(nodeTree, paramBus, operation, label):
+        sockType = paramBus.data.sockType
+        if(sockType == 'SHADER'): # Only + is allowed
+            fnInfo = fnMap['addshad']
+            node = EvaluatorBase.getNode(nodeTree, fnInfo[1], fnInfo[2])
+        else:
+            node = EvaluatorBase.getNode(nodeTree, SHADER_VMATH \
+                if sockType == 'VECTOR' else SHADER_MATH, label)
+            node.operation = operation
+        paramBus.linkOperand(nodeTree, paramBus.operand0, node.inputs[0])
+        paramBus.linkOperand(nodeTree, paramBus.operands1[0], node.inputs[1])
+        return node
+
     def __init__(self):
         pass
 
@@ -101,12 +180,12 @@ class VariableEvaluator(EvaluatorBase):
             node.operation = nodeInfo[1]
         else:
             if(data.isLHS): return None # LHS is handled in evalEquals
-            varTableInfo = varTable.get(varName)
+            varTableInfo = varTable.lookup(varName)
             if(varTableInfo != None):
                 node, sockIdx, usageCnt = varTableInfo
                 if(nodeTree != node.id_data): raise SyntaxError('Groups cannot contain variables')
                 if(sockIdx != None): paramBus.data.sockIdx = sockIdx
-                varTable[varName][2] += 1
+                varTableInfo[2] += 1
             else:
                 node = EvaluatorBase.getNode(nodeTree, SHADER_VALUE, data.value, 0, data.value)
                 varTable[varName] = [node, 0, 0]
@@ -136,29 +215,38 @@ class EqualsEvaluator(EvaluatorBase):
         nodeTree.links.new(ip, op)
         return rhsNodes[0]
 
-class PlusEvaluator(EvaluatorBase):
-    def evaluate(self, nodeTree, group_node, paramBus, varTable):
-        return EvaluatorBase.getPrimitiveMathNode(nodeTree, 'ADD', 'Add', paramBus.getDefLHSOutput(), paramBus.getDefRHSOutput())
-
-class MinusEvaluator(EvaluatorBase):
-    def evaluate(self, nodeTree, group_node, paramBus, varTable):
-        return EvaluatorBase.getPrimitiveMathNode(nodeTree, 'SUBTRACT', 'Subtract', paramBus.getDefLHSOutput(), paramBus.getDefRHSOutput())
+# Infix operator, the node is selected by the inferred type (see
+# getOperatorNode)
+class OperatorEvaluator(EvaluatorBase):
+    def __init__(self, operation, label):
+        self.operation = operation
+        self.label = label
 
-class MultiplyEvaluator(EvaluatorBase):
     def evaluate(self, nodeTree, group_node, paramBus, varTable):
-        return EvaluatorBase.getPrimitiveMathNode(nodeTree, 'MULTIPLY', 'Multiply', paramBus.getDefLHSOutput(), paramBus.getDefRHSOutput())
+        return EvaluatorBase.getOperatorNode(nodeTree, paramBus, \
+            self.operation, self.label)
 
-class DivisionEvaluator(EvaluatorBase):
+# Also the prefix minus of expressions (numbers are negated by the parser)
+class MinusEvaluator(OperatorEvaluator):
     def evaluate(self, nodeTree, group_node, paramBus, varTable):
-        return EvaluatorBase.getPrimitiveMathNode(nodeTree, 'DIVIDE', 'Divide', paramBus.getDefLHSOutput(), paramBus.getDefRHSOutput())
-
-class ModuloEvaluator(EvaluatorBase):
-    def evaluate(self, nodeTree, group_node, paramBus, varTable):
-        return EvaluatorBase.getPrimitiveMathNode(nodeTree, 'MODULO', 'Modulo', paramBus.getDefLHSOutput(), paramBus.getDefRHSOutput())
+        if(paramBus.operands1 != None):
+            return super(MinusEvaluator, self).evaluate(nodeTree, \
+                group_node, paramBus, varTable)
+        isVector = (paramBus.data.sockType == 'VECTOR')
+        node = EvaluatorBase.getNode(nodeTree, \
+            SHADER_VMATH if isVector else SHADER_MATH, 'Negate')
+        node.operation = 'MULTIPLY'
+        paramBus.linkOperand(nodeTree, paramBus.operand0, node.inputs[0])
+        node.inputs[1].default_value = (-1, -1, -1) if isVector else -1
+        return node
 
-class PowerEvaluator(EvaluatorBase):
+# Equality, without tolerance (Epsilon 0)
+class CompareEvaluator(OperatorEvaluator):
     def evaluate(self, nodeTree, group_node, paramBus, varTable):
-        return EvaluatorBase.getPrimitiveMathNode(nodeTree, 'POWER', 'Power', paramBus.getDefLHSOutput(), paramBus.getDefRHSOutput())
+        node = super(CompareEvaluator, self).evaluate(nodeTree, \
+            group_node, paramBus, varTable)
+        node.inputs[2].default_value = 0
+        return node
 
 class DollarEvaluator(EvaluatorBase):
     def evaluate(self, nodeTree, group_node, paramBus, varTable):
@@ -188,8 +276,34 @@ class DollarEvaluator(EvaluatorBase):
         else: assert(False) # Should never happen
         return node
 
+# Components of vector literal e.g. (1, x, 0) and the swizzles e.g. v.x
+VECTOR_COMPONENTS = {'x': 0, 'y': 1, 'z': 2}
+COLOR_COMPONENTS = {'r': 0, 'g': 1, 'b': 2}
+
 class ParenthesisEvaluator(EvaluatorBase):
+    # Vector literal of numbers only needs no value nodes (numbers are
+    # inlined outside groups, see XNodifyContext.setVectorLiterals)
+    def beforeOperand1(self, nodeTree, paramBus):
+        if(paramBus.operand0 == None and all(op.isInlined \
+            for op in paramBus.operands1)):
+            paramBus.skipOperands1 = True
+        return nodeTree, None
+
+    # Combine XYZ with the numbers as values and the other components linked
+    def getVectorNode(self, nodeTree, paramBus):
+        if(paramBus.skipOperands1):
+            return EvaluatorBase.getLiteralNode(nodeTree, \
+                EvaluatorBase.getLiteralValue(paramBus.data))
+        fnInfo = fnMap['comxyz']
+        node = EvaluatorBase.getNode(nodeTree, fnInfo[1], fnInfo[2])
+        for i, op in enumerate(paramBus.operands1):
+            paramBus.linkOperand(nodeTree, op, node.inputs[i])
+        return node
+
     def evaluate(self, nodeTree, group_node, paramBus, varTable):
+        if(paramBus.data.isGroup): return None # Parameters of the group
+        if(paramBus.operand0 == None):
+            return self.getVectorNode(nodeTree, paramBus)
         node = customName = None
         fnName = paramBus.operand0.value
         fn = fnMap.get(fnName)
@@ -209,40 +323,143 @@ class ParenthesisEvaluator(EvaluatorBase):
                     node.operation = fn[1]
                     customName = vmathPrefix + fnName
         if(node != None):
-            outputs = paramBus.getRHSOutputs()
-            inputs = [ip for ip in node.inputs if ip.enabled == True]
-            for i in range(min(len(outputs), len(inputs))):
-                if(inputs[i] != None and outputs[i] != None):
-                    nodeTree.links.new(outputs[i], inputs[i])
+            sockIndex = getSocketIndex(node, out = False)
+            for i, op in enumerate(paramBus.operands1):
+                if(op == None or (not op.isInlined and \
+                    paramBus.getNodeSocket(op) == None)):
+                    continue
+                if(op.argName != None): # Keyword argument
+                    idx = sockIndex.getNameIdx(op.argName)
+                    if(idx == None):
+                        raise SyntaxError('Unknown input: ' + op.argName + \
+                            ' (' + fnName + ')')
+                else:
+                    idx = sockIndex.getPosIdx(i)
+                if(idx != None):
+                    paramBus.linkOperand(nodeTree, op, node.inputs[idx])
             return node
         raise SyntaxError('Unknown Function: '+ paramBus.operand0.value)
 
+# Component of vector (x, y, z) or color (r, g, b) e.g. v.x; all the
+# components of the same socket share the Separate XYZ / RGB node, found
+# from the links of the socket (so also across lines)
+class SwizzleEvaluator(EvaluatorBase):
+    def evaluate(self, nodeTree, group_node, paramBus, varTable):
+        component = paramBus.data.value
+        fnInfo = fnMap['sepxyz' if component in VECTOR_COMPONENTS \
+            else 'seprgb']
+        idx = VECTOR_COMPONENTS.get(component, \
+            COLOR_COMPONENTS.get(component))
+        if(idx == None): raise SyntaxError('Unknown component: ' + component)
+        source = paramBus.getDefLHSOutput()
+        node = None
+        for link in source.links:
+            if(link.to_node.bl_idname == fnInfo[1]):
+                node = link.to_node
+                break
+        if(node == None):
+            node = EvaluatorBase.getNode(nodeTree, fnInfo[1], fnInfo[2])
+            nodeTree.links.new(source, node.inputs[0])
+        paramBus.data.sockIdx = idx
+        return node
+
+# Custom property with the structural hash of the group body
+GROUP_HASH_PROP = 'xn_hash'
+GROUP_INPUT = 'NodeGroupInput'
+GROUP_OUTPUT = 'NodeGroupOutput'
+
+# Group input socket of the parameters by inferred type (see typeinfer)
+PARAM_SOCKET_TYPES = {'VECTOR': 'NodeSocketVector', \
+    'RGBA': 'NodeSocketColor', 'SHADER': 'NodeSocketShader'}
+DEFAULT_PARAM_SOCKET = 'NodeSocketFloat'
+
 class BraceEvaluator(EvaluatorBase):
 
+    # Group tree created earlier (in this or earlier runs) for the same body
+    @staticmethod
+    def getHashedGroup(nodeGroups, groupHash):
+        if(groupHash == None): return None
+        for gNodeTree in nodeGroups:
+            if(gNodeTree.get(GROUP_HASH_PROP) == groupHash):
+                return gNodeTree
+        return None
+
+    # Groups created by XNodify that are not used any more, e.g. left by
+    # earlier runs or by runs with errors
+    @staticmethod
+    def removeOrphanGroups(nodeTree):
+        nodeGroups = EvaluatorBase.getNodeGroups(nodeTree)
+        orphans = [g for g in nodeGroups \
+            if g.get(GROUP_HASH_PROP) != None and g.users == 0]
+        # Removing a group can orphan the groups nested in it
+        while(len(orphans) > 0):
+            for gNodeTree in orphans: nodeGroups.remove(gNodeTree)
+            orphans = [g for g in nodeGroups \
+                if g.get(GROUP_HASH_PROP) != None and g.users == 0]
+
+    # Explicit parameters e.g. a, b of grp(a, b){...} (arguments of the call
+    # before {, evaluated in the enclosing tree), empty list if none
+    @staticmethod
+    def getParams(data):
+        if(data.operand0 == None or data.operand0.getMetaData().id != '('):
+            return []
+        return data.operand0.operand1
+
+    # Name of the parameter in the body, k for keyword argument k = expr
+    @staticmethod
+    def getParamName(param):
+        return param.argName if param.argName != None else param.value
+
     def beforeOperand1(self, nodeTree, paramBus):
+        params = BraceEvaluator.getParams(paramBus.data)
         if(paramBus.operand0 == None): groupName = 'XNGroup'
+        elif(paramBus.operand0.getMetaData().id == '('):
+            groupName = paramBus.operand0.operand0.value
         else: groupName = paramBus.operand0.value
         group = nodeTree.nodes.new(SHADER_GROUP)
         group.name = groupName
-        gNodeTree = bpy.data.node_groups.new(groupName, 'ShaderNodeTree')
+        nodeGroups = EvaluatorBase.getNodeGroups(nodeTree)
+        groupHash = paramBus.data.groupHash
+        gNodeTree = BraceEvaluator.getHashedGroup(nodeGroups, groupHash)
+        paramBus.groupNode = group # Temporarily created will be used below
+        if(gNodeTree != None): # Identical group, body need not be evaluated
+            group.node_tree = gNodeTree
+            paramBus.skipOperands1 = True
+            return gNodeTree, group
+        gNodeTree = nodeGroups.new(groupName, 'ShaderNodeTree')
+        if(groupHash != None): gNodeTree[GROUP_HASH_PROP] = groupHash
         group.node_tree = gNodeTree
-        gNodeTree.nodes.new('NodeGroupOutput')
+        gNodeTree.nodes.new(GROUP_OUTPUT)
         gNodeTree.nodes[-1].name = gNodeTree.nodes[-1].label = 'Group Output'
-        gNodeTree.nodes.new('NodeGroupInput')
+        gNodeTree.nodes.new(GROUP_INPUT)
         gNodeTree.nodes[-1].name = gNodeTree.nodes[-1].label = 'Group Input'
-        paramBus.groupNode = group # Temporarily created will be used below
+        # The body has its own variables, parameters are the first inputs
+        paramBus.varTable = VarTable(paramBus.varTable)
+        for i, param in enumerate(params):
+            gNodeTree.inputs.new(PARAM_SOCKET_TYPES.get(param.sockType, \
+                DEFAULT_PARAM_SOCKET), BraceEvaluator.getParamName(param))
+            paramBus.varTable[BraceEvaluator.getParamName(param)] = \
+                [gNodeTree.nodes[1], i, 0]
         return gNodeTree, group
 
+    def linkParams(self, paramBus):
+        group = paramBus.groupNode
+        for i, param in enumerate(BraceEvaluator.getParams(paramBus.data)):
+            paramBus.linkOperand(group.id_data, param, group.inputs[i])
+
     def evaluate(self, tree, group_node, paramBus, varTable):
+        self.linkParams(paramBus)
+        if(paramBus.skipOperands1): return paramBus.groupNode
         nodes = tree.nodes
         links = tree.links
         gOutput = nodes[0]
         gInput = nodes[1]
-        childNodes = set()
+        childNodes = {} # Ordered, so that the group sockets are in script order
         for op in paramBus.operands1:
             childOps = []
             op.getLinearList(childOps)
-            childNodes = childNodes.union([o.node for o in childOps if o != None and o.node != None])
+            childNodes.update((o.node, None) for o in childOps if o != None \
+                and o.node != None and o.node.bl_idname != GROUP_INPUT)
         for node in childNodes:
             outputs = [o for o in node.outputs if o.enabled == True and o.hide == False]
             for op in outputs:
@@ -0,0 +1,90 @@
+#
+# Generates the socket schema file (see schema.py) of the running Blender.
+# Run from the add-on folder:
+#   blender -b --factory-startup --python extractschema.py [-- output file]
+# Default output: schemas/blender_<major>_<minor>.json
+# Node sizes can't be read in background mode, so they are taken from lookups
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import bpy, json, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import lookups
+from lookups import fnMap, mathFnMap, vmathFnMap, SHADER_MATH, SHADER_VMATH
+
+FORMAT_VERSION = 1
+TYPE_CODES = {'VALUE': 'F', 'INT': 'I', 'VECTOR': 'V', 'RGBA': 'C', \
+    'SHADER': 'S', 'STRING': 'T'}
+TYPE_DEFAULTS = {'F': 0.0, 'I': 0, 'V': [0.0, 0.0, 0.0], \
+    'C': [0.0, 0.0, 0.0, 1.0], 'T': ''}
+SKIPPED = {'nodegrp', 'nodeip', 'nodeop'} # Sockets from the group interface
+
+def getDefault(socket):
+    value = getattr(socket, 'default_value', None)
+    if(value == None or isinstance(value, str)): return value
+    try: return [round(v, 6) for v in value]
+    except TypeError: return round(value, 6)
+
+def getSocketData(socket, isOutput):
+    typeCode = TYPE_CODES.get(socket.type, 'F')
+    default = getDefault(socket)
+    data = [socket.name, typeCode]
+    # Output defaults and enabled flags only when they are not the usual
+    if(not isOutput or default != TYPE_DEFAULTS.get(typeCode) or \
+        not socket.enabled):
+        data.append(default)
+    if(not socket.enabled): data.append(0)
+    return data
+
+def getNodeData(nodeTree, bl_idname, size, opMap = None):
+    node = nodeTree.nodes.new(bl_idname)
+    data = {'in': [getSocketData(s, False) for s in node.inputs], \
+        'out': [getSocketData(s, True) for s in node.outputs], \
+            'size': list(size)}
+    if(opMap != None):
+        ops = {}
+        for fnInfo in opMap.values():
+            node.operation = fnInfo[1]
+            ops[fnInfo[1]] = {'size': list(fnInfo[5]), \
+                'in': [i for i, s in enumerate(node.inputs) if s.enabled], \
+                    'out': [i for i, s in enumerate(node.outputs) if s.enabled]}
+        data['ops'] = ops
+    nodeTree.nodes.remove(node)
+    return data
+
+def dumps(nodes):
+    version = list(bpy.app.version[:2])
+    items = ',\n'.join('  ' + json.dumps(key) + ': ' + \
+        json.dumps(nodes[key], sort_keys = True) for key in sorted(nodes))
+    return '{\n "blender": ' + json.dumps(version) + ',\n "format": ' + \
+        str(FORMAT_VERSION) + ',\n "nodes": {\n' + items + '\n }\n}\n'
+
+def main():
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    if(len(args) > 0): outPath = args[0]
+    else:
+        outPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+            'schemas', 'blender_%d_%d.json' % bpy.app.version[:2])
+
+    nodeTree = bpy.data.node_groups.new('.XNSchema', 'ShaderNodeTree')
+    try:
+        nodes = {}
+        for customName, fnInfo in fnMap.items():
+            if(customName not in SKIPPED):
+                nodes[fnInfo[1]] = getNodeData(nodeTree, fnInfo[1], fnInfo[5])
+        nodes[SHADER_MATH] = getNodeData(nodeTree, SHADER_MATH, \
+            mathFnMap[lookups.MATH_ADD][5], mathFnMap)
+        nodes[SHADER_VMATH] = getNodeData(nodeTree, SHADER_VMATH, \
+            vmathFnMap['vmath_vadd'][5], vmathFnMap)
+    finally:
+        bpy.data.node_groups.remove(nodeTree)
+
+    with open(outPath, 'w') as f:
+        f.write(dumps(nodes))
+    print('Schema of %d nodes written to %s' % (len(nodes), outPath))
+
+main()
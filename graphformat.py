@@ -0,0 +1,265 @@
+#
+# Serialization of the node graphs generated by XNodify.
+# Works with bpy as well as in-memory (nodemodel) node trees.
+#
+# Format (version 1), a JSON object with:
+#   version: FORMAT_VERSION
+#   tree: the material (top level) tree
+#   groups: {group name: tree} for all the (nested) group trees
+# Each tree has:
+#   nodes: list of {'id': bl_idname[_operation], 'name', 'label', 'loc',
+#       'parent': index of frame, 'hide', 'in' / 'out': {socket index:
+#       non-default value}, 'tree': group name, 'props': xn_* properties
+#       e.g. the OSL source of Script nodes (see oslgen)}
+#       (keys with default values are omitted)
+#   links: list of [from node, from socket, to node, to socket] indices
+#   inputs / outputs: group interface as list of [bl_idname, name]
+# One node or link per line, so that the files diff well
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import json
+
+from .lookups import SHADER_GROUP, SHADER_MATH, SHADER_VMATH, SHADER_SCRIPT
+from .evaluator import EvaluatorBase
+from .oslgen import setScript, OSL_SOURCE_PROP
+
+FORMAT_VERSION = 1
+GRAPH_EXT = '.xng.json'
+PROP_PREFIX = 'xn_'
+VALUE_PRECISION = 6
+
+def getNodeKey(node):
+    if(node.bl_idname in {SHADER_MATH, SHADER_VMATH}):
+        return node.bl_idname + '_' + node.operation
+    return node.bl_idname
+
+def splitNodeKey(key):
+    if(key.startswith(SHADER_MATH + '_') or key.startswith(SHADER_VMATH + '_')):
+        return key.split('_', 1)
+    return key, None
+
+def getSocketValue(socket):
+    try: value = socket.default_value
+    except AttributeError: return None
+    try: return [round(v, VALUE_PRECISION) for v in value]
+    except TypeError:
+        try: return round(value, VALUE_PRECISION)
+        except TypeError: return None # Non-numeric (e.g. string) value
+
+def setSocketValue(socket, value):
+    try:
+        if(isinstance(value, list)):
+            for i, v in enumerate(value): socket.default_value[i] = v
+        else: socket.default_value = value
+    except (AttributeError, TypeError, IndexError): pass
+
+# Default socket values of freshly created nodes, to skip them in output
+class ReferenceDefaults:
+    def __init__(self, nodeTree):
+        self.nodeGroups = EvaluatorBase.getNodeGroups(nodeTree)
+        self.probeTree = None
+        self.cache = {}
+        self.propCache = {}
+
+    def newProbe(self, node):
+        if(self.probeTree == None):
+            self.probeTree = self.nodeGroups.new('.XNProbe', 'ShaderNodeTree')
+        probe = self.probeTree.nodes.new(node.bl_idname)
+        if(node.bl_idname in {SHADER_MATH, SHADER_VMATH}):
+            probe.operation = node.operation
+        return probe
+
+    def get(self, node):
+        key = getNodeKey(node)
+        defaults = self.cache.get(key)
+        if(defaults == None):
+            if(node.bl_idname == SHADER_GROUP): # Depends on interface
+                return [None] * len(node.inputs), [None] * len(node.outputs)
+            probe = self.newProbe(node)
+            defaults = ([getSocketValue(s) for s in probe.inputs], \
+                [getSocketValue(s) for s in probe.outputs])
+            self.probeTree.nodes.remove(probe)
+            self.cache[key] = defaults
+        return defaults
+
+    # {name: default value} of the node properties (e.g. blend_type) with
+    # the names, for the ones the node has
+    def getProps(self, node, names):
+        key = getNodeKey(node)
+        props = self.propCache.get(key)
+        if(props == None):
+            probe = self.newProbe(node)
+            props = {name: getattr(probe, name) for name in names \
+                if hasattr(probe, name)}
+            self.probeTree.nodes.remove(probe)
+            self.propCache[key] = props
+        return props
+
+    def cleanup(self):
+        if(self.probeTree != None):
+            self.nodeGroups.remove(self.probeTree)
+            self.probeTree = None
+
+def getProps(idData):
+    try: return {k: idData[k] for k in idData.keys() \
+        if k.startswith(PROP_PREFIX)}
+    except (AttributeError, TypeError): return {}
+
+def dumpTree(nodeTree, refDefaults):
+    nodes = list(nodeTree.nodes)
+    nodeIdxs = {node: i for i, node in enumerate(nodes)}
+    nodeDatas = []
+    for node in nodes:
+        nodeData = {'id': getNodeKey(node), 'name': node.name, \
+            'loc': [round(v, 2) for v in node.location]}
+        if(node.label != ''): nodeData['label'] = node.label
+        if(node.parent != None): nodeData['parent'] = nodeIdxs[node.parent]
+        if(node.hide): nodeData['hide'] = 1
+        if(node.bl_idname == SHADER_GROUP and node.node_tree != None):
+            nodeData['tree'] = node.node_tree.name
+        refIps, refOps = refDefaults.get(node)
+        for key, sockets, refVals in (('in', node.inputs, refIps), \
+            ('out', node.outputs, refOps)):
+            values = {}
+            for i, socket in enumerate(sockets):
+                if(socket.is_output or len(socket.links) == 0):
+                    value = getSocketValue(socket)
+                    if(value != None and (i >= len(refVals) or \
+                        value != refVals[i])):
+                        values[str(i)] = value
+            if(len(values) > 0): nodeData[key] = values
+        props = getProps(node)
+        if(len(props) > 0): nodeData['props'] = props
+        nodeDatas.append(nodeData)
+
+    links = []
+    for link in nodeTree.links:
+        fromNode, toNode = link.from_node, link.to_node
+        links.append([nodeIdxs[fromNode], \
+            list(fromNode.outputs).index(link.from_socket), \
+                nodeIdxs[toNode], list(toNode.inputs).index(link.to_socket)])
+    treeData = {'nodes': nodeDatas, 'links': links}
+    if(len(nodeTree.inputs) > 0 or len(nodeTree.outputs) > 0):
+        treeData['inputs'] = [[s.bl_idname, s.name] for s in nodeTree.inputs]
+        treeData['outputs'] = [[s.bl_idname, s.name] for s in nodeTree.outputs]
+    props = getProps(nodeTree)
+    if(len(props) > 0): treeData['props'] = props
+    return treeData
+
+def dumpGraph(nodeTree):
+    refDefaults = ReferenceDefaults(nodeTree)
+    try:
+        groups = {}
+        pending = [nodeTree]
+        while(len(pending) > 0):
+            tree = pending.pop()
+            for node in tree.nodes:
+                gTree = getattr(node, 'node_tree', None)
+                if(gTree != None and gTree.name not in groups):
+                    groups[gTree.name] = None # Placeholder, avoids cycles
+                    pending.append(gTree)
+            if(tree != nodeTree): groups[tree.name] = dumpTree(tree, refDefaults)
+        return {'version': FORMAT_VERSION, \
+            'tree': dumpTree(nodeTree, refDefaults), 'groups': groups}
+    finally:
+        refDefaults.cleanup()
+
+def dumpsTree(treeData, indent):
+    pad = ' ' * indent
+    lines = []
+    for key in sorted(treeData.keys()):
+        value = treeData[key]
+        if(key in {'nodes', 'links'} and len(value) > 0):
+            items = (',\n' + pad + '  ').join(json.dumps(v, sort_keys = True) \
+                for v in value)
+            lines.append(pad + ' "' + key + '": [\n' + pad + '  ' + \
+                items + '\n' + pad + ' ]')
+        else:
+            lines.append(pad + ' "' + key + '": ' + \
+                json.dumps(value, sort_keys = True))
+    return '{\n' + ',\n'.join(lines) + '\n' + pad + '}'
+
+def dumps(nodeTree):
+    graph = dumpGraph(nodeTree)
+    groups = ',\n'.join('  ' + json.dumps(name) + ': ' + \
+        dumpsTree(graph['groups'][name], 2) for name in sorted(graph['groups']))
+    return '{\n"version": ' + str(graph['version']) + ',\n"tree": ' + \
+        dumpsTree(graph['tree'], 0) + ',\n"groups": {' + \
+            ('\n' + groups + '\n' if groups != '' else '') + '}\n}\n'
+
+# Group tree of the graph, loaded on first use
+def getGroupTree(groupName, graph, nodeGroups, loadedGroups):
+    gTree = loadedGroups.get(groupName)
+    if(gTree == None):
+        gTree = nodeGroups.new(groupName, 'ShaderNodeTree')
+        loadedGroups[groupName] = gTree
+        loadTree(graph['groups'][groupName], gTree, graph, nodeGroups, \
+            loadedGroups)
+    return gTree
+
+# Materializes the tree data into nodeTree; group trees are created on first
+# reference (via loadedGroups) so that their interface exists before the
+# group nodes are added
+def loadTree(treeData, nodeTree, graph, nodeGroups, loadedGroups, \
+    offset = None):
+    for bl_idname, name in treeData.get('inputs', []):
+        nodeTree.inputs.new(bl_idname, name)
+    for bl_idname, name in treeData.get('outputs', []):
+        nodeTree.outputs.new(bl_idname, name)
+    for key, value in treeData.get('props', {}).items():
+        nodeTree[key] = value
+
+    nodes = []
+    for nodeData in treeData['nodes']:
+        bl_idname, operation = splitNodeKey(nodeData['id'])
+        node = nodeTree.nodes.new(bl_idname)
+        nodes.append(node)
+        if(operation != None): node.operation = operation
+        node.name = nodeData['name']
+        node.label = nodeData.get('label', '')
+        node.hide = nodeData.get('hide', 0) == 1
+        groupName = nodeData.get('tree')
+        if(groupName != None):
+            node.node_tree = getGroupTree(groupName, graph, nodeGroups, \
+                loadedGroups)
+        source = nodeData.get('props', {}).get(OSL_SOURCE_PROP)
+        if(bl_idname == SHADER_SCRIPT and source != None): # Creates sockets
+            setScript(node, source)
+        for idx, value in nodeData.get('in', {}).items():
+            setSocketValue(node.inputs[int(idx)], value)
+        for idx, value in nodeData.get('out', {}).items():
+            setSocketValue(node.outputs[int(idx)], value)
+        for key, value in nodeData.get('props', {}).items():
+            node[key] = value
+
+    # Parent before location, (child location is relative to the frame)
+    for node, nodeData in zip(nodes, treeData['nodes']):
+        parentIdx = nodeData.get('parent')
+        if(parentIdx != None): node.parent = nodes[parentIdx]
+        loc = nodeData['loc']
+        if(offset != None and parentIdx == None):
+            loc = (loc[0] + offset[0], loc[1] + offset[1])
+        node.location = loc
+
+    links = nodeTree.links
+    for fromIdx, fromSock, toIdx, toSock in treeData['links']:
+        links.new(nodes[fromIdx].outputs[fromSock], nodes[toIdx].inputs[toSock])
+    return nodes
+
+# loadedGroups: {group name in graph: tree}, pass the same dict for multiple
+# trees to share (i.e. link instead of copy) the group trees
+def loadGraph(graph, nodeTree, offset = None, loadedGroups = None):
+    version = graph.get('version')
+    if(version == None or version > FORMAT_VERSION):
+        raise ValueError('Unsupported node graph format version: ' + \
+            str(version))
+    return loadTree(graph['tree'], nodeTree, graph, \
+        EvaluatorBase.getNodeGroups(nodeTree), \
+            {} if loadedGroups == None else loadedGroups, offset)
+
+def loads(text, nodeTree, offset = None):
+    return loadGraph(json.loads(text), nodeTree, offset)
@@ -0,0 +1,220 @@
+#
+# Import directive of the scripts e.g.
+#   import "lib/noise.edf"
+#   import NoiseLib
+# The lines of the imported script (file, relative to the importing script,
+# or Blender text block) are added in place of the directive, each script is
+# imported only once per run. The parsed lines of the imported scripts are
+# cached as modules, in memory and on disk (CACHE_DIR_ENV, default:
+# ~/.cache/xnodify), so that shared libraries are not parsed again. Cached
+# modules of files are used as long as the modification time (or else the
+# content hash) of the file is the same
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import os, re, json, hashlib
+try:
+    import bpy
+except ImportError: # Outside Blender, only files can be imported
+    bpy = None
+
+from . import Parser, checker, loops
+
+SCRIPT_EXT = '.edf'
+CACHE_DIR_ENV = 'XNODIFY_CACHE_DIR'
+CACHE_VERSION = 2 # Changed when the format of the cached lines changes
+
+# import name or import "name with spaces", optionally followed by comment
+IMPORT_PATTERN = re.compile(r'^import\s+(?:"([^"]+)"|([^\s#="][^\s#]*))' + \
+    r'\s*(#.*)?$')
+# Lines with hard replacements (see XNodifyContext.hardReplace) depend on
+# the importing script, they are parsed in each run
+HARD_REPLACE_MARKER = '`'
+
+# Name of the imported script if the line is an import directive
+def getImportName(expression):
+    match = IMPORT_PATTERN.match(expression.strip())
+    if(match == None): return None
+    return match.group(1) if match.group(1) != None else match.group(2)
+
+def getCacheDir():
+    cacheDir = os.environ.get(CACHE_DIR_ENV)
+    if(cacheDir == None or cacheDir == ''):
+        cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'xnodify')
+    return cacheDir
+
+# Imports without directory are relative to the blend file (if saved)
+def getDefaultDir():
+    if(bpy != None):
+        blendDir = bpy.path.abspath('//')
+        if(blendDir != ''): return blendDir
+    return os.getcwd()
+
+# Parsing depends on the registered operators (see registry)
+def getParserKey():
+    symbols = sorted((id, type(symbol).__name__, sorted((k, repr(v)) \
+        for k, v in vars(symbol).items())) \
+            for id, symbol in Parser.symbolTable.items())
+    return hashlib.sha1(repr((CACHE_VERSION, symbols)).encode('utf-8')).\
+        hexdigest()
+
+def getContentHash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+# JSON form of the parsed line (SymbolData tree), only the attributes set
+# by the parser
+def encodeTree(data):
+    if(isinstance(data, list)):
+        return [encodeTree(d) for d in data]
+    if(data == None):
+        return None
+    item = {'id': data.getMetaData().id, 'value': data.value}
+    for attr in ('isFn', 'isGroup', 'isLHS'):
+        if(getattr(data, attr)): item[attr] = True
+    for attr in ('sockIdx', 'symbolType', 'argName'):
+        if(getattr(data, attr) != None): item[attr] = getattr(data, attr)
+    if(data.operand0 != None): item['operand0'] = encodeTree(data.operand0)
+    if(data.operand1 != None): item['operand1'] = encodeTree(data.operand1)
+    return item
+
+# New SymbolData tree (dataclass) from encodeTree output
+def decodeTree(item, dataclass):
+    if(isinstance(item, list)):
+        return [decodeTree(i, dataclass) for i in item]
+    if(item == None):
+        return None
+    id = item['id']
+    data = dataclass(id, Parser.getSymbolMeta(id), item['value'])
+    for attr in ('isFn', 'isGroup', 'isLHS'):
+        if(attr in item): setattr(data, attr, True)
+    for attr in ('sockIdx', 'symbolType', 'argName'):
+        if(attr in item): setattr(data, attr, item[attr])
+    data.operand0 = decodeTree(item.get('operand0'), dataclass)
+    data.operand1 = decodeTree(item.get('operand1'), dataclass)
+    return data
+
+# Parsed lines of an imported script
+class Module:
+    def __init__(self, key, name, dirPath, stamp, contentHash, parserKey, \
+        lines):
+        self.key = key # Absolute path or text: + name of the text block
+        self.name = name
+        self.dirPath = dirPath # Base of the imports of this module
+        self.stamp = stamp # (mtime, size) of the file, None for text blocks
+        self.contentHash = contentHash
+        self.parserKey = parserKey
+        # (line no, expression, encoded tree, error); lines with imports
+        # and hard replacements have no tree, comment lines are left out
+        self.lines = lines
+
+    @staticmethod
+    def compile(key, name, dirPath, stamp, content, dataclass):
+        lines = []
+        for i, line in enumerate(content.splitlines()):
+            expression = line.strip()
+            if(getImportName(expression) != None or \
+                HARD_REPLACE_MARKER in expression or \
+                    loops.getLoopHeader(expression) != None):
+                lines.append((i + 1, expression, None, None))
+                continue
+            try:
+                dataTree = Parser.parse(expression, dataclass)
+                if(dataTree != None):
+                    lines.append((i + 1, expression, encodeTree(dataTree), \
+                        None))
+            except Exception as e:
+                lines.append((i + 1, expression, None, \
+                    checker.getErrorMessage(e)))
+        return Module(key, name, dirPath, stamp, getContentHash(content), \
+            getParserKey(), lines)
+
+    def toDict(self):
+        return {'version': CACHE_VERSION, 'key': self.key, 'name': self.name, \
+            'dirPath': self.dirPath, 'stamp': self.stamp, \
+                'contentHash': self.contentHash, 'parserKey': self.parserKey, \
+                    'lines': self.lines}
+
+    @staticmethod
+    def fromDict(moduleDict):
+        if(moduleDict.get('version') != CACHE_VERSION): return None
+        stamp = moduleDict['stamp']
+        return Module(moduleDict['key'], moduleDict['name'], \
+            moduleDict['dirPath'], tuple(stamp) if stamp != None else None, \
+                moduleDict['contentHash'], moduleDict['parserKey'], \
+                    [tuple(line) for line in moduleDict['lines']])
+
+# Compiled modules by key, kept for the session
+moduleCache = {}
+
+def clearModuleCache():
+    moduleCache.clear()
+
+def getArtifactPath(key):
+    return os.path.join(getCacheDir(), \
+        hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+def readArtifact(key):
+    try:
+        with open(getArtifactPath(key)) as f:
+            module = Module.fromDict(json.load(f))
+        return module if module != None and module.key == key else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+# Not caching on disk (e.g. read only directory) only costs parse time
+def writeArtifact(module):
+    path = getArtifactPath(module.key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(module.toDict(), f)
+        os.replace(tmpPath, path)
+    except OSError:
+        pass
+
+# Module of the imported script (text block or file relative to baseDir),
+# compiled only if the cached one (in memory or on disk) is outdated
+def loadModule(name, baseDir, dataclass):
+    if(bpy != None and name in bpy.data.texts):
+        key, stamp, dirPath = 'text:' + name, None, getDefaultDir()
+        content = bpy.data.texts[name].as_string()
+    else:
+        path = name if os.path.splitext(name)[1] != '' else name + SCRIPT_EXT
+        if(not os.path.isabs(path)):
+            path = os.path.join(baseDir if baseDir != None \
+                else getDefaultDir(), path)
+        key = os.path.normpath(os.path.abspath(path))
+        try: stat = os.stat(key)
+        except OSError: raise SyntaxError('Import not found: ' + name)
+        stamp, dirPath, content = (stat.st_mtime_ns, stat.st_size), \
+            os.path.dirname(key), None
+
+    parserKey = getParserKey()
+    module = moduleCache.get(key)
+    if(module == None or module.parserKey != parserKey):
+        module = readArtifact(key)
+    if(module != None and module.parserKey != parserKey):
+        module = None
+    # Unchanged file, nothing to read
+    if(module != None and stamp != None and module.stamp == stamp):
+        moduleCache[key] = module
+        return module
+
+    if(content == None):
+        try:
+            with open(key) as f: content = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            raise SyntaxError('Cannot import ' + name + ': ' + str(e))
+    if(module != None and module.contentHash == getContentHash(content)):
+        if(module.stamp != stamp): # Touched, but not changed
+            module.stamp = stamp
+            writeArtifact(module)
+    else:
+        module = Module.compile(key, name, dirPath, stamp, content, dataclass)
+        writeArtifact(module)
+    moduleCache[key] = module
+    return module
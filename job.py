@@ -0,0 +1,92 @@
+#
+# Resumable node generation for big scripts.
+# XNodifyContext.generateExpressions is a generator that yields after each
+# line of each phase; GenerationJob runs it in steps within a time budget,
+# so that the modal operator (see xnodifyui) can keep Blender responsive,
+# show the progress and cancel the run. Without UI, step can be called with
+# any budget and clock e.g. to test the scheduling
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import time
+
+# Phases in the order of execution with their share of the total progress
+PHASES = ['parse', 'check', 'generate', 'optimize', 'layout']
+PHASE_WEIGHTS = {'parse': .1, 'check': .1, 'generate': .65, 'optimize': .1, \
+    'layout': .05}
+
+DEFAULT_BUDGET = 0.05 # Seconds per step (i.e. per timer tick)
+
+# Progress reported by the generator: phase, done and total (None if unknown)
+class JobProgress:
+    def __init__(self, phase, done = 0, total = None):
+        self.phase = phase
+        self.done = done
+        self.total = total
+
+    # Fraction of the whole job done (0 to 1)
+    def getFraction(self):
+        fraction = sum(PHASE_WEIGHTS[p] for p in \
+            PHASES[:PHASES.index(self.phase)])
+        if(self.total != None and self.total > 0):
+            fraction += PHASE_WEIGHTS[self.phase] * self.done / self.total
+        return min(fraction, 1)
+
+    def __str__(self):
+        text = self.phase.capitalize()
+        if(self.total != None): text += ' %d / %d' % (self.done, self.total)
+        elif(self.done > 0): text += ' %d' % self.done
+        return text
+
+class GenerationJob:
+    PENDING, RUNNING, DONE, CANCELLED, FAILED = range(5)
+
+    # generator: yields JobProgress, returns the result (e.g. DisplayParams)
+    # It's closed on cancel (and must roll back on GeneratorExit)
+    def __init__(self, generator):
+        self.generator = generator
+        self.state = GenerationJob.PENDING
+        self.progress = JobProgress(PHASES[0])
+        self.result = None
+        self.error = None
+        self.steps = 0 # Calls of step that did some work
+
+    def isFinished(self):
+        return self.state in {GenerationJob.DONE, GenerationJob.CANCELLED, \
+            GenerationJob.FAILED}
+
+    # Advances the job until budget (seconds) is used up or it's finished,
+    # at least by one yield. Returns True once finished
+    # Errors of the generator are stored in error and raised
+    def step(self, budget = DEFAULT_BUDGET, clock = time.perf_counter):
+        if(self.isFinished()): return True
+        self.state = GenerationJob.RUNNING
+        self.steps += 1
+        end = clock() + budget if budget != None else None
+        try:
+            while(True):
+                self.progress = next(self.generator)
+                if(end != None and clock() >= end):
+                    return False
+        except StopIteration as e:
+            self.result = e.value
+            self.state = GenerationJob.DONE
+        except Exception as e:
+            self.error = e
+            self.state = GenerationJob.FAILED
+            raise
+        return True
+
+    # Stops the job and removes the nodes created by it
+    def cancel(self):
+        if(not self.isFinished()):
+            self.generator.close()
+            self.state = GenerationJob.CANCELLED
+
+    # Runs the job to the end in one go (no budget)
+    def run(self):
+        self.step(budget = None)
+        return self.result
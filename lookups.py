@@ -13,6 +13,10 @@ SHADER_MATH = 'ShaderNodeMath'
 SHADER_VMATH = 'ShaderNodeVectorMath'
 SHADER_GROUP = 'ShaderNodeGroup'
 SHADER_VALUE = 'ShaderNodeValue'
+SHADER_SCRIPT = 'ShaderNodeScript'
+# Of the Script node without the sockets; it's generated only by oslgen, so
+# it's not in fnMap (not a script function)
+SCRIPT_DIMENSIONS = (153.61, 65.0)
 
 nodeGroups = [None] * 9
 nodeGroups[0] = ('0', 'Input', 'Category Input Node')
@@ -216,6 +220,89 @@ fnMap['nodegrp'] = ('7', SHADER_GROUP, 'Node Group', 0, 1, (153.61, 65.0))
 fnMap['nodeip'] = ('7', 'NodeGroupInput', 'Group Input', 0, 1, (153.61, 122.77))
 fnMap['nodeop'] = ('7', 'NodeGroupOutput', 'Group Output', 0, 1, (153.61, 122.77))
 
+# Types of the enabled outputs of the nodes in fnMap
+# F: VALUE, V: VECTOR, C: RGBA, S: SHADER (math nodes always return VALUE,
+# vector math nodes VECTOR, except the ones in vmathValueOps)
+socketTypes = {'F': 'VALUE', 'V': 'VECTOR', 'C': 'RGBA', 'S': 'SHADER'}
+vmathValueOps = {'DOT_PRODUCT', 'DISTANCE', 'LENGTH'}
+outputTypes = {}
+
+outputTypes['amboccl'] = 'CF'
+outputTypes['bevel'] = 'V'
+outputTypes['fresnel'] = 'F'
+outputTypes['layerwt'] = 'FF'
+outputTypes['prtclinf'] = 'FFFFVFVV'
+outputTypes['wireframe'] = 'F'
+outputTypes['attrib'] = 'CVF'
+outputTypes['camdata'] = 'VFF'
+outputTypes['geom'] = 'VVVVVVFFF'
+outputTypes['hairinf'] = 'FFFVF'
+outputTypes['lgtpth'] = 'FFFFFFFFFFFFF'
+outputTypes['objinf'] = 'VCFFF'
+outputTypes['shadrgb'] = 'C'
+outputTypes['tangent'] = 'V'
+outputTypes['texco'] = 'VVVVVVV'
+outputTypes['uvmap'] = 'V'
+outputTypes['value'] = 'F'
+outputTypes['vertcol'] = 'CF'
+outputTypes['volinf'] = 'CFFF'
+outputTypes['output'] = ''
+for key in ['addshad', 'diffbsdf', 'emission', 'glasbsdf', 'glosbsdf', \
+    'mixshad', 'prnbsdf', 'prnvol', 'refrbsdf', 'specular', 'subsrfsct', \
+        'tcntbsdf', 'tpntbsdf', 'volabs', 'volscat', 'holdout']:
+    outputTypes[key] = 'S'
+outputTypes['brcktex'] = 'CF'
+outputTypes['chctex'] = 'CF'
+outputTypes['envtex'] = 'C'
+outputTypes['gradtex'] = 'CF'
+outputTypes['iestex'] = 'F'
+outputTypes['imgtex'] = 'CF'
+outputTypes['magictex'] = 'CF'
+outputTypes['mustex'] = 'F'
+outputTypes['noisetex'] = 'FC'
+outputTypes['ptdnsty'] = 'CF'
+outputTypes['skytex'] = 'C'
+outputTypes['vorntex'] = 'FCV'
+outputTypes['wavetex'] = 'CF'
+outputTypes['whnsetex'] = 'FC'
+outputTypes['brtcst'] = 'C'
+outputTypes['gamma'] = 'C'
+outputTypes['hsval'] = 'C'
+outputTypes['invert'] = 'C'
+outputTypes['ltfloff'] = 'FFF'
+outputTypes['mixrgb'] = 'C'
+outputTypes['rgbcrvs'] = 'C'
+outputTypes['bump'] = 'V'
+outputTypes['disp'] = 'V'
+outputTypes['mapping'] = 'V'
+outputTypes['normal'] = 'VF'
+outputTypes['normmap'] = 'V'
+outputTypes['vctcrvs'] = 'V'
+outputTypes['vctdisp'] = 'V'
+outputTypes['vctrot'] = 'V'
+outputTypes['vcttrns'] = 'V'
+outputTypes['blkbody'] = 'C'
+outputTypes['clamp'] = 'F'
+outputTypes['colramp'] = 'CF'
+outputTypes['comhsv'] = 'C'
+outputTypes['comrgb'] = 'C'
+outputTypes['comxyz'] = 'V'
+outputTypes['maprange'] = 'F'
+outputTypes['rgb2bw'] = 'F'
+outputTypes['sephsv'] = 'FFF'
+outputTypes['seprgb'] = 'FFF'
+outputTypes['sepxyz'] = 'FFF'
+outputTypes['shd2rgb'] = 'CF'
+outputTypes['wvlngth'] = 'C'
+
+# Type of the output at index (within enabled outputs), None if not known
+def getOutputType(customName, idx = 0):
+    if(customName.startswith(mathPrefix)): types = 'F'
+    elif(customName.startswith(vmathPrefix)):
+        types = 'F' if vmathFnMap[customName][1] in vmathValueOps else 'V'
+    else: types = outputTypes.get(customName, '')
+    return socketTypes[types[idx]] if 0 <= idx < len(types) else None
+
 def getCombinedMap():
     cmap = {}
     cmap.update(fnMap)
@@ -233,15 +320,17 @@ def reverseLookup(revKey):
 
     # TODO: Uniform reverse lookup as much as possible
     if(revKey.startswith(SHADER_MATH) or revKey.startswith(SHADER_VMATH)):
-        shaderName, operation = revKey.split('_')
+        shaderName, operation = revKey.split('_', 1)
         mp = mathFnMap if revKey.startswith(SHADER_MATH) \
             else vmathFnMap
         for customName in mp.keys():
-            revKey = shaderName + '_' + mp[customName][1]
-            _reverseLookup[revKey] = customName
+            _reverseLookup[shaderName + '_' + mp[customName][1]] = customName
     else:
         mp = fnMap
         for customName in mp.keys():
-            revKey = mp[customName][1]
-            _reverseLookup[revKey] = customName
+            _reverseLookup[mp[customName][1]] = customName
     return _reverseLookup.get(revKey)
+
+# After changes of the maps (see registry.registerFunction)
+def clearReverseLookup(revKey):
+    _reverseLookup.pop(revKey, None)
@@ -0,0 +1,204 @@
+#
+# Compile-time loops of the scripts e.g.
+#   for i in range(1, 6): n = n + noisetex(texco()[3] * 2 ** i)[0] / 2 ** i
+# The line after : is parsed once and a copy of its tree is added for each
+# value of the loop variable, with the variable replaced by the number (also
+# in $ defaults e.g. $(, i)), so the expansion takes time linear in the
+# number of lines it creates. Loops can be nested, range arguments are
+# integers or the variables of enclosing loops.
+# Subexpressions that are the same in all the iterations (e.g. texco()[3]
+# above) are created only once: they are moved to lines before the loop,
+# bound to hidden variables (HIDDEN_PREFIX) used by all the iterations
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import re
+
+from . import Parser
+
+LOOP_PATTERN = re.compile(r'^for\s+([A-Za-z_]\w*)\s+in\s+range\s*' + \
+    r'\(([^()]*)\)\s*:\s*(.*)$')
+MAX_ITERATIONS = 10000 # Of a loop, including its nested loops
+HIDDEN_PREFIX = 'xn_loop'
+
+# (variable, range arguments, line to repeat) if the line is a loop
+def getLoopHeader(expression):
+    match = LOOP_PATTERN.match(expression.strip())
+    if(match == None): return None
+    return match.group(1), match.group(2), match.group(3)
+
+def getRange(argsText, env):
+    values = []
+    for arg in argsText.split(','):
+        arg = arg.strip()
+        if(arg in env):
+            values.append(env[arg])
+            continue
+        try: values.append(int(arg))
+        except ValueError:
+            raise SyntaxError('Range arguments should be integers or ' + \
+                'loop variables: ' + arg)
+    if(len(values) > 3 or (len(values) == 3 and values[2] == 0)):
+        raise SyntaxError('Invalid range: range(' + argsText + ')')
+    return range(*values)
+
+# Text of an iteration (for the hard replacements and the reports)
+def getLineText(body, env):
+    for var, value in env.items():
+        body = re.sub(r'\b' + var + r'\b', str(value), body)
+    return body
+
+def isLoopVar(data, names):
+    return data.getMetaData().id == 'NAME' and not data.isFn and \
+        not data.isGroup and not data.isLHS and data.value in names
+
+def getChildren(data):
+    children = []
+    for operand in (data.operand0, data.operand1):
+        children += operand if isinstance(operand, list) else [operand]
+    return [child for child in children if isinstance(child, type(data))]
+
+# Copy of the parsed line with the loop variables (env) replaced by numbers
+def cloneTree(data, env, dataclass):
+    if(isinstance(data, list)):
+        return [cloneTree(d, env, dataclass) for d in data]
+    if(data == None):
+        return None
+    id, value = data.getMetaData().id, data.value
+    if(isLoopVar(data, env)):
+        id, value = 'NUMBER', str(env[value])
+    elif(id == '$'): # Default values, single or list for a socket
+        value = [[str(env[v]) if v in env else v for v in val] \
+            if isinstance(val, list) else (str(env[val]) if val in env \
+                else val) for val in value]
+    clone = dataclass(id, Parser.getSymbolMeta(id), value)
+    for attr in ('isFn', 'isGroup', 'isLHS', 'sockIdx', 'symbolType', \
+        'argName'):
+        setattr(clone, attr, getattr(data, attr))
+    clone.operand0 = cloneTree(data.operand0, env, dataclass)
+    clone.operand1 = cloneTree(data.operand1, env, dataclass)
+    return clone
+
+class LoopExpander:
+    def __init__(self, dataclass, loopId):
+        self.dataclass = dataclass
+        self.loopId = loopId # Unique in the run, for the hidden variables
+        self.templates = {} # Line to repeat: tree with shared parts hoisted
+        self.hoisted = [] # (hidden variable, tree) of the shared parts
+        self.hoistedNames = {} # Structure key of the shared part: variable
+        self.iterationCnt = 0
+
+    # Returns (expression, tree) of the lines, hoisted ones first
+    def expandLines(self, expression):
+        iterations = self.expand(expression, {})
+        hoistedLines = [(name + ' = ... # ' + expression.strip(), \
+            self.getAssignment(name, tree)) for name, tree in self.hoisted]
+        return hoistedLines + iterations
+
+    def expand(self, expression, env):
+        var, argsText, body = getLoopHeader(expression)
+        if(var in env):
+            raise SyntaxError('Loop variable already used: ' + var)
+        lines = []
+        for value in getRange(argsText, env):
+            innerEnv = dict(env)
+            innerEnv[var] = value
+            if(getLoopHeader(body) != None):
+                lines += self.expand(body, innerEnv)
+                continue
+            self.iterationCnt += 1
+            if(self.iterationCnt > MAX_ITERATIONS):
+                raise SyntaxError('Too many loop iterations (at most ' + \
+                    str(MAX_ITERATIONS) + ')')
+            template = self.getTemplate(body, innerEnv)
+            lines.append((getLineText(body, innerEnv), \
+                cloneTree(template, innerEnv, self.dataclass)))
+        return lines
+
+    def getTemplate(self, body, env):
+        template = self.templates.get(body)
+        if(template == None):
+            template = Parser.parse(body, self.dataclass)
+            if(template == None):
+                raise SyntaxError('Loop needs a line to repeat after :')
+            names = set(env)
+            if(template.getMetaData().id == '='):
+                names.add(template.operand0.value) # Changes in each iteration
+            self.hoistShared(template, self.getVariants(template, names))
+            self.templates[body] = template
+        return template
+
+    # Symbols whose value depends on the iteration
+    def getVariants(self, data, names):
+        variants = set()
+        def isVariant(data):
+            variant = isLoopVar(data, names) or (data.getMetaData().id == \
+                '$' and any(v in names for val in data.value for v in \
+                    (val if isinstance(val, list) else [val])))
+            for child in getChildren(data):
+                variant = isVariant(child) or variant
+            if(variant): variants.add(data)
+            return variant
+        isVariant(data)
+        return variants
+
+    # Parts without variants that create nodes, not the ones whose node
+    # gets values of the iteration ($) or outputs
+    def canHoist(self, data, variants):
+        if(data in variants or data.isLHS): return False
+        id = data.getMetaData().id
+        if(id in {'NAME', 'NUMBER'} or (id == '(' and data.isGroup)):
+            return False
+        items = data.getLinearList([])
+        if(all(item.getMetaData().id in {'NUMBER', '('} \
+            and item.operand0 == None for item in items)):
+            return False # Literal e.g. (1, 2, 3)
+        return not any(item.getMetaData().id in {'=', '{'} or \
+            (item.isFn and item.value == 'output') for item in items)
+
+    # Replaces the shared parts with the hidden variables
+    def hoistShared(self, data, variants, isFixed = True):
+        id = data.getMetaData().id
+        for attr in ('operand0', 'operand1'):
+            operand = getattr(data, attr)
+            if(id == '{' and attr == 'operand1'): continue # Group body
+            operands = operand if isinstance(operand, list) else [operand]
+            for i, child in enumerate(operands):
+                if(not isinstance(child, type(data))): continue
+                # Root of the line, RHS and the node of $ stay in place
+                fixed = (id == '=' and isFixed) or id == '$'
+                if(not fixed and self.canHoist(child, variants)):
+                    child = self.getHiddenVar(child)
+                    if(isinstance(operand, list)): operand[i] = child
+                    else: setattr(data, attr, child)
+                else:
+                    self.hoistShared(child, variants, fixed)
+
+    def getHiddenVar(self, data):
+        argName, symbolType = data.argName, data.symbolType
+        data.argName = data.symbolType = None
+        key = data.getStructureKey()
+        name = self.hoistedNames.get(key)
+        if(name == None):
+            name = HIDDEN_PREFIX + str(self.loopId) + '_' + \
+                str(len(self.hoisted))
+            self.hoistedNames[key] = name
+            self.hoisted.append((name, data))
+        var = self.dataclass('NAME', Parser.getSymbolMeta('NAME'), name)
+        var.argName, var.symbolType = argName, symbolType
+        return var
+
+    def getAssignment(self, name, tree):
+        var = self.dataclass('NAME', Parser.getSymbolMeta('NAME'), name)
+        var.isLHS = True
+        assignment = self.dataclass('=', Parser.getSymbolMeta('='), None)
+        assignment.operand0, assignment.operand1 = var, tree
+        return assignment
+
+# (expression, tree) of the lines the loop expands to, loopId: unique number
+# of the loop in the run
+def expandLoop(expression, dataclass, loopId):
+    return LoopExpander(dataclass, loopId).expandLines(expression)
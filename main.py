@@ -8,49 +8,61 @@
 # License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
 #
 
-import bpy
-from mathutils import Vector
 from io import StringIO
-
-from .lookups import getCombinedMap, SHADER_GROUP
-
-# For debug
-from . import Parser, lookups, evaluator
-import importlib
-importlib.reload(Parser)
-importlib.reload(lookups)
-importlib.reload(evaluator)
-
-from . evaluator import NumberEvaluator, VariableEvaluator, EqualsEvaluator
-from . evaluator import PlusEvaluator, MultiplyEvaluator, DivisionEvaluator
-from . evaluator import PowerEvaluator, ParenthesisEvaluator, EvaluatorBase
+from collections import OrderedDict
+import os, copy, hashlib, time
+try:
+    import bpy
+    from mathutils import Vector
+except ImportError: # Outside Blender, only in-memory trees (see nodemodel)
+    bpy = None
+    from .nodemodel import Vector
+
+from .lookups import SHADER_GROUP, SHADER_VALUE, SHADER_SCRIPT
+from . import Parser, registry, graphformat, checker, typeinfer, optimizer
+from . import importer, rendercost, rebalance, loops, oslgen
+from .costreport import CostReport
+from . evaluator import EvaluatorBase, BraceEvaluator, VarTable, GROUP_INPUT
+from .sockindex import getSocketIndex
+from .job import GenerationJob, JobProgress
+
+# Changed when the nodes created for the same group body change
+GROUP_HASH_VERSION = 1
+
+# Stable id of the generated nodes (see XNodifyContext.setNodeIds)
+NODE_ID_PROP = graphformat.PROP_PREFIX + 'id'
 
 # Message bus to exchange data between objects
 class EvalParamsBus:
+    # Socket for data.sockIdx (position or name, see sockindex)
+    # Invalid positions fall back to the first socket
     @staticmethod
     def getNodeSocket(data, out = True, defaultIdx = 0):
         if(data == None or data.node == None):
             return None
         node = data.node
-        if(out): sockets = [o for o in node.outputs if o.enabled == True and o.hide == False]
-        else:    sockets = [i for i in node.inputs if i.enabled == True and i.hide == False]
-        if(data.sockIdx == None and len(sockets) > 0): return sockets[defaultIdx] if(defaultIdx != None and len(sockets) > defaultIdx) else None
-        socket = None
-        try: socket = sockets[int(data.sockIdx)]
-        except Exception as e:
-            print(e)
-            try: 
-                socket = sockets[data.sockIdx]
-            except Exception as e2:
-                print(e2)
-                if(len(node.outputs) > 0):
-                    socket = sockets[0]
-        return socket
+        sockets = node.outputs if out else node.inputs
+        sockIndex = getSocketIndex(node, out)
+        if(data.sockIdx == None):
+            if(defaultIdx == None): return None
+            idx = sockIndex.getPosIdx(defaultIdx)
+            return sockets[idx] if idx != None else None
+        idx = sockIndex.getIdx(data.sockIdx)
+        if(idx == None):
+            if(not str(data.sockIdx).isdigit()):
+                raise SyntaxError('Unknown socket: ' + str(data.sockIdx) + \
+                    ' (' + node.name + ')')
+            idx = sockIndex.getPosIdx(0)
+        return sockets[idx] if idx != None else None
 
     def __init__(self, data, operand0, operands1):
         self.data = data
         self.operand0 = operand0
         self.operands1 = operands1
+        self.skipOperands1 = False # Set by evaluator e.g. for reused groups
+        # Variables of operands1, the body of a group gets its own (see
+        # BraceEvaluator.beforeOperand1)
+        self.varTable = None
 
     def getLHSNode(self):
         if(self.operand0 != None):
@@ -85,6 +97,17 @@ class EvalParamsBus:
         outputs = self.getRHSOutputs()
         return None if outputs == None else outputs[0]
 
+    # Links the output of the operand (data) to the input socket; inlined
+    # literals (see XNodifyContext.setInlinedLiterals) are set as the value
+    # of the socket instead, or get their node if the socket has no value
+    # (added to the layout in evalSymbol)
+    def linkOperand(self, nodeTree, data, socket):
+        if(data.isInlined and data.node == None):
+            value = EvaluatorBase.getLiteralValue(data)
+            if(EvaluatorBase.setLiteralValue(socket, value)): return
+            data.node = EvaluatorBase.getLiteralNode(nodeTree, value)
+        nodeTree.links.new(EvalParamsBus.getNodeSocket(data), socket)
+
 class SymbolData(object):
     def __init__(self, id, meta, value):
         self.meta = meta
@@ -96,6 +119,12 @@ class SymbolData(object):
         self.sockIdx = None # Index in [] operator TODO: separate class?
         self.isLHS = False # TODO: Separate class?
         self.symbolType = None # For default values i.e. $ & { symbols
+        self.argName = None # Socket name of keyword argument e.g. Roughness=r
+        self.sockType = None # Inferred type of the output (see typeinfer)
+        self.groupHash = None # Structural hash of group body ({ symbol)
+        # Literal set as the value of the input it feeds, no node is created
+        # for it (see XNodifyContext.setInlinedLiterals)
+        self.isInlined = False
         self.evaluator = EvaluatorBase.getEvaluator(id)
         self.node = None # Is set during evalSymbol
 
@@ -123,12 +152,26 @@ class SymbolData(object):
     def getMetaData(self):
         return self.meta
 
+    # Hashable form of the parsed expression (including inferred types),
+    # same for the expressions that create identical nodes
+    def getStructureKey(self):
+        def getKey(operand):
+            if isinstance(operand, SymbolData):
+                return operand.getStructureKey()
+            elif isinstance(operand, list):
+                return tuple(getKey(o) for o in operand)
+            return operand
+
+        return (self.meta.id, self.value, self.isFn, self.isGroup, \
+            self.sockIdx, self.symbolType, self.sockType, self.argName, \
+                getKey(self.operand0), getKey(self.operand1))
+
     # Assuming operand0 i.e. LHS of the operator will always be a single element
     # operand1 can be a list (function arguments for example);
     # So in case of prefix operators with a list as operand0,
     # this will need to be changed
     def evalSymbol(self, nodeTree, varTable, afterProcNode, colNo = 0):
-        if(self.evaluator == None):
+        if(self.evaluator == None or self.isInlined):
             return None
 
         operand0 = self.operand0
@@ -152,13 +195,19 @@ class SymbolData(object):
             operands1 = None
 
         paramBus = EvalParamsBus(self, operand0, operands1)
+        paramBus.varTable = varTable
         nodeTree, group_node = self.evaluator.beforeOperand1(nodeTree, paramBus)
 
         nextColNo = colNo + 1
-        if(operands1 != None):
+        if(operands1 != None and not paramBus.skipOperands1):
             for s in operands1:
-                if(s != None): s.evalSymbol(nodeTree, varTable, afterProcNode, nextColNo)
+                if(s != None): s.evalSymbol(nodeTree, paramBus.varTable, \
+                    afterProcNode, nextColNo)
         node = self.evaluator.evaluate(nodeTree, group_node, paramBus, varTable)
+        # Inlined literals that needed a node after all (see linkOperand)
+        for s in [operand0] + (operands1 if operands1 != None else []):
+            if(s != None and s.isInlined and s.node != None):
+                afterProcNode(nextColNo, s, paramBus, varTable)
 
         self.node = node
         # afterProcNode: callback after processing each token
@@ -174,6 +223,20 @@ class VarInfo:
         self.isProcessed = False # Used at the time of processing
         self.isLaidOut = False # Used at the time of post-processing
 
+    # Adds the nodes and usages of the other variable with the same node,
+    # e.g. after both nodes are replaced by one (see applyGraphEdits)
+    def merge(self, varInfo):
+        self.usageLines |= varInfo.usageLines
+        for nodeTree, nodeGraph in varInfo.nodeTreeTable.items():
+            ownGraph = self.nodeTreeTable.setdefault(nodeTree, {})
+            nodes = set(dispNode.data.node for dispNodes in ownGraph.values() \
+                for dispNode in dispNodes)
+            for col in sorted(nodeGraph.keys()):
+                for dispNode in nodeGraph[col]:
+                    if(dispNode.data.node not in nodes):
+                        nodes.add(dispNode.data.node)
+                        appendDispNode(dispNode, ownGraph, col)
+
     def __str__(self):
         return '<' + str(self.nodeTreeTable) + '::' + str(self.usageLines) + '>'
 
@@ -236,21 +299,12 @@ class Controller:
     def getGlobalNodes(self):
         return self.getDispNodeTable().keys()
 
-    def removeAllNodes(self, newNodes = None):
-        for node in self.getGlobalNodes():
-            node.id_data.nodes.remove(node)
-        # TODO : better way to delete all nodes on syntax error
-        if(newNodes != None):
-            for node in newNodes:
-                try:
-                    node.id_data.nodes.remove(node)
-                except:
-                    pass
-
     # Callback method, creates and updates nodeTreeTable used by arrange.
     # nodeTreeTable will have mulitple nodeGraphs only in case of group nodes.
     def afterProcNode(self, colNo, data, params, varTable):
         node = data.node
+        if(node != None and node.bl_idname == GROUP_INPUT):
+            return # Parameter of group, placed with the group
         varInfo = self.varNodeGraphs.get(node)
         if(varInfo != None):
             varInfo.usageLines.add(self.currLineNo)
@@ -270,39 +324,22 @@ class Controller:
             if(self.minimized):
                 node.hide = True
 
-    def createNodes(self, nodeTree, varTable, expression, depth = 0):
+    # dataTree: parsed line that passed the checks of checker module
+    def createNodes(self, nodeTree, varTable, dataTree, depth = 0):
 
         OUTPUT_ON_LHS = 'Deprecation Warning: output on LHS is deprecated, ' + \
             'use output on RHS with incoming nodes as parameters instead.' + \
             '(Layout won\'t be correct.)'
         warnings = set()
-        dataTree = Parser.parse(expression, SymbolData)
-
-        if(dataTree == None):
-            return None, None, None, None, warnings
-
-        datas = dataTree.getLinearList([])
-        equalsOps = [t for t in datas if t.getMetaData().id == '=']
-
-        if(len(equalsOps) > 1):
-            raise SyntaxError('Only one assignment allowed in a line.')
-        elif(len(equalsOps) == 1):
-            op0 = equalsOps[0].operand0
-            op1 = equalsOps[0].operand0
-            if(op0 == None or op1 == None):
-                raise SyntaxError('Values needed on both sides of =')
 
-            if(op0.getMetaData().id != 'NAME'):
-                raise SyntaxError('LHS must be a variable or the output node')
-            if(op0.value == 'output'):
+        if(dataTree.getMetaData().id == '='):
+            lhsName = dataTree.operand0.value
+            if(lhsName == 'output'):
                 warnings.add(OUTPUT_ON_LHS)
                 exprType = 'output'
-            elif(op0.value in getCombinedMap().keys()):
-                raise SyntaxError('LHS cannot refer to a node ' + \
-                    'other than output')
             else:
-                exprType = op0.value
-        elif(len(equalsOps) == 0):
+                exprType = lhsName
+        else:
             exprType = None
 
         evalNode = dataTree.evalSymbol(nodeTree, varTable, \
@@ -373,41 +410,86 @@ class NodeLayout:
                     appendDispNode(dispNode, newNodeGraph, newColNo)
         return newNodeGraph
 
-    @staticmethod
-    def arrangeNodes(nodeTreeTable, nodeTree, location, scale, alignment):
+    # Computed layouts (node offsets and extents) by layout key (see
+    # getLayoutKey), so that the lines (and groups) with the same graph are
+    # only translated, also across runs. Least recently used ones are
+    # dropped beyond MAX_CACHED_LAYOUTS
+    MAX_CACHED_LAYOUTS = 512
+    layoutCache = OrderedDict()
 
-        height = 0
-        width = 0
-        augNodeGraph = nodeTreeTable[nodeTree]
-
-        nodeLayout = NodeLayout(augNodeGraph)
-
-        colHeights, colWidths, totalHeight, totalWidth, nodeGraph = \
-            nodeLayout.colHeights, nodeLayout.colWidths, \
-                nodeLayout.totalHeight, nodeLayout.totalWidth, \
-                    nodeLayout.nodeGraph
+    @staticmethod
+    def clearLayoutCache():
+        NodeLayout.layoutCache.clear()
 
-        for col in range(len(nodeGraph)):
+    # Structure of the node graph that the layout depends on: kind of each
+    # node (with its size if already drawn, hide state i.e. minimized,
+    # and socket count of groups and Script nodes, which are sized by it)
+    # by column and row and layout parameters
+    @staticmethod
+    def getLayoutKey(nodeGraph, scale, alignment):
+        def getNodeKey(node):
+            key = (graphformat.getNodeKey(node), node.hide, \
+                tuple(node.dimensions))
+            if(node.bl_idname in {SHADER_GROUP, SHADER_SCRIPT}):
+                key += (sum(1 for s in node.inputs if s.enabled and \
+                    not s.hide), sum(1 for s in node.outputs if s.enabled \
+                        and not s.hide))
+            return key
+
+        return (tuple(scale), alignment, tuple(tuple(getNodeKey(\
+            dispNode.data.node) for dispNode in nodeGraph[col]) \
+                for col in sorted(nodeGraph.keys())))
+
+    # Node offsets (from location, by column and row) for alignment and scale
+    def computeOffsets(self, scale, alignment):
+        offsets = []
+        for col in range(len(self.nodeGraph)):
             yOffset = 0
             if(alignment == 'CENTER'):
-                yOffset = (totalHeight - colHeights[col]) / 2
+                yOffset = (self.totalHeight - self.colHeights[col]) / 2
             elif(alignment == 'BOTTOM'):
-                yOffset = (totalHeight - colHeights[col])
+                yOffset = (self.totalHeight - self.colHeights[col])
 
             prevHeight = 0
-            for row in range(len(nodeGraph[col])):
-                node = nodeGraph[col][row].data.node
+            colOffsets = []
+            for row in range(len(self.nodeGraph[col])):
+                node = self.nodeGraph[col][row].data.node
                 dimensions = EvaluatorBase.getNodeDimensions(node)
-                x = totalWidth / 2 -  sum(colWidths[:col + 1]) - \
+                x = self.totalWidth / 2 -  sum(self.colWidths[:col + 1]) - \
                     col * NodeLayout.noodleWidth + \
-                        (colWidths[col] - dimensions[0]) / 2
+                        (self.colWidths[col] - dimensions[0]) / 2
                 y =  prevHeight + yOffset + (dimensions[1] / 2 \
                     if node.hide else 0)
 
                 prevHeight += dimensions[1]
+                colOffsets.append((scale[0] * x, -scale[1] * y))
+            offsets.append(colOffsets)
+        return offsets
 
-                nodeLoc = Vector((location[0] + scale[0] * x, \
-                    location[1] + -scale[1] * y))
+    @staticmethod
+    def arrangeNodes(nodeTreeTable, nodeTree, location, scale, alignment):
+
+        augNodeGraph = nodeTreeTable[nodeTree]
+        layoutCache = NodeLayout.layoutCache
+        key = NodeLayout.getLayoutKey(augNodeGraph, scale, alignment)
+        cachedLayout = layoutCache.get(key)
+        if(cachedLayout != None):
+            layoutCache.move_to_end(key)
+        nodeLayout = NodeLayout(augNodeGraph, cachedLayout)
+        if(cachedLayout == None):
+            nodeLayout.offsets = nodeLayout.computeOffsets(scale, alignment)
+            layoutCache[key] = (nodeLayout.offsets, nodeLayout.totalHeight, \
+                nodeLayout.totalWidth)
+            if(len(layoutCache) > NodeLayout.MAX_CACHED_LAYOUTS):
+                layoutCache.popitem(last = False)
+
+        nodeGraph = nodeLayout.nodeGraph
+        for col in range(len(nodeGraph)):
+            for row in range(len(nodeGraph[col])):
+                node = nodeGraph[col][row].data.node
+                offset = nodeLayout.offsets[col][row]
+                nodeLoc = Vector((location[0] + offset[0], \
+                    location[1] + offset[1]))
                 node.location = nodeLoc
 
                 if(node.bl_idname == SHADER_GROUP and \
@@ -458,7 +540,7 @@ class NodeLayout:
         if(testDimensions):
             dimensions = \
                 NodeLayout.testNodeDimension(dispTreeTables[0][1], matNodeTree)
-            if(dimensions[0] == 0):
+            if(dimensions != None and dimensions[0] == 0):
                 return False
 
         height = 0
@@ -467,8 +549,12 @@ class NodeLayout:
             lineNo = dispTreeTable[0]
             nodeTreeTable = dispTreeTable[1]
             newLoc = Vector(location) + Vector((0, -height))
+            start = time.perf_counter()
             nodeLayout = NodeLayout.arrangeNodes(nodeTreeTable, \
                 matNodeTree, newLoc, scale, alignment)
+            if(displayParams.costReport != None):
+                displayParams.costReport.addTime(lineNo, 'layout', \
+                    time.perf_counter() - start)
             if(addFrame):
                 frame = matNodeTree.nodes.new(type='NodeFrame')
                 frame.label = frameTitle if frameTitle != None \
@@ -480,10 +566,13 @@ class NodeLayout:
 
         return True
 
-    def __init__(self, tNodeGraph):
+    # cachedLayout: (offsets, total height, total width) from layoutCache,
+    # the node dimensions are not needed then
+    def __init__(self, tNodeGraph, cachedLayout = None):
         self.colHeights = []
         self.colWidths = []
         self.nodeGraph = []
+        self.offsets = None # Set in arrangeNodes
 
         # Normalize the nodegraph to remove gaps in columns and rows
         for col in sorted(tNodeGraph.keys()):
@@ -495,12 +584,16 @@ class NodeLayout:
                 node = tNodeGraph[col][row].data.node
                 appendDispNode(dispNode, self.nodeGraph, \
                     len(self.nodeGraph) - 1)
+                if(cachedLayout != None): continue
                 dimensions = EvaluatorBase.getNodeDimensions(node)
                 self.colHeights[-1] += dimensions[1]
                 if(self.colWidths[-1] < dimensions[0]):
                     self.colWidths[-1] = dimensions[0]
 
         self.nodeCnt = len(self.colHeights)
+        if(cachedLayout != None):
+            self.offsets, self.totalHeight, self.totalWidth = cachedLayout
+            return
         self.totalHeight = max(self.colHeights) if(self.nodeCnt > 0) else 0
         self.totalWidth = (sum(self.colWidths) + \
             (self.nodeCnt - 1) * NodeLayout.noodleWidth) \
@@ -508,7 +601,9 @@ class NodeLayout:
 
 class DisplayParams:
     def __init__(self, dispTreeTables, dispNodeTable, matNodeTree, \
-        location, scale, alignment, addFrame, frameTitle, warnings):
+        location, scale, alignment, addFrame, frameTitle, warnings, \
+            optCounters = None, varTable = None, reconcileStats = None, \
+                costReport = None, renderCost = None):
 
         self.dispTreeTables = dispTreeTables
         self.dispNodeTable = dispNodeTable
@@ -519,6 +614,50 @@ class DisplayParams:
         self.addFrame = addFrame
         self.frameTitle = frameTitle
         self.warnings = warnings
+        self.optCounters = optCounters if optCounters != None else {}
+        # name: [node, socket index, usage count] of the script variables
+        self.varTable = varTable if varTable != None else {}
+        # Counts of kept, added, removed nodes... if updated in place
+        self.reconcileStats = reconcileStats
+        # Nodes, links and time by script line (see costreport), layout time
+        # is added by arrangeNodeLines
+        self.costReport = costReport
+        # Estimated render cost of the material (see rendercost), if asked
+        self.renderCost = renderCost
+
+# Options that change the generated graph (defaults: as written in the script)
+class CompileOptions:
+    def __init__(self, optimize = False, reconcile = False, inline = False, \
+        importDir = None, estimateCost = False, costBudget = None, \
+            rebalance = False, osl = None):
+        self.optimize = optimize # Graph optimizations (see optimizer)
+        # Update the nodes of earlier runs in place (see reconcile), the
+        # generated nodes get stable ids (doesn't change the graph)
+        self.reconcile = reconcile
+        # Numbers as input values instead of Value nodes (see
+        # XNodifyContext.setInlinedLiterals)
+        self.inline = inline
+        # Directory of the relative imports (see importer), default: the
+        # folder of the script file or of the blend file
+        self.importDir = importDir
+        # Render cost estimate of the generated material (see rendercost),
+        # a warning is added if it's more than costBudget (implies estimate)
+        self.estimateCost = estimateCost
+        self.costBudget = costBudget
+        # Balanced trees for long chains of e.g. + (see rebalance), changes
+        # the rounding order
+        self.rebalance = rebalance
+        # Math nodes compiled to OSL Script nodes (see oslgen): None,
+        # oslgen.OSL_ALL for the whole script or names of the groups
+        self.osl = osl
+
+    def getOSLKey(self):
+        if(self.osl == None or self.osl == oslgen.OSL_ALL): return self.osl
+        return tuple(sorted(self.osl))
+
+    # Nodes created with different options must not be shared (e.g. groups)
+    def getKey(self):
+        return (self.optimize, self.inline, self.rebalance, self.getOSLKey())
 
 # Context for all the lines
 class XNodifyContext:
@@ -538,44 +677,267 @@ class XNodifyContext:
     def __init__(self):
         pass
 
+    # Identical groups are created only once (see BraceEvaluator)
+    @staticmethod
+    def setGroupHashes(program, options):
+        for actLineCnt, expression, dataTree in program:
+            for data in dataTree.getLinearList([]):
+                if(data.getMetaData().id == '{'):
+                    key = (GROUP_HASH_VERSION, options.getKey(), \
+                        data.getStructureKey())
+                    data.groupHash = \
+                        hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    # Literals (numbers and vectors of numbers) that feed an input of an
+    # operator or function directly are set as the value of the input
+    # instead of creating Value / Combine XYZ nodes (see
+    # EvalParamsBus.linkOperand). Literals bound to variables (e.g. a = 1)
+    # keep their node, as it may feed several inputs, so do the ones in
+    # groups (unlinked inputs become group inputs)
+    @staticmethod
+    def setInlinedLiterals(program):
+        def isLiteral(data):
+            if(data.sockIdx != None): return False
+            items = Parser.getListItems(data) \
+                if data.getMetaData().id == '(' else None
+            if(items != None):
+                return len(items) == 3 and all(item != None and \
+                    item.getMetaData().id == 'NUMBER' for item in items)
+            return data.getMetaData().id == 'NUMBER'
+
+        def setInlined(data):
+            id = data.getMetaData().id
+            if(id == '{'): return
+            opInfo = registry.getOperator(id)
+            isConsumer = (id == '(') or (opInfo != None and \
+                opInfo.customName != None and data.sockType != 'SHADER')
+            operands = [data.operand0] + (data.operand1 \
+                if isinstance(data.operand1, list) else [data.operand1])
+            for operand in operands:
+                if(isinstance(operand, SymbolData)):
+                    if(isConsumer and isLiteral(operand)):
+                        operand.isInlined = True
+                    else:
+                        setInlined(operand)
+
+        for actLineCnt, expression, dataTree in program:
+            setInlined(dataTree)
+
+    # Numbers in vector literals e.g. (1, x, 0) are set as the values of the
+    # Combine XYZ inputs instead of creating Value nodes (see
+    # ParenthesisEvaluator), except in groups, whose unlinked inputs become
+    # group inputs
+    @staticmethod
+    def setVectorLiterals(program):
+        def setInlined(data):
+            if(data.getMetaData().id == '{'): return
+            items = Parser.getListItems(data) \
+                if data.getMetaData().id == '(' else None
+            if(items != None and not data.isGroup):
+                for item in items:
+                    if(item != None and item.getMetaData().id == 'NUMBER' \
+                        and item.sockIdx == None):
+                        item.isInlined = True
+            operands = [data.operand0] + (data.operand1 \
+                if isinstance(data.operand1, list) else [data.operand1])
+            for operand in operands:
+                if(isinstance(operand, SymbolData)): setInlined(operand)
+
+        for actLineCnt, expression, dataTree in program:
+            setInlined(dataTree)
+
+    # Stable identities of the generated nodes (see reconcile) stored in
+    # NODE_ID_PROP: key of the line (variable name or outermost symbol, with
+    # occurrence count) and path of the symbol that created the node in the
+    # parsed line, so that an edit changes the ids only where it's made.
+    # Value nodes of undeclared names are identified by the name
+    @staticmethod
+    def setNodeIds(program, matNodeTree):
+        treeNodes = set(matNodeTree.nodes)
+        def setIds(data, lineKey, path):
+            operands = [data.operand0] + (data.operand1 \
+                if isinstance(data.operand1, list) else [data.operand1])
+            for i, operand in enumerate(operands):
+                if(isinstance(operand, SymbolData)):
+                    setIds(operand, lineKey, path + [str(i)])
+            node = data.node
+            if(node == None or node not in treeNodes or \
+                node.get(NODE_ID_PROP) != None):
+                return
+            if(data.getMetaData().id == 'NAME' and \
+                node.bl_idname == SHADER_VALUE and node.name == data.value):
+                node[NODE_ID_PROP] = '$' + data.value
+            else:
+                node[NODE_ID_PROP] = lineKey + ':' + '.'.join(path)
+
+        lineKeyCnts = {}
+        for actLineCnt, expression, dataTree in program:
+            # Variable or function name, if any
+            data = dataTree
+            while(data.getMetaData().id in {'=', '(', '$', '[', '{'} and \
+                isinstance(data.operand0, SymbolData)):
+                data = data.operand0
+            key = str(data.value)
+            cnt = lineKeyCnts.get(key, 0)
+            lineKeyCnts[key] = cnt + 1
+            setIds(dataTree, key + '#' + str(cnt), [])
+        # Nodes not created by any symbol (e.g. by optimizer)
+        cnt = 0
+        for node in matNodeTree.nodes:
+            if(node.get(NODE_ID_PROP) == None):
+                node[NODE_ID_PROP] = '~' + str(cnt)
+                cnt += 1
+
+    # Updates the display tables after graph optimizations (see optimizer)
+    @staticmethod
+    def applyGraphEdits(edits, lineNodeTables, varNodeGraphs, varTable, \
+        dispNodeTables):
+        def mapNode(node):
+            if(node in edits.replaced): return edits.replaced[node]
+            return None if node in edits.removed else node
+
+        nodeTreeTables = {id(t[1]): t[1] for t in lineNodeTables}
+        for varInfo in varNodeGraphs.values():
+            nodeTreeTables[id(varInfo.nodeTreeTable)] = varInfo.nodeTreeTable
+        for nodeTreeTable in nodeTreeTables.values():
+            for nodeGraph in nodeTreeTable.values():
+                # Replacement takes the place of the first (right most) node
+                laidOut = set()
+                for col in sorted(nodeGraph.keys()):
+                    dispNodes = []
+                    for dispNode in nodeGraph[col]:
+                        node = mapNode(dispNode.data.node)
+                        if(node != None and node not in laidOut):
+                            laidOut.add(node)
+                            dispNode.data.node = node
+                            dispNode.rowNo = len(dispNodes)
+                            dispNodes.append(dispNode)
+                    if(len(dispNodes) > 0): nodeGraph[col] = dispNodes
+                    else: del nodeGraph[col]
+
+        lineNodeTables[:] = [(t[0], t[1], t[2], mapNode(t[3])) \
+            for t in lineNodeTables]
+        for node in list(varNodeGraphs.keys()):
+            varInfo = varNodeGraphs.pop(node)
+            node = mapNode(node)
+            if(node == None): continue
+            if(node in varNodeGraphs): # e.g. compiled into one Script node
+                varNodeGraphs[node].merge(varInfo)
+            else:
+                varNodeGraphs[node] = varInfo
+        for varInfo in varTable.values():
+            varInfo[1] = edits.replacedOutputs.get(varInfo[0], varInfo[1])
+            varInfo[0] = mapNode(varInfo[0])
+        for dispNodeTable in dispNodeTables:
+            for node in list(dispNodeTable.keys()):
+                dispNode = dispNodeTable.pop(node)
+                if(mapNode(node) != None):
+                    dispNodeTable[mapNode(node)] = dispNode
+
+    # Render cost of matNodeTree with the costs of the nodes of each line
+    # (variable nodes count for the line defining them), before the variable
+    # nodes are added to the line tables for layout.
+    # The warning for the exceeded budget is added to the most expensive line
+    @staticmethod
+    def estimateRenderCost(matNodeTree, lineNodeTables, costBudget, warnings):
+        lineNodes = {}
+        seenNodes = set()
+        for nType, nodeTreeTable, actLineCnt, evalNode in lineNodeTables:
+            nodes = lineNodes.setdefault(actLineCnt, [])
+            for dispNodes in nodeTreeTable.get(matNodeTree, {}).values():
+                for dispNode in dispNodes:
+                    if(dispNode.data.node not in seenNodes):
+                        seenNodes.add(dispNode.data.node)
+                        nodes.append(dispNode.data.node)
+        renderCost = rendercost.estimateCost(matNodeTree, lineNodes)
+        if(costBudget != None and renderCost.total > costBudget):
+            lineNo = renderCost.getMaxLine()
+            if(lineNo == None and len(lineNodeTables) > 0):
+                lineNo = lineNodeTables[-1][2]
+            warnings.setdefault(lineNo, set()).add(('Render cost %.1f ' + \
+                'exceeds budget %.1f (%s)') % (renderCost.total, costBudget, \
+                    renderCost.getDetails()))
+        return renderCost
+
+    # Removes the nodes of matNodeTree that are not in existingNodes
+    # and the groups that are not used anymore (after errors and cancel)
+    @staticmethod
+    def rollback(matNodeTree, existingNodes):
+        for node in list(matNodeTree.nodes):
+            if(node not in existingNodes):
+                matNodeTree.nodes.remove(node)
+        BraceEvaluator.removeOrphanGroups(matNodeTree)
+
     def processExpressions(self, lineFeeder, matNodeTree, \
-        location, scale, alignment, addFrame, minimized, frameTitle = None):
+        location, scale, alignment, addFrame, minimized, frameTitle = None, \
+            options = None):
+        return GenerationJob(self.generateExpressions(lineFeeder, matNodeTree, \
+            location, scale, alignment, addFrame, minimized, frameTitle, \
+                options)).run()
+
+    # Generator version of processExpressions (see job.GenerationJob)
+    # Yields JobProgress after each line of each phase and returns
+    # DisplayParams; the created nodes are removed if it's closed midway
+    def generateExpressions(self, lineFeeder, matNodeTree, \
+        location, scale, alignment, addFrame, minimized, frameTitle = None, \
+            options = None):
 
         if(matNodeTree == None):
-            matNodeTree = XNodifyContext.getActiveMatTree()
-
-        actLineCnt = 1
+            matNodeTree = getActiveMatTree()
+            if(matNodeTree == None):
+                raise SyntaxError('No active material')
+        if(options == None):
+            options = CompileOptions()
+
+        costReport = CostReport()
+        program = yield from self.iterParseLines(lineFeeder, \
+            options.importDir, costReport)
+        if(options.rebalance):
+            rebalance.rebalanceProgram(program)
+        XNodifyContext.setGroupHashes(program, options)
+        XNodifyContext.setVectorLiterals(program)
+        if(options.inline):
+            XNodifyContext.setInlinedLiterals(program)
+
+        actLineCnt = None
         warnings = {}
         varNodeGraphs = {}
-        varTable = {}
-        hardReplaceTable = {}
+        varTable = VarTable()
         nonvarDispNodeTable = {} # Nodes that are not vartable nodes
         allDispNodesTable = {}
         lineNodeTables = []
         lineCnt = 0
+        existingNodes = set(matNodeTree.nodes)
+        seenNodes = set(existingNodes) # For the node counts of cost report
+        lineVars = [] # (line cost, var table entry) for the use counts
 
-        # TODO: Split in 3 different methods
         try:
-            expression = next(lineFeeder)
-            while(expression != None):
-                expression = expression.strip()
-                expression = XNodifyContext.hardReplace(expression, \
-                    hardReplaceTable)
+            for lineIdx, (actLineCnt, expression, dataTree) in \
+                enumerate(program):
+                start = time.perf_counter()
                 controller = Controller(nonvarDispNodeTable, varNodeGraphs, \
                     lineCnt, minimized)
                 evalNode, exprType, nodeTreeTable, newDispNodeTable, \
                     newWarnings = controller.createNodes(matNodeTree, \
-                        varTable, expression)
+                        varTable, dataTree)
+                costReport.addTime(actLineCnt, 'evaluate', \
+                    time.perf_counter() - start)
+                lineCost = costReport.getLineCost(actLineCnt)
+                newNodes = set(d.node for d in dataTree.getLinearList([]) \
+                    if d.node != None and d.node not in seenNodes)
+                seenNodes.update(newNodes)
+                lineCost.nodes += len(newNodes)
+                lineCost.links += sum(len(s.links) for node in newNodes \
+                    for s in node.inputs)
+                if(exprType != None and exprType != 'output' and \
+                    varTable.get(exprType) != None):
+                    lineCost.variable = exprType if lineCost.variable == None \
+                        else lineCost.variable + ', ' + exprType # Imports
+                    lineVars.append((lineCost, varTable[exprType]))
 
                 if(len(newWarnings) > 0):
                     warnings[actLineCnt] = newWarnings
 
-                if(exprType != None):
-                    tmp = expression.split('#')
-                    expression = tmp[0]
-                    lhs, rhs = expression.split('=')
-                    hardReplaceTable[lhs.strip()] = rhs.strip()
-
                 if(nodeTreeTable != None and len(nodeTreeTable) > 0):
                     if(exprType != None and exprType != 'output'):
                         if(varNodeGraphs.get(evalNode) == None):
@@ -590,30 +952,165 @@ class XNodifyContext:
                         actLineCnt, evalNode))
                     lineCnt += 1
                     allDispNodesTable.update(newDispNodeTable)
-                expression = next(lineFeeder)
-                actLineCnt += 1
-
-            varKeys = varNodeGraphs.keys()
+                yield JobProgress('generate', lineIdx + 1, len(program))
+
+            optCounters = {}
+            if(options.optimize):
+                edits = optimizer.optimizeGraph(allDispNodesTable.keys(), \
+                    [varInfo[0] for varInfo in varTable.values()])
+                XNodifyContext.applyGraphEdits(edits, lineNodeTables, \
+                    varNodeGraphs, varTable, \
+                        [allDispNodesTable, nonvarDispNodeTable])
+                optCounters = edits.counters
+                yield JobProgress('optimize', 1, 1)
+
+            if(options.osl != None):
+                edits, failed = oslgen.compileGraph(allDispNodesTable.keys(), \
+                    [varInfo[0] for varInfo in varTable.values()], \
+                        matNodeTree, options.osl)
+                XNodifyContext.applyGraphEdits(edits, lineNodeTables, \
+                    varNodeGraphs, varTable, \
+                        [allDispNodesTable, nonvarDispNodeTable])
+                for name, cnt in edits.counters.items():
+                    optCounters[name] = optCounters.get(name, 0) + cnt
+                if(len(failed) > 0 and len(lineNodeTables) > 0):
+                    warnings.setdefault(lineNodeTables[-1][2], set()).add(\
+                        'OSL script could not be compiled (needs Cycles), ' + \
+                            'kept %d math nodes' % sum(len(r) for r in failed))
+                yield JobProgress('optimize', 1, 1)
+
+            if(options.reconcile):
+                XNodifyContext.setNodeIds(program, matNodeTree)
+
+            renderCost = None
+            if(options.estimateCost or options.costBudget != None):
+                renderCost = XNodifyContext.estimateRenderCost(matNodeTree, \
+                    lineNodeTables, options.costBudget, warnings)
 
             dispTreeTables = []
             for i in range(lineCnt):
+                start = time.perf_counter()
                 nType, nodeTreeTable, actLineCnt, evalNode = lineNodeTables[i]
                 isDisplayed = XNodifyContext.isLineDisplayed(nType, varTable)
                 augNodeGraph = NodeLayout.insertVarNodes(nodeTreeTable, \
                     matNodeTree, varNodeGraphs, i, isDisplayed)
                 nodeTreeTable[matNodeTree] = augNodeGraph
+                costReport.addTime(actLineCnt, 'layout', \
+                    time.perf_counter() - start)
                 if(isDisplayed):
                     dispTreeTables.append((actLineCnt, nodeTreeTable))
+                yield JobProgress('layout', i + 1, lineCnt)
 
+            for lineCost, varInfo in lineVars:
+                lineCost.uses += varInfo[2]
             displayParams = DisplayParams(dispTreeTables, allDispNodesTable, \
                 matNodeTree, location, scale, alignment, \
-                    addFrame, frameTitle, warnings)
+                    addFrame, frameTitle, warnings, optCounters, varTable, \
+                        costReport = costReport, renderCost = renderCost)
+            # After generation, so that unused groups of earlier runs are reused
+            BraceEvaluator.removeOrphanGroups(matNodeTree)
             return displayParams
 
+        except GeneratorExit: # Cancelled
+            XNodifyContext.rollback(matNodeTree, existingNodes)
+            raise
         except Exception as e:
-            controller.removeAllNodes(varNodeGraphs.keys())
+            XNodifyContext.rollback(matNodeTree, existingNodes)
             raise SyntaxError('Line: ' + str(actLineCnt) + ': ' + str(e))
 
+    def parseLines(self, lineFeeder, importDir = None):
+        return GenerationJob(self.iterParseLines(lineFeeder, importDir)).run()
+
+    # Parses all the lines and checks the whole program before any node is
+    # created, so that failed runs don't need to remove nodes.
+    # Returns list of (line no, expression, data tree) of non-comment lines
+    # Parse time of each line is added to costReport (if given)
+    def iterParseLines(self, lineFeeder, importDir = None, costReport = None):
+        program = []
+        errors = []
+        hardReplaceTable = {}
+        imported = set() # Keys of the imported modules (once per run)
+        loopCnt = [0] # For the unique names of the hidden loop variables
+
+        # Hidden variables of loops are not available for hard replacement
+        def addLine(actLineCnt, expression, dataTree, replaceable = True):
+            program.append((actLineCnt, expression, dataTree))
+            if(replaceable and dataTree.getMetaData().id == '='):
+                lhs, rhs = expression.split('#')[0].split('=', 1)
+                hardReplaceTable[lhs.strip()] = rhs.strip()
+
+        def parseLine(actLineCnt, expression, prefix = ''):
+            expression = XNodifyContext.hardReplace(expression.strip(), \
+                hardReplaceTable)
+            try:
+                if(loops.getLoopHeader(expression) != None):
+                    loopCnt[0] += 1
+                    lines = loops.expandLoop(expression, SymbolData, \
+                        loopCnt[0])
+                else:
+                    dataTree = Parser.parse(expression, SymbolData)
+                    lines = [(expression, dataTree)] \
+                        if dataTree != None else []
+            except Exception as e:
+                errors.append((actLineCnt, prefix + \
+                    checker.getErrorMessage(e)))
+                lines = []
+            for lineExpr, dataTree in lines:
+                addLine(actLineCnt, lineExpr, dataTree, \
+                    not lineExpr.startswith(loops.HIDDEN_PREFIX))
+
+        # Lines of the imported module are added with the line number of
+        # the import directive (errors have the module line as prefix)
+        def addImport(actLineCnt, name, baseDir, prefix = ''):
+            try:
+                module = importer.loadModule(name, baseDir, SymbolData)
+            except SyntaxError as e:
+                errors.append((actLineCnt, prefix + str(e)))
+                return
+            if(module.key in imported): return
+            imported.add(module.key)
+            for lineNo, expression, treeData, error in module.lines:
+                linePrefix = prefix + module.name + ': Line: ' + \
+                    str(lineNo) + ': '
+                subName = importer.getImportName(expression)
+                if(subName != None):
+                    addImport(actLineCnt, subName, module.dirPath, linePrefix)
+                elif(treeData != None):
+                    addLine(actLineCnt, expression, \
+                        importer.decodeTree(treeData, SymbolData))
+                elif(error != None):
+                    errors.append((actLineCnt, linePrefix + error))
+                else: # Hard replacements of the importing script
+                    parseLine(actLineCnt, expression, linePrefix)
+
+        actLineCnt = 1
+        expression = next(lineFeeder)
+        while(expression != None):
+            start = time.perf_counter()
+            lineCnt = len(program)
+            importName = importer.getImportName(expression)
+            if(importName != None):
+                addImport(actLineCnt, importName, importDir)
+            else:
+                parseLine(actLineCnt, expression)
+            if(costReport != None and len(program) > lineCnt):
+                costReport.getLineCost(actLineCnt, expression.strip())
+                costReport.addTime(actLineCnt, 'parse', \
+                    time.perf_counter() - start)
+            yield JobProgress('parse', actLineCnt)
+            expression = next(lineFeeder)
+            actLineCnt += 1
+
+        lineTrees = [(p[0], p[2]) for p in program]
+        errors += checker.checkProgram(lineTrees)
+        if(len(errors) == 0):
+            errors += typeinfer.inferTypes(lineTrees)
+        yield JobProgress('check', 1, 1)
+        if(len(errors) > 0):
+            raise SyntaxError('\n'.join('Line: ' + str(lineNo) + ': ' + msg \
+                for lineNo, msg in sorted(errors, key = lambda e: e[0])))
+        return program
+
 def getActiveMatTree():
     obj = bpy.context.active_object
     if(obj == None):
@@ -625,16 +1122,57 @@ def getActiveMatTree():
     mat.use_nodes = True
     return mat.node_tree
 
-def procScript(scriptName, location, scale, alignment, addFrame, minimized):
+# Active materials of the selected objects (each material only once)
+def getSelectedMaterials():
+    mats = []
+    for obj in bpy.context.selected_objects:
+        mat = obj.active_material
+        if(mat != None and mat not in mats):
+            mat.use_nodes = True
+            mats.append(mat)
+    return mats
+
+# Returns GenerationJob of the generator (to be run by the caller) if asJob
+# is True, otherwise runs it and returns DisplayParams
+def runGenerator(generator, asJob):
+    job = GenerationJob(generator)
+    return job if asJob else job.run()
+
+# Generator of the nodes for the script lines, either added to the tree or
+# updated in place if options.reconcile (see reconcile)
+def generateNodes(lineFeeder, matNodeTree, location, scale, alignment, \
+    addFrame, minimized, frameTitle = None, options = None):
+    if(options != None and options.reconcile):
+        from .reconcile import generateReconcile # Only when used
+        return generateReconcile(lineFeeder, matNodeTree, location, scale, \
+            alignment, addFrame, minimized, frameTitle, options)
+    return XNodifyContext().generateExpressions(lineFeeder, matNodeTree, \
+        location, scale, alignment, addFrame, minimized, frameTitle, options)
+
+def procScript(scriptName, location, scale, alignment, addFrame, minimized, \
+    options = None, asJob = False):
     def scriptLineFeeder(scriptName):
         for line in bpy.data.texts[scriptName].lines:
             yield line.body
         yield None
 
-    return XNodifyContext().processExpressions(scriptLineFeeder(scriptName), \
-        getActiveMatTree(), location, scale, alignment, addFrame, minimized)
+    return runGenerator(generateNodes(scriptLineFeeder(scriptName), \
+        getActiveMatTree(), location, scale, alignment, addFrame, minimized, \
+            options = options), asJob)
+
+# Options with the folder of the script as import directory (if not given)
+def getFileOptions(options, filePath):
+    options = copy.copy(options) if options != None else CompileOptions()
+    if(options.importDir == None):
+        options.importDir = os.path.dirname(os.path.abspath(filePath))
+    return options
+
+def procFile(filePath, location, scale, alignment, addFrame, minimized, \
+    options = None, asJob = False):
+    if(filePath.endswith(graphformat.GRAPH_EXT)):
+        return runGenerator(generateGraphFile(filePath, location), asJob)
+    options = getFileOptions(options, filePath)
 
-def procFile(filePath, location, scale, alignment, addFrame, minimized):
     def fileLineFeeder(filePath):
         with open(filePath) as f:
             line = f.readline()
@@ -643,11 +1181,12 @@ def procFile(filePath, location, scale, alignment, addFrame, minimized):
                 line = f.readline()
         yield None
 
-    return XNodifyContext().processExpressions(fileLineFeeder(filePath), \
-        getActiveMatTree(), location, scale, alignment, addFrame, minimized)
+    return runGenerator(generateNodes(fileLineFeeder(filePath), \
+        getActiveMatTree(), location, scale, alignment, addFrame, minimized, \
+            options = options), asJob)
 
 def procStringExpression(expression, location, scale, alignment, \
-    addFrame, minimized):
+    addFrame, minimized, options = None, asJob = False):
     def feeder():
         f = StringIO(expression)
         line = f.readline()
@@ -657,6 +1196,18 @@ def procStringExpression(expression, location, scale, alignment, \
         yield None
 
 
-    return XNodifyContext().processExpressions(feeder(), getActiveMatTree(), \
-        location, scale, alignment, addFrame, minimized, 'Expression')
+    return runGenerator(generateNodes(feeder(), getActiveMatTree(), \
+        location, scale, alignment, addFrame, minimized, 'Expression', \
+            options), asJob)
+
+def procGraphFile(filePath, location):
+    return runGenerator(generateGraphFile(filePath, location), False)
 
+# Compiled graph (e.g. from python -m xnodify), nothing to parse or lay out
+def generateGraphFile(filePath, location):
+    yield JobProgress('generate', 0, 1)
+    matNodeTree = getActiveMatTree()
+    with open(filePath) as f:
+        graphformat.loads(f.read(), matNodeTree, location)
+    return DisplayParams([], {}, matNodeTree, location, (1, 1), None, \
+        False, None, {})
@@ -0,0 +1,510 @@
+#
+# In-memory node model for XNodify.
+# Mirrors the subset of the bpy node tree API used by evaluator and main,
+# so that scripts can be compiled without Blender (see compiler.py)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import re
+
+from .lookups import fnMap, mathFnMap, vmathFnMap
+from .lookups import reverseLookup, getOutputType
+from .lookups import SHADER_GROUP, SHADER_MATH, SHADER_VMATH, SHADER_SCRIPT
+from .schema import getNodeSchema
+
+GROUP_INPUT = 'NodeGroupInput'
+GROUP_OUTPUT = 'NodeGroupOutput'
+NODE_FRAME = 'NodeFrame'
+
+socketIdNames = {'VALUE': 'NodeSocketFloat', 'VECTOR': 'NodeSocketVector', \
+    'RGBA': 'NodeSocketColor', 'SHADER': 'NodeSocketShader', \
+        'INT': 'NodeSocketInt', 'STRING': 'NodeSocketString', \
+            'CUSTOM': 'NodeSocketVirtual'}
+
+socketDefaults = {'VALUE': 0.0, 'VECTOR': (0.0, 0.0, 0.0), \
+    'RGBA': (0.8, 0.8, 0.8, 1.0)}
+
+# Socket types of the OSL shader parameters (see Node.script)
+oslSocketTypes = {'float': 'VALUE', 'int': 'INT', 'vector': 'VECTOR', \
+    'point': 'VECTOR', 'normal': 'VECTOR', 'color': 'RGBA', \
+        'closure color': 'SHADER', 'string': 'STRING'}
+OSL_PARAM_PATTERN = re.compile(r'^\s*(output\s+)?(closure\s+color|\w+)\s+' + \
+    r'(\w+)\s*=')
+
+# Stand-in for mathutils.Vector (only what layout code needs)
+class Vector:
+    def __init__(self, values = (0, 0)):
+        self._values = [float(v) for v in values]
+
+    def __getitem__(self, idx):
+        return self._values[idx]
+
+    def __setitem__(self, idx, value):
+        self._values[idx] = float(value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __add__(self, other):
+        return Vector([a + b for a, b in zip(self, other)])
+
+    def __sub__(self, other):
+        return Vector([a - b for a, b in zip(self, other)])
+
+    def __neg__(self):
+        return Vector([-a for a in self])
+
+    def __mul__(self, scalar):
+        return Vector([a * scalar for a in self])
+
+    def __eq__(self, other):
+        try: return list(self) == list(other)
+        except TypeError: return False
+
+    def __repr__(self):
+        return 'Vector(' + str(tuple(self._values)) + ')'
+
+    def copy(self):
+        return Vector(self._values)
+
+def getSocketType(bl_idname):
+    for sockType, idName in socketIdNames.items():
+        if(bl_idname.startswith(idName)): return sockType
+    return 'VALUE'
+
+# Custom (ID) property support i.e. node['key'] = value
+class PropHolder:
+    def __getitem__(self, key):
+        return self._props[key]
+
+    def __setitem__(self, key, value):
+        self._props[key] = value
+
+    def __contains__(self, key):
+        return key in self._props
+
+    def get(self, key, default = None):
+        return self._props.get(key, default)
+
+    def keys(self):
+        return self._props.keys()
+
+class NamedCollection:
+    def __init__(self):
+        self._items = []
+
+    def __getitem__(self, key):
+        if(isinstance(key, str)):
+            item = self.get(key)
+            if(item == None): raise KeyError(key)
+            return item
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, name, default = None):
+        for item in self._items:
+            if(item.name == name): return item
+        return default
+
+    def keys(self):
+        return [item.name for item in self._items]
+
+    def getUniqueName(self, name, item = None):
+        names = set(i.name for i in self._items if i != item)
+        if(name not in names): return name
+        i = 1
+        while(name + '.%03d' % i in names): i += 1
+        return name + '.%03d' % i
+
+class SocketCollection(NamedCollection):
+    def get(self, name, default = None):
+        for item in self._items:
+            if(item.name == name or item.identifier == name): return item
+        return default
+
+class NodeSocket:
+    def __init__(self, node, name, sockType, isOutput, default = None):
+        self.node = node
+        self.name = name
+        self.identifier = name
+        self.type = sockType
+        self.bl_idname = socketIdNames.get(sockType, socketIdNames['VALUE'])
+        self.is_output = isOutput
+        self.enabled = True
+        self.hide = False
+        self.links = []
+        # Like bpy, shader and virtual sockets don't have default_value
+        if(isinstance(default, (tuple, list))):
+            self.default_value = list(default)
+        elif(isinstance(default, str)):
+            self.default_value = default
+        elif(default != None):
+            self.default_value = float(default)
+
+    @property
+    def is_linked(self):
+        return len(self.links) > 0
+
+    def __repr__(self):
+        return '<Socket ' + self.node.name + '.' + self.name + '>'
+
+class NodeLink:
+    def __init__(self, fromSocket, toSocket):
+        self.from_socket = fromSocket
+        self.to_socket = toSocket
+        self.from_node = fromSocket.node
+        self.to_node = toSocket.node
+        self.is_valid = True
+
+class Node(PropHolder):
+    def __init__(self, tree, bl_idname):
+        self.id_data = tree
+        self.bl_idname = bl_idname
+        self.type = bl_idname
+        self._name = ''
+        self.label = ''
+        self._location = Vector((0, 0))
+        self.dimensions = Vector((0, 0)) # Never drawn, see getNodeDimensions
+        self.width = 140.0
+        self.hide = False
+        self.mute = False
+        self.select = True
+        self.parent = None
+        self.inputs = SocketCollection()
+        self.outputs = SocketCollection()
+        self._operation = None
+        self._nodeTree = None
+        self._script = None
+        self.mode = 'INTERNAL' # Only for ShaderNodeScript
+        self._props = {}
+        for isOutput in (False, True):
+            for name, sockType, default, enabled in \
+                getSocketSpec(bl_idname, isOutput):
+                self.addSocket(name, sockType, isOutput, default).enabled = \
+                    enabled
+        if(bl_idname in {SHADER_MATH, SHADER_VMATH}):
+            self.operation = 'ADD'
+
+    def __repr__(self):
+        return '<Node ' + self.name + '>'
+
+    # Like bpy, names are kept unique within the tree
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = self.id_data.nodes.getUniqueName(name, self)
+
+    @property
+    def location(self):
+        return self._location
+
+    @location.setter
+    def location(self, location):
+        self._location = Vector(location)
+
+    def addSocket(self, name, sockType, isOutput, default = None, idx = None):
+        sockets = self.outputs if isOutput else self.inputs
+        socket = NodeSocket(self, name, sockType, isOutput, default)
+        # Like bpy, identifiers of sockets with the same name are numbered
+        # e.g. Value, Value_001, Value_002
+        identifiers = set(s.identifier for s in sockets)
+        i = 1
+        while(socket.identifier in identifiers):
+            socket.identifier = name + '_%03d' % i
+            i += 1
+        if(idx == None): sockets._items.append(socket)
+        else: sockets._items.insert(idx, socket)
+        return socket
+
+    @property
+    def operation(self):
+        return self._operation
+
+    @operation.setter
+    def operation(self, operation):
+        self._operation = operation
+        updateEnabledSockets(self)
+
+    # Only for ShaderNodeGroup
+    @property
+    def node_tree(self):
+        return self._nodeTree
+
+    @node_tree.setter
+    def node_tree(self, tree):
+        if(self._nodeTree != None): self._nodeTree.users -= 1
+        self._nodeTree = tree
+        self.inputs._items = []
+        self.outputs._items = []
+        if(tree != None):
+            tree.users += 1
+            for sock in tree.inputs:
+                self.addSocket(sock.name, sock.type, False, \
+                    socketDefaults.get(sock.type))
+            for sock in tree.outputs:
+                self.addSocket(sock.name, sock.type, True)
+
+    # Only for ShaderNodeScript, sockets are created from the parameters of
+    # the shader, as Cycles does when it compiles the script
+    @property
+    def script(self):
+        return self._script
+
+    @script.setter
+    def script(self, text):
+        self._script = text
+        for socket in list(self.inputs) + list(self.outputs):
+            for link in list(socket.links): self.id_data.links.remove(link)
+        self.inputs._items = []
+        self.outputs._items = []
+        if(text != None):
+            for isOutput, name, sockType in getShaderParams(text.as_string()):
+                self.addSocket(name, sockType, isOutput, \
+                    socketDefaults.get(sockType))
+
+# (is output, name, socket type) of the parameters of the OSL shader
+def getShaderParams(source):
+    match = re.search(r'\bshader\s+\w+\s*\(', source)
+    if(match == None): return []
+    params, depth, start = [], 0, match.end()
+    for i in range(start, len(source)):
+        if(source[i] == '('): depth += 1
+        elif(source[i] == ')' and depth > 0): depth -= 1
+        elif(source[i] in {',', ')'} and depth == 0):
+            params.append(source[start:i])
+            start = i + 1
+            if(source[i] == ')'): break
+    specs = []
+    for param in params:
+        match = OSL_PARAM_PATTERN.match(param)
+        if(match != None and match.group(2) in oslSocketTypes):
+            specs.append((match.group(1) != None, match.group(3), \
+                oslSocketTypes[match.group(2)]))
+    return specs
+
+# Counterpart of bpy.types.Text (script source of Script nodes)
+class Text:
+    def __init__(self, name):
+        self.name = name
+        self._content = ''
+
+    def write(self, content):
+        self._content += content
+
+    def clear(self):
+        self._content = ''
+
+    def as_string(self):
+        return self._content
+
+class Texts(NamedCollection):
+    def new(self, name):
+        text = Text(self.getUniqueName(name))
+        self._items.append(text)
+        return text
+
+    def remove(self, text):
+        self._items.remove(text)
+
+class InterfaceSocket:
+    def __init__(self, bl_idname, name):
+        self.bl_idname = bl_idname
+        self.name = name
+        self.type = getSocketType(bl_idname)
+
+# Group interface (tree.inputs / tree.outputs of Blender 2.8 - 3.x)
+class Interface(NamedCollection):
+    def __init__(self, tree, isOutput):
+        super(Interface, self).__init__()
+        self.tree = tree
+        self.isOutput = isOutput
+
+    def new(self, bl_idname, name):
+        sock = InterfaceSocket(bl_idname, name)
+        self._items.append(sock)
+        # Group input node has outputs & group output node has inputs
+        ioType = GROUP_OUTPUT if self.isOutput else GROUP_INPUT
+        for node in self.tree.nodes:
+            if(node.bl_idname == ioType):
+                sockets = node.inputs if self.isOutput else node.outputs
+                node.addSocket(name, sock.type, not self.isOutput, \
+                    socketDefaults.get(sock.type), len(sockets) - 1)
+        if(self.tree.nodeGroups != None):
+            for user in self.tree.nodeGroups.getGroupNodes(self.tree):
+                user.addSocket(name, sock.type, self.isOutput, \
+                    None if self.isOutput else socketDefaults.get(sock.type))
+        return sock
+
+class Nodes(NamedCollection):
+    def __init__(self, tree):
+        super(Nodes, self).__init__()
+        self.tree = tree
+
+    def new(self, type):
+        node = Node(self.tree, type)
+        self._items.append(node)
+        node.name = getDefaultName(type)
+        if(type in {GROUP_INPUT, GROUP_OUTPUT}):
+            isOutput = (type == GROUP_OUTPUT)
+            for sock in (self.tree.outputs if isOutput else self.tree.inputs):
+                node.addSocket(sock.name, sock.type, not isOutput, \
+                    socketDefaults.get(sock.type))
+            node.addSocket('', 'CUSTOM', not isOutput)
+        return node
+
+    def remove(self, node):
+        for socket in list(node.inputs) + list(node.outputs):
+            for link in list(socket.links):
+                self.tree.links.remove(link)
+        for child in self._items:
+            if(child.parent == node): child.parent = None
+        if(node.bl_idname == SHADER_GROUP): node.node_tree = None
+        self._items.remove(node)
+
+class Links(NamedCollection):
+    def __init__(self, tree):
+        super(Links, self).__init__()
+        self.tree = tree
+
+    # Same argument handling as bpy: sockets can be passed in any order
+    def new(self, fromSocket, toSocket):
+        if(not fromSocket.is_output): fromSocket, toSocket = toSocket, fromSocket
+        for link in list(toSocket.links): # Input socket takes only one link
+            self.remove(link)
+        link = NodeLink(fromSocket, toSocket)
+        fromSocket.links.append(link)
+        toSocket.links.append(link)
+        self._items.append(link)
+        return link
+
+    def remove(self, link):
+        link.from_socket.links.remove(link)
+        link.to_socket.links.remove(link)
+        link.is_valid = False
+        self._items.remove(link)
+
+    def clear(self):
+        for link in list(self._items): self.remove(link)
+
+class NodeTree(PropHolder):
+    def __init__(self, name, bl_idname = 'ShaderNodeTree', nodeGroups = None):
+        self.name = name
+        self.bl_idname = bl_idname
+        self.nodeGroups = nodeGroups
+        self.users = 0
+        self.view_center = Vector((0, 0))
+        self.nodes = Nodes(self)
+        self.links = Links(self)
+        self.inputs = Interface(self, False)
+        self.outputs = Interface(self, True)
+        self._props = {}
+
+    def __repr__(self):
+        return '<NodeTree ' + self.name + '>'
+
+# Counterpart of bpy.data.node_groups; trees created here have nodeGroups set
+class NodeGroups(NamedCollection):
+    def __init__(self):
+        super(NodeGroups, self).__init__()
+        self.rootTrees = []
+        self.texts = Texts() # bpy.data.texts
+
+    def new(self, name, type):
+        tree = NodeTree(self.getUniqueName(name), type, self)
+        self._items.append(tree)
+        return tree
+
+    def remove(self, tree):
+        for node in self.getGroupNodes(tree): node.node_tree = None
+        self._items.remove(tree)
+
+    # Top level (e.g. material) tree, not part of the group collection
+    def newRootTree(self, name, type = 'ShaderNodeTree'):
+        tree = NodeTree(name, type, self)
+        self.rootTrees.append(tree)
+        return tree
+
+    def getGroupNodes(self, tree):
+        return [n for t in self.rootTrees + self._items for n in t.nodes \
+            if n.bl_idname == SHADER_GROUP and n.node_tree == tree]
+
+def getDefaultName(bl_idname):
+    if(bl_idname == SHADER_MATH): return 'Math'
+    if(bl_idname == SHADER_VMATH): return 'Vector Math'
+    if(bl_idname == SHADER_GROUP): return 'Group'
+    if(bl_idname == NODE_FRAME): return 'Frame'
+    if(bl_idname == SHADER_SCRIPT): return 'Script'
+    customName = reverseLookup(bl_idname)
+    if(customName != None): return fnMap[customName][2]
+    return bl_idname
+
+def getArity(bl_idname, operation):
+    mp, prefix = (mathFnMap, SHADER_MATH) if bl_idname == SHADER_MATH \
+        else (vmathFnMap, SHADER_VMATH)
+    customName = reverseLookup(prefix + '_' + str(operation))
+    return mp[customName][3] if customName != None else 2
+
+def updateEnabledSockets(node):
+    nodeSchema = getNodeSchema(node.bl_idname)
+    if(nodeSchema != None and node.operation in nodeSchema.ops):
+        for sockets, isOutput in ((node.inputs, False), (node.outputs, True)):
+            enabled = set(nodeSchema.getEnabled(isOutput, node.operation))
+            for i, socket in enumerate(sockets): socket.enabled = i in enabled
+    elif(node.bl_idname == SHADER_MATH):
+        arity = getArity(SHADER_MATH, node.operation)
+        for i, ip in enumerate(node.inputs): ip.enabled = i < arity
+    elif(node.bl_idname == SHADER_VMATH):
+        arity = getArity(SHADER_VMATH, node.operation)
+        isScale = (node.operation == 'SCALE')
+        for i, ip in enumerate(node.inputs):
+            ip.enabled = (i in {0, 3}) if isScale else i < min(arity, 3)
+        isValueOp = node.operation in {'DOT_PRODUCT', 'DISTANCE', 'LENGTH'}
+        node.outputs[0].enabled = not isValueOp
+        node.outputs[1].enabled = isValueOp
+
+# Returns list of (name, type, default value, enabled) for inputs or outputs
+def getSocketSpec(bl_idname, isOutput):
+    nodeSchema = getNodeSchema(bl_idname)
+    if(nodeSchema != None):
+        return [(s.name, s.type, s.default, s.enabled) \
+            for s in nodeSchema.getSockets(isOutput)]
+    return [spec + (True,) for spec in \
+        getGenericSocketSpec(bl_idname, isOutput)]
+
+# Without schema: socket counts and output types from lookups
+def getGenericSocketSpec(bl_idname, isOutput):
+    if(bl_idname == SHADER_MATH):
+        return [('Value', 'VALUE', 0.0)] if isOutput \
+            else [('Value', 'VALUE', 0.5)] * 3
+    if(bl_idname == SHADER_VMATH):
+        return [('Vector', 'VECTOR', None), ('Value', 'VALUE', None)] \
+            if isOutput else [('Vector', 'VECTOR', (0.0, 0.0, 0.0))] * 3 + \
+                [('Scale', 'VALUE', 1.0)]
+    if(bl_idname in {SHADER_GROUP, GROUP_INPUT, GROUP_OUTPUT, NODE_FRAME}):
+        return [] # Created from the group interface
+    if(bl_idname == SHADER_SCRIPT):
+        return [] # Created from the shader (see Node.script)
+    customName = reverseLookup(bl_idname)
+    if(customName == None): return []
+    fnInfo = fnMap[customName]
+    if(isOutput):
+        sockTypes = [getOutputType(customName, i) or 'VALUE' \
+            for i in range(fnInfo[4])]
+        return [('Output' if i == 0 else 'Output_%d' % i, sockType, \
+            socketDefaults.get(sockType)) for i, sockType in enumerate(sockTypes)]
+    return [('Input' if i == 0 else 'Input_%d' % i, 'VALUE', 0.0) \
+        for i in range(fnInfo[3])]
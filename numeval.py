@@ -0,0 +1,609 @@
+#
+# Vectorized evaluation of generated node graphs with NumPy, to check what
+# a script computes without rendering. Each socket value is an array over
+# all the samples: (n,) for values, (n, 3) for vectors and (n, 4) for
+# colors. Supported: Math and Vector Math (all operations of lookups),
+# Value, RGB, Clamp, Map Range, Combine / Separate XYZ and RGB, Mix RGB,
+# groups and the input nodes (e.g. texco) for which the samples are given.
+# Results follow Cycles (SVM) including the edge cases e.g. division by zero
+# is 0, sqrt of negative numbers is 0 and so on.
+# Benchmark (samples per second, for random samples of the inputs):
+#   python -m xnodify.numeval script.edf [-s size] [-r runs]
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+try:
+    import numpy as np
+except ImportError: # Optional, needed only for this module
+    np = None
+
+from .lookups import fnMap, reverseLookup, SHADER_GROUP, SHADER_MATH, \
+    SHADER_VMATH, SHADER_VALUE
+from .sockindex import getSocketIndex
+
+# Implicit conversion of colors to values (Cycles: linear_rgb_to_gray)
+RGB_TO_BW = (0.2126729, 0.7151522, 0.0721750)
+
+typeShapes = {'VALUE': (), 'INT': (), 'VECTOR': (3,), 'RGBA': (4,)}
+
+# Input nodes whose outputs are taken from the inputs (see GraphInterpreter)
+inputNodes = {fnInfo[1] for fnInfo in fnMap.values() \
+    if fnInfo[0] == '0' and fnInfo[1] != SHADER_VALUE}
+
+def checkNumPy():
+    if(np == None):
+        raise ImportError('NumPy is needed for numerical evaluation')
+
+def safeDivide(a, b):
+    nonZero = (b != 0)
+    return np.where(nonZero, a / np.where(nonZero, b, 1), 0)
+
+def fract(a):
+    return a - np.floor(a)
+
+def wrap(value, maxValue, minValue):
+    valueRange = maxValue - minValue
+    return np.where(valueRange != 0, value - valueRange * \
+        np.floor(safeDivide(value - minValue, valueRange)), minValue)
+
+def snap(a, b):
+    return np.floor(safeDivide(a, b)) * b
+
+def safeModulo(a, b):
+    nonZero = (b != 0)
+    return np.where(nonZero, np.fmod(a, np.where(nonZero, b, 1)), 0)
+
+def pingPong(a, b):
+    return np.where(b != 0, \
+        np.abs(fract(safeDivide(a - b, b * 2)) * b * 2 - b), 0)
+
+def smoothMin(a, b, c):
+    h = safeDivide(np.maximum(c - np.abs(a - b), 0), c)
+    return np.where(c != 0, np.minimum(a, b) - h * h * h * c / 6, \
+        np.minimum(a, b))
+
+def safePower(a, b):
+    invalid = (a < 0) & (b != np.trunc(b))
+    return np.where(invalid, 0, np.power(np.where(invalid, 1, a), b))
+
+def safeLog(a, b):
+    valid = (a > 0) & (b > 0)
+    return np.where(valid, safeDivide(np.log(np.where(valid, a, 1)), \
+        np.log(np.where(valid, b, 2))), 0)
+
+def dot(a, b):
+    return np.sum(a * b, axis = -1)
+
+def length(a):
+    return np.sqrt(dot(a, a))
+
+def safeNormalize(a):
+    return safeDivide(a, length(a)[..., None])
+
+# Functions of (a, b, c) for the operations of Math node
+mathOps = {
+    'ADD': lambda a, b, c: a + b,
+    'SUBTRACT': lambda a, b, c: a - b,
+    'MULTIPLY': lambda a, b, c: a * b,
+    'DIVIDE': lambda a, b, c: safeDivide(a, b),
+    'MULTIPLY_ADD': lambda a, b, c: a * b + c,
+    'POWER': lambda a, b, c: safePower(a, b),
+    'LOGARITHM': lambda a, b, c: safeLog(a, b),
+    'SQRT': lambda a, b, c: np.sqrt(np.maximum(a, 0)),
+    'INVERSE_SQRT': lambda a, b, c: \
+        np.where(a > 0, 1 / np.sqrt(np.where(a > 0, a, 1)), 0),
+    'ABSOLUTE': lambda a, b, c: np.abs(a),
+    'EXPONENT': lambda a, b, c: np.exp(a),
+    'MINIMUM': lambda a, b, c: np.minimum(a, b),
+    'MAXIMUM': lambda a, b, c: np.maximum(a, b),
+    'LESS_THAN': lambda a, b, c: (a < b).astype(a.dtype),
+    'GREATER_THAN': lambda a, b, c: (a > b).astype(a.dtype),
+    'SIGN': lambda a, b, c: np.sign(a),
+    'COMPARE': lambda a, b, c: \
+        (np.abs(a - b) <= np.maximum(c, 1e-5)).astype(a.dtype),
+    'SMOOTH_MIN': lambda a, b, c: smoothMin(a, b, c),
+    'SMOOTH_MAX': lambda a, b, c: -smoothMin(-a, -b, c),
+    'ROUND': lambda a, b, c: np.floor(a + 0.5),
+    'FLOOR': lambda a, b, c: np.floor(a),
+    'CEIL': lambda a, b, c: np.ceil(a),
+    'TRUNC': lambda a, b, c: np.trunc(a),
+    'FRACT': lambda a, b, c: fract(a),
+    'MODULO': lambda a, b, c: safeModulo(a, b),
+    'WRAP': lambda a, b, c: wrap(a, b, c),
+    'SNAP': lambda a, b, c: snap(a, b),
+    'PINGPONG': lambda a, b, c: pingPong(a, b),
+    'SINE': lambda a, b, c: np.sin(a),
+    'COSINE': lambda a, b, c: np.cos(a),
+    'TANGENT': lambda a, b, c: np.tan(a),
+    'ARCSINE': lambda a, b, c: np.arcsin(np.clip(a, -1, 1)),
+    'ARCCOSINE': lambda a, b, c: np.arccos(np.clip(a, -1, 1)),
+    'ARCTANGENT': lambda a, b, c: np.arctan(a),
+    'ARCTAN2': lambda a, b, c: np.arctan2(a, b),
+    'SINH': lambda a, b, c: np.sinh(a),
+    'COSH': lambda a, b, c: np.cosh(a),
+    'TANH': lambda a, b, c: np.tanh(a),
+    'RADIANS': lambda a, b, c: np.radians(a),
+    'DEGREES': lambda a, b, c: np.degrees(a),
+}
+
+# Functions of (a, b, c, scale) for the operations of Vector Math node
+vmathOps = {
+    'ADD': lambda a, b, c, s: a + b,
+    'SUBTRACT': lambda a, b, c, s: a - b,
+    'MULTIPLY': lambda a, b, c, s: a * b,
+    'DIVIDE': lambda a, b, c, s: safeDivide(a, b),
+    'CROSS_PRODUCT': lambda a, b, c, s: np.cross(a, b),
+    'PROJECT': lambda a, b, c, s: \
+        safeDivide(dot(a, b), dot(b, b))[..., None] * b,
+    'REFLECT': lambda a, b, c, s: a - 2 * \
+        dot(safeNormalize(b), a)[..., None] * safeNormalize(b),
+    'DOT_PRODUCT': lambda a, b, c, s: dot(a, b),
+    'DISTANCE': lambda a, b, c, s: length(a - b),
+    'LENGTH': lambda a, b, c, s: length(a),
+    'SCALE': lambda a, b, c, s: a * s[..., None],
+    'NORMALIZE': lambda a, b, c, s: safeNormalize(a),
+    'ABSOLUTE': lambda a, b, c, s: np.abs(a),
+    'MINIMUM': lambda a, b, c, s: np.minimum(a, b),
+    'MAXIMUM': lambda a, b, c, s: np.maximum(a, b),
+    'FLOOR': lambda a, b, c, s: np.floor(a),
+    'CEIL': lambda a, b, c, s: np.ceil(a),
+    'FRACTION': lambda a, b, c, s: fract(a),
+    'MODULO': lambda a, b, c, s: safeModulo(a, b),
+    'WRAP': lambda a, b, c, s: wrap(a, b, c),
+    'SNAP': lambda a, b, c, s: snap(a, b),
+    'SINE': lambda a, b, c, s: np.sin(a),
+    'COSINE': lambda a, b, c, s: np.cos(a),
+    'TANGENT': lambda a, b, c, s: np.tan(a),
+}
+
+vmathValueOps = {'DOT_PRODUCT', 'DISTANCE', 'LENGTH'}
+
+def smoothStep(edge0, edge1, x):
+    t = safeDivide(x - edge0, edge1 - edge0)
+    return np.where(x < edge0, 0, np.where(x >= edge1, 1, \
+        (3 - 2 * t) * t * t))
+
+def smootherStep(edge0, edge1, x):
+    t = np.clip(safeDivide(x - edge0, edge1 - edge0), 0, 1)
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+def rgbToHsv(rgb):
+    cMax = np.max(rgb, axis = -1)
+    cDelta = cMax - np.min(rgb, axis = -1)
+    s = safeDivide(cDelta, cMax)
+    c = safeDivide(cMax[..., None] - rgb, cDelta[..., None])
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    h = np.where(r == cMax, c[..., 2] - c[..., 1], \
+        np.where(g == cMax, 2 + c[..., 0] - c[..., 2], \
+            4 + c[..., 1] - c[..., 0])) / 6
+    h = np.where(s != 0, np.where(h < 0, h + 1, h), 0)
+    return np.stack([h, s, cMax], axis = -1)
+
+def hsvToRgb(hsv):
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    h = np.where(h == 1, 0, h) * 6
+    i = np.floor(h)
+    f = h - i
+    p, q, t = v * (1 - s), v * (1 - s * f), v * (1 - s * (1 - f))
+    choices = [np.stack(c, axis = -1) for c in \
+        ((v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q))]
+    i = np.clip(i, 0, 5).astype(int)[..., None]
+    rgb = np.choose(np.broadcast_to(i, choices[0].shape), choices)
+    return np.where((s != 0)[..., None], rgb, v[..., None])
+
+def mixHue(c1, c2, t, hsvMix):
+    hsv2 = rgbToHsv(c2)
+    hsv = rgbToHsv(c1)
+    hsvMix(hsv, hsv2)
+    mixed = c1 + t * (hsvToRgb(hsv) - c1)
+    return np.where((hsv2[..., 1] != 0)[..., None], mixed, c1)
+
+def mixSaturation(c1, c2, t):
+    hsv = rgbToHsv(c1)
+    hsv2 = rgbToHsv(c2)
+    sat = hsv[..., 1].copy()
+    hsv[..., 1] = (1 - t[..., 0]) * sat + t[..., 0] * hsv2[..., 1]
+    return np.where((sat != 0)[..., None], hsvToRgb(hsv), c1)
+
+def mixValue(c1, c2, t):
+    hsv = rgbToHsv(c1)
+    hsv[..., 2] = (1 - t[..., 0]) * hsv[..., 2] + \
+        t[..., 0] * rgbToHsv(c2)[..., 2]
+    return hsvToRgb(hsv)
+
+def mixDodge(c1, c2, t):
+    tmp = 1 - t * c2
+    return np.where(c1 != 0, np.where(tmp <= 0, 1, \
+        np.minimum(safeDivide(c1, tmp), 1)), c1)
+
+def mixBurn(c1, c2, t):
+    tmp = 1 - t + t * c2
+    return np.where(tmp <= 0, 0, \
+        np.clip(1 - safeDivide(1 - c1, tmp), 0, 1))
+
+def setHue(hsv, hsv2):
+    hsv[..., 0] = hsv2[..., 0]
+
+def setHueSat(hsv, hsv2):
+    hsv[..., :2] = hsv2[..., :2]
+
+# Functions of (rgb1, rgb2, fac) for the blend types of Mix RGB node
+mixOps = {
+    'MIX': lambda c1, c2, t: c1 + t * (c2 - c1),
+    'ADD': lambda c1, c2, t: c1 + t * c2,
+    'MULTIPLY': lambda c1, c2, t: c1 + t * (c1 * c2 - c1),
+    'SUBTRACT': lambda c1, c2, t: c1 - t * c2,
+    'SCREEN': lambda c1, c2, t: 1 - (1 - t + t * (1 - c2)) * (1 - c1),
+    'DIVIDE': lambda c1, c2, t: \
+        np.where(c2 != 0, (1 - t) * c1 + t * safeDivide(c1, c2), c1),
+    'DIFFERENCE': lambda c1, c2, t: c1 + t * (np.abs(c1 - c2) - c1),
+    'DARKEN': lambda c1, c2, t: c1 + t * (np.minimum(c1, c2) - c1),
+    'LIGHTEN': lambda c1, c2, t: c1 + t * (np.maximum(c1, c2) - c1),
+    'OVERLAY': lambda c1, c2, t: np.where(c1 < 0.5, \
+        c1 * (1 - t + 2 * t * c2), 1 - (1 - t + 2 * t * (1 - c2)) * (1 - c1)),
+    'DODGE': mixDodge,
+    'BURN': mixBurn,
+    'HUE': lambda c1, c2, t: mixHue(c1, c2, t, setHue),
+    'SATURATION': mixSaturation,
+    'VALUE': mixValue,
+    'COLOR': lambda c1, c2, t: mixHue(c1, c2, t, setHueSat),
+    'SOFT_LIGHT': lambda c1, c2, t: (1 - t) * c1 + t * ((1 - c1) * c2 * c1 + \
+        c1 * (1 - (1 - c2) * (1 - c1))),
+    'LINEAR_LIGHT': lambda c1, c2, t: c1 + t * (2 * c2 - 1),
+}
+
+def clampRange(value, minValue, maxValue):
+    return np.minimum(np.maximum(value, minValue), maxValue)
+
+# Implicit socket conversions of Cycles
+def convertValue(value, fromType, toType):
+    if(fromType == 'INT'): fromType = 'VALUE'
+    if(toType == 'INT'): toType = 'VALUE'
+    if(fromType == toType): return value
+    if(toType == 'VALUE'):
+        if(fromType == 'VECTOR'): return np.mean(value, axis = -1)
+        if(fromType == 'RGBA'):
+            return np.dot(value[..., :3], np.array(RGB_TO_BW, value.dtype))
+    elif(toType == 'VECTOR'):
+        if(fromType == 'VALUE'): return np.repeat(value[..., None], 3, -1)
+        if(fromType == 'RGBA'): return value[..., :3]
+    elif(toType == 'RGBA'):
+        if(fromType == 'VALUE'): value = np.repeat(value[..., None], 3, -1)
+        if(fromType in {'VALUE', 'VECTOR'}):
+            return np.concatenate([value, np.ones_like(value[..., :1])], -1)
+    raise ValueError('Cannot convert ' + fromType + ' to ' + toType)
+
+# Values within one (group) node tree; child frames for the group nodes
+class Frame:
+    def __init__(self, groupNode = None, parent = None):
+        self.groupNode = groupNode
+        self.parent = parent
+        self.cache = {} # node: list of output values
+        self.children = {}
+
+    def getChild(self, groupNode):
+        child = self.children.get(groupNode)
+        if(child == None):
+            child = Frame(groupNode, self)
+            self.children[groupNode] = child
+        return child
+
+def getGroupOutputNode(nodeTree):
+    outputs = [n for n in nodeTree.nodes if n.bl_idname == 'NodeGroupOutput']
+    active = [n for n in outputs if getattr(n, 'is_active_output', False)]
+    return (active + outputs)[0] if len(outputs) > 0 else None
+
+def getLink(socket):
+    for link in socket.links:
+        if(link.is_valid and not getattr(link, 'is_muted', False)):
+            return link
+    return None
+
+def getSocketPos(sockets, socket):
+    for i, s in enumerate(sockets):
+        if(s == socket): return i
+    return None
+
+# Evaluates the output sockets of a (bpy or nodemodel) node tree for the
+# samples in inputs: {node name or custom name of input node (e.g. texco):
+# array (used for all outputs) or {output socket name: array}}.
+# Value nodes with a name in inputs (e.g. undeclared script variables) take
+# their value from inputs too. count: number of samples (default: from inputs)
+class GraphInterpreter:
+    def __init__(self, inputs = None, count = None, dtype = None):
+        checkNumPy()
+        self.inputs = inputs if inputs != None else {}
+        self.dtype = dtype if dtype != None else np.float32
+        self.count = count if count != None else self.getInputCount()
+        self.frame = Frame()
+
+    def getInputCount(self):
+        for value in self.inputs.values():
+            values = value.values() if isinstance(value, dict) else [value]
+            for v in values:
+                if(np.ndim(v) > 0): return len(v)
+        return 1
+
+    def getConstant(self, value, sockType):
+        shape = (self.count,) + typeShapes[sockType]
+        value = np.asarray(value, self.dtype)
+        if(sockType == 'RGBA' and value.shape[-1:] == (3,)):
+            value = np.append(value, 1).astype(self.dtype)
+        return np.broadcast_to(value, shape)
+
+    def getInputSample(self, node, socket):
+        value = self.inputs.get(node.name) # Arrays can't be compared to None
+        if(value is None):
+            value = self.inputs.get(reverseLookup(node.bl_idname))
+        if(isinstance(value, dict)): value = value.get(socket.name)
+        if(value is None):
+            return None
+        return self.getConstant(value, socket.type)
+
+    # Returns the value of the output socket of the top level tree
+    def getSocketValue(self, socket):
+        node = socket.node
+        outputs = self.getNodeOutputs(node, self.frame)
+        return outputs[getSocketPos(node.outputs, socket)]
+
+    # Value (converted to the socket type) of the input socket at idx
+    # Source nodes must have been evaluated (see getDependencies)
+    def getInput(self, node, idx, frame):
+        socket = node.inputs[idx]
+        link = getLink(socket)
+        if(link == None):
+            if(not hasattr(socket, 'default_value')):
+                return None # e.g. shader sockets
+            return self.getConstant(socket.default_value, socket.type)
+        value = frame.cache[link.from_node][\
+            getSocketPos(link.from_node.outputs, link.from_socket)]
+        if(value is None): return None
+        return convertValue(value, link.from_socket.type, socket.type)
+
+    # (node, frame) pairs that need to be evaluated before the node
+    def getDependencies(self, node, frame):
+        if(node.bl_idname == SHADER_GROUP):
+            outNode = getGroupOutputNode(node.node_tree) \
+                if node.node_tree != None else None
+            return [(outNode, frame.getChild(node))] if outNode != None else []
+        if(node.bl_idname == 'NodeGroupInput'):
+            if(frame.groupNode == None): return []
+            node, frame = frame.groupNode, frame.parent
+        deps = []
+        for socket in node.inputs:
+            link = getLink(socket)
+            if(link != None): deps.append((link.from_node, frame))
+        return deps
+
+    # Evaluates the node (and the ones it depends on) without recursion,
+    # so that long chains of nodes don't hit the recursion limit
+    def getNodeOutputs(self, node, frame):
+        stack = [(node, frame)]
+        while(len(stack) > 0):
+            currNode, currFrame = stack[-1]
+            if(currNode in currFrame.cache):
+                stack.pop()
+                continue
+            pending = [(n, f) for n, f in \
+                self.getDependencies(currNode, currFrame) if n not in f.cache]
+            if(len(pending) > 0):
+                stack += pending
+                continue
+            stack.pop()
+            currFrame.cache[currNode] = self.evaluateNode(currNode, currFrame)
+        return frame.cache[node]
+
+    def evaluateNode(self, node, frame):
+        bl_idname = node.bl_idname
+        getInput = lambda idx: self.getInput(node, idx, frame)
+        if(bl_idname == SHADER_MATH):
+            result = mathOps[node.operation](getInput(0), getInput(1), \
+                getInput(2))
+            if(getattr(node, 'use_clamp', False)):
+                result = np.clip(result, 0, 1)
+            return [result.astype(self.dtype)]
+        if(bl_idname == SHADER_VMATH):
+            result = vmathOps[node.operation](getInput(0), getInput(1), \
+                getInput(2), getInput(3)).astype(self.dtype)
+            if(node.operation in vmathValueOps):
+                return [self.getConstant(0, 'VECTOR'), result]
+            return [result, self.getConstant(0, 'VALUE')]
+        if(bl_idname in {SHADER_VALUE, 'ShaderNodeRGB'}):
+            socket = node.outputs[0]
+            value = self.getInputSample(node, socket)
+            return [value if value is not None \
+                else self.getConstant(socket.default_value, socket.type)]
+        if(bl_idname == 'ShaderNodeClamp'):
+            value, minValue, maxValue = getInput(0), getInput(1), getInput(2)
+            if(getattr(node, 'clamp_type', 'MINMAX') == 'RANGE'):
+                minValue, maxValue = np.minimum(minValue, maxValue), \
+                    np.maximum(minValue, maxValue)
+            return [clampRange(value, minValue, maxValue)]
+        if(bl_idname == 'ShaderNodeMapRange'):
+            return [self.mapRange(node, [getInput(i) \
+                for i in range(len(node.inputs))])]
+        if(bl_idname == 'ShaderNodeCombineXYZ'):
+            return [np.stack([getInput(0), getInput(1), getInput(2)], -1)]
+        if(bl_idname == 'ShaderNodeSeparateXYZ'):
+            vector = getInput(0)
+            return [vector[..., 0], vector[..., 1], vector[..., 2]]
+        if(bl_idname == 'ShaderNodeCombineRGB'):
+            rgb = [getInput(0), getInput(1), getInput(2)]
+            return [np.stack(rgb + [np.ones_like(rgb[0])], -1)]
+        if(bl_idname == 'ShaderNodeSeparateRGB'):
+            color = getInput(0)
+            return [color[..., 0], color[..., 1], color[..., 2]]
+        if(bl_idname == 'ShaderNodeMixRGB'):
+            fac = np.clip(getInput(0), 0, 1)[..., None]
+            c1, c2 = getInput(1), getInput(2)
+            blendType = getattr(node, 'blend_type', 'MIX')
+            rgb = mixOps[blendType](c1[..., :3], c2[..., :3], fac)
+            if(getattr(node, 'use_clamp', False)): rgb = np.clip(rgb, 0, 1)
+            return [convertValue(rgb.astype(self.dtype), 'VECTOR', 'RGBA')]
+        if(bl_idname == 'NodeReroute'):
+            return [getInput(0)]
+        if(bl_idname == SHADER_GROUP):
+            child = frame.getChild(node)
+            outNode = getGroupOutputNode(node.node_tree) \
+                if node.node_tree != None else None
+            if(outNode == None): return [None] * len(node.outputs)
+            values = child.cache[outNode]
+            return [convertValue(v, s.type, o.type) if v is not None else \
+                None for v, s, o in zip(values, outNode.inputs, node.outputs)]
+        if(bl_idname == 'NodeGroupOutput'):
+            return [getInput(i) for i in range(len(node.inputs))]
+        if(bl_idname == 'NodeGroupInput'):
+            if(frame.groupNode == None): return [None] * len(node.outputs)
+            groupNode = frame.groupNode
+            return [self.getInput(groupNode, i, frame.parent) \
+                if i < len(groupNode.inputs) else None \
+                    for i in range(len(node.outputs))]
+        if(bl_idname in inputNodes):
+            values = [self.getInputSample(node, s) for s in node.outputs]
+            if(all(v is None for v in values)):
+                raise ValueError('No samples given for the input node: ' + \
+                    node.name)
+            return values
+        raise ValueError('Unsupported node: ' + node.name + \
+            ' (' + bl_idname + ')')
+
+    def mapRange(self, node, inputs):
+        value, fromMin, fromMax, toMin, toMax = inputs[:5]
+        interpolation = getattr(node, 'interpolation_type', 'LINEAR')
+        if(interpolation in {'LINEAR', 'STEPPED'}):
+            factor = safeDivide(value - fromMin, fromMax - fromMin)
+            if(interpolation == 'STEPPED'):
+                steps = inputs[5] if len(inputs) > 5 \
+                    else self.getConstant(4, 'VALUE')
+                factor = np.where(steps > 0, \
+                    safeDivide(np.floor(factor * (steps + 1)), steps), 0)
+        else:
+            step = smoothStep if interpolation == 'SMOOTHSTEP' \
+                else smootherStep
+            factor = np.where(fromMin > fromMax, \
+                1 - step(fromMax, fromMin, value), step(fromMin, fromMax, value))
+        result = np.where(fromMin != fromMax, \
+            toMin + factor * (toMax - toMin), 0)
+        if(getattr(node, 'clamp', True)):
+            result = clampRange(result, np.minimum(toMin, toMax), \
+                np.maximum(toMin, toMax))
+        return result.astype(self.dtype)
+
+# Samples of a width x height grid in 0 - 1 (pixel centers), z = 0
+def getGridCoords(width, height, dtype = None):
+    checkNumPy()
+    dtype = dtype if dtype != None else np.float32
+    x = (np.arange(width, dtype = dtype) + 0.5) / width
+    y = (np.arange(height, dtype = dtype) + 0.5) / height
+    xs, ys = np.meshgrid(x, y)
+    return np.stack([xs.ravel(), ys.ravel(), np.zeros(width * height, dtype)], \
+        -1)
+
+# Values of the script variables (varTable of DisplayParams) {name: array}
+def getVariableValues(varTable, interpreter):
+    values = {}
+    for name, (node, sockIdx, usageCnt) in varTable.items():
+        if(node == None or len(node.outputs) == 0): continue
+        idx = getSocketIndex(node).getIdx(sockIdx if sockIdx != None else 0)
+        if(idx != None):
+            values[name] = interpreter.getSocketValue(node.outputs[idx])
+    return values
+
+def compileVariables(lines, options = None):
+    from .compiler import compileLines # Only when used
+    matNodeTree, displayParams = compileLines(lines, addFrame = False, \
+        options = options)
+    return displayParams.varTable
+
+# Compiles the lines (see compiler.compileLines) and returns the values of
+# all the script variables {name: array}
+def evaluateLines(lines, inputs = None, count = None, options = None):
+    return getVariableValues(compileVariables(lines, options), \
+        GraphInterpreter(inputs, count))
+
+def getGridInputs(width, height, inputs = None):
+    allInputs = {'texco': getGridCoords(width, height)}
+    if(inputs != None): allInputs.update(inputs)
+    return allInputs
+
+# Random samples (0 - 1) of the undeclared variables and of all outputs of
+# the input nodes of the tree (and its groups) of the variables, so that
+# each sample is evaluated on its own as for the pixels of a render
+def getRandomInputs(varTable, count, seed = 0, dtype = None):
+    checkNumPy()
+    dtype = dtype if dtype != None else np.float32
+    rng = np.random.default_rng(seed)
+    getSamples = lambda sockType: rng.random((count,) + \
+        typeShapes.get(sockType, ()), dtype = np.float64).astype(dtype)
+    inputs = {}
+    trees = []
+    for name, (node, sockIdx, usageCnt) in varTable.items():
+        if(node == None): continue
+        if(node.bl_idname == SHADER_VALUE and node.name == name):
+            inputs[name] = getSamples('VALUE')
+        if(node.id_data not in trees): trees.append(node.id_data)
+    for nodeTree in trees: # Grows with the group trees
+        for node in nodeTree.nodes:
+            if(node.bl_idname in inputNodes):
+                samples = inputs.setdefault(reverseLookup(node.bl_idname), {})
+                for socket in node.outputs:
+                    if(socket.name not in samples):
+                        samples[socket.name] = getSamples(socket.type)
+            elif(node.bl_idname == SHADER_GROUP and node.node_tree != None \
+                and node.node_tree not in trees):
+                trees.append(node.node_tree)
+    return inputs
+
+def reshapeGrid(values, width, height):
+    return {name: np.reshape(value, (height, width) + np.shape(value)[1:]) \
+        for name, value in values.items() if value is not None}
+
+# Evaluates the lines for a width x height grid of texture coordinates
+# (all outputs of texco) in one batch. Returns {name: array of shape
+# (height, width) + (3,) for vectors / (4,) for colors}
+def evaluateGrid(lines, width, height, inputs = None, options = None):
+    values = evaluateLines(lines, getGridInputs(width, height, inputs), \
+        width * height, options)
+    return reshapeGrid(values, width, height)
+
+def main():
+    import argparse, time
+    argParser = argparse.ArgumentParser(prog = 'python -m xnodify.numeval', \
+        description = 'Evaluate a script for size x size random samples ' + \
+            'of its inputs with NumPy and report samples per second.')
+    argParser.add_argument('path', help = 'Script file (.edf)')
+    argParser.add_argument('-s', '--size', type = int, default = 512, \
+        help = 'Resolution (size x size samples)')
+    argParser.add_argument('-r', '--runs', type = int, default = 3, \
+        help = 'Number of runs (best one is reported)')
+    args = argParser.parse_args()
+
+    with open(args.path) as f:
+        lines = f.readlines()
+    start = time.perf_counter()
+    varTable = compileVariables(lines)
+    print('Compiled in %.3fs' % (time.perf_counter() - start))
+    size = args.size
+    inputs = getRandomInputs(varTable, size * size)
+    best = None
+    for i in range(args.runs):
+        start = time.perf_counter()
+        values = getVariableValues(varTable, \
+            GraphInterpreter(inputs, size * size))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    values = reshapeGrid(values, size, size)
+    for name in sorted(values):
+        value = values[name]
+        print('%s: shape %s, min %s, max %s, mean %s' % (name, \
+            value.shape, value.min(axis = (0, 1)), value.max(axis = (0, 1)), \
+                value.mean(axis = (0, 1))))
+    samples = size * size
+    print('%d samples in %.3fs (%.0f samples/s)' % \
+        (samples, best, samples / best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#
+# Graph optimizations for the nodes generated by XNodify.
+# Passes work on the created nodes (bpy or in-memory), before layout.
+# Changes are recorded in GraphEdits so that the display tables of main
+# can be updated
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+from .lookups import SHADER_MATH, SHADER_VMATH, SHADER_VALUE, mathFnMap, \
+    reverseLookup
+
+GROUP_OUTPUT = 'NodeGroupOutput'
+
+# Separate / Combine node pairs for component wise math
+COMPONENT_NODES = {'ShaderNodeCombineXYZ': 'ShaderNodeSeparateXYZ', \
+    'ShaderNodeCombineRGB': 'ShaderNodeSeparateRGB'}
+
+# Math operation: (vector math operation, arity)
+VECTOR_OPS = {'ADD': ('ADD', 2), 'SUBTRACT': ('SUBTRACT', 2), \
+    'MULTIPLY': ('MULTIPLY', 2), 'DIVIDE': ('DIVIDE', 2), \
+        'MINIMUM': ('MINIMUM', 2), 'MAXIMUM': ('MAXIMUM', 2), \
+            'MODULO': ('MODULO', 2), 'SNAP': ('SNAP', 2), \
+                'WRAP': ('WRAP', 3), 'ABSOLUTE': ('ABSOLUTE', 1), \
+                    'FLOOR': ('FLOOR', 1), 'CEIL': ('CEIL', 1), \
+                        'FRACT': ('FRACTION', 1), 'SINE': ('SINE', 1), \
+                            'COSINE': ('COSINE', 1), 'TANGENT': ('TANGENT', 1)}
+
+class GraphEdits:
+    def __init__(self, nodes, protected):
+        self.nodes = set(nodes) # Nodes that can be changed
+        self.protected = set(protected) # Can't be removed (e.g. variables)
+        self.replaced = {} # Removed node: node that takes its place
+        # Removed node: output of the replacement with its value, if not the
+        # same index (e.g. a Script node with an output for each node)
+        self.replacedOutputs = {}
+        self.removed = set()
+        self.counters = {} # Name of the pass: count of nodes saved
+
+    def isCandidate(self, node):
+        return node in self.nodes and node not in self.removed
+
+    def addNode(self, nodeTree, bl_idname, label = None):
+        node = nodeTree.nodes.new(bl_idname)
+        if(label != None): node.label = label
+        self.nodes.add(node)
+        return node
+
+    def removeNode(self, node, replacement = None):
+        if(replacement != None):
+            self.replaced[node] = replacement
+            self.protected.discard(node)
+            # Replacement chains e.g. a -> b, b -> c
+            for key, value in self.replaced.items():
+                if(value == node): self.replaced[key] = replacement
+        self.removed.add(node)
+        self.nodes.discard(node)
+        node.id_data.nodes.remove(node)
+
+    def addSaved(self, name, cnt):
+        self.counters[name] = self.counters.get(name, 0) + cnt
+
+    # Moves all the links of the output socket to the new output socket
+    def relinkOutput(self, oldOutput, newOutput):
+        links = newOutput.node.id_data.links
+        for link in list(oldOutput.links):
+            links.new(newOutput, link.to_socket)
+
+def getLinkedOutput(socket):
+    return socket.links[0].from_socket if len(socket.links) > 0 else None
+
+def getEnabledOutput(node):
+    for op in node.outputs:
+        if(op.enabled): return op
+    return None
+
+def getConsumerCnt(node):
+    return sum(len(op.links) for op in node.outputs)
+
+# Operand of the vector node for the component sockets (one per component)
+# Returns ('LINK', socket), ('VALUE', default value) or None
+def getVectorOperand(sockets, sepType, edits):
+    outputs = [getLinkedOutput(s) for s in sockets]
+    if(all(op == None for op in outputs)):
+        try: return ('VALUE', [float(s.default_value) for s in sockets])
+        except (AttributeError, TypeError): return None
+    if(all(op != None and op.node.bl_idname == SHADER_VALUE and \
+        edits.isCandidate(op.node) and op.node not in edits.protected and \
+            getConsumerCnt(op.node) == 1 for op in outputs)): # Number literals
+        return ('VALUE', [float(op.default_value) for op in outputs])
+    if(any(op == None for op in outputs)): return None
+    if(all(op == outputs[0] for op in outputs)): # Scalar, broadcast
+        return ('LINK', outputs[0])
+    # Each component from the corresponding output of a separate node
+    sources = []
+    for i, op in enumerate(outputs):
+        node = op.node
+        if(node.bl_idname != sepType or list(node.outputs).index(op) != i):
+            return None
+        source = getLinkedOutput(node.inputs[0])
+        if(source == None): return None
+        sources.append(source)
+    if(all(s == sources[0] for s in sources)): return ('VECTOR', sources[0])
+    return None
+
+# separate -> per component math -> combine becomes single vector math node
+def collapseComponentMath(edits):
+    for combNode in list(edits.nodes):
+        sepType = COMPONENT_NODES.get(combNode.bl_idname)
+        if(sepType == None or not edits.isCandidate(combNode)): continue
+        mathNodes = [getLinkedOutput(ip) for ip in combNode.inputs[:3]]
+        if(any(op == None or op.node.bl_idname != SHADER_MATH \
+            for op in mathNodes)): continue
+        mathNodes = [op.node for op in mathNodes]
+        operation = mathNodes[0].operation
+        if(operation not in VECTOR_OPS or any(n.operation != operation or \
+            not edits.isCandidate(n) or n in edits.protected or \
+                getConsumerCnt(n) != 1 for n in mathNodes) or \
+                    len(set(mathNodes)) != 3): continue
+        vOperation, arity = VECTOR_OPS[operation]
+        operands = [getVectorOperand([n.inputs[k] for n in mathNodes], \
+            sepType, edits) for k in range(arity)]
+        if(any(op == None for op in operands) or \
+            not any(op[0] == 'VECTOR' for op in operands)): continue
+
+        nodeTree = combNode.id_data
+        vNode = edits.addNode(nodeTree, SHADER_VMATH, mathNodes[0].label)
+        vNode.operation = vOperation
+        vNode.hide = combNode.hide
+        for k, (opType, value) in enumerate(operands):
+            if(opType == 'VALUE'): vNode.inputs[k].default_value = value
+            else: nodeTree.links.new(value, vNode.inputs[k])
+        edits.relinkOutput(combNode.outputs[0], getEnabledOutput(vNode))
+
+        srcNodes = set() # Separate / value nodes, unused if only math used them
+        for n in mathNodes:
+            for ip in n.inputs:
+                op = getLinkedOutput(ip)
+                if(op != None and op.node.bl_idname in {sepType, SHADER_VALUE}):
+                    srcNodes.add(op.node)
+            edits.removeNode(n, vNode)
+        edits.removeNode(combNode, vNode)
+        saved = 3
+        for srcNode in srcNodes:
+            if(getConsumerCnt(srcNode) == 0 and edits.isCandidate(srcNode) \
+                and srcNode not in edits.protected):
+                edits.removeNode(srcNode, vNode)
+                saved += 1
+        edits.addSaved('Component math', saved)
+
+############################ Peephole Rules ############################
+# A rule is called with (edits, node) for each of the candidate math nodes
+# and returns the number of nodes saved (None or 0 if it doesn't apply).
+# Rules must leave the graph consistent; they are applied repeatedly till
+# none of them changes the graph
+
+peepholeRules = [] # (name, rule function)
+
+def addPeepholeRule(name, ruleFn):
+    peepholeRules.append((name, ruleFn))
+
+def getMathLabel(operation):
+    customName = reverseLookup(SHADER_MATH + '_' + operation)
+    return mathFnMap[customName][2] if customName != None else operation
+
+def setOperation(node, operation):
+    if(node.label == getMathLabel(node.operation)):
+        node.label = getMathLabel(operation)
+    node.operation = operation
+
+def isRemovable(edits, node):
+    return edits.isCandidate(node) and node not in edits.protected
+
+def isPlainMath(edits, node, operation = None):
+    return node.bl_idname == SHADER_MATH and edits.isCandidate(node) and \
+        not getattr(node, 'use_clamp', False) and \
+            (operation == None or node.operation == operation)
+
+# Constant value of the input: unlinked input or linked number literal
+# (Value node used only by this input)
+def getConstInput(edits, socket):
+    op = getLinkedOutput(socket)
+    if(op == None): return socket.default_value
+    if(op.node.bl_idname == SHADER_VALUE and isRemovable(edits, op.node) and \
+        getConsumerCnt(op.node) == 1):
+        return op.default_value
+    return None
+
+# Removes the node and recursively the nodes that fed only this node
+# Returns the number of nodes removed
+def removeTree(edits, node, replacement = None):
+    sources = [getLinkedOutput(ip) for ip in node.inputs]
+    edits.removeNode(node, replacement)
+    removedCnt = 1
+    for op in sources:
+        if(op != None and isRemovable(edits, op.node) and \
+            getConsumerCnt(op.node) == 0):
+            removedCnt += removeTree(edits, op.node)
+    return removedCnt
+
+# Input socket gets the link or the value of the source (input) socket
+def copyInput(nodeTree, source, target):
+    if(source[0] != None): nodeTree.links.new(source[0], target)
+    else:
+        for link in list(target.links): nodeTree.links.remove(link)
+        target.default_value = source[1]
+
+def getInputSource(socket):
+    return (getLinkedOutput(socket), socket.default_value)
+
+# Node with the value replaced by its (linked) operand
+def bypassNode(edits, node, operand):
+    source = getLinkedOutput(operand)
+    if(source == None): return 0
+    edits.relinkOutput(node.outputs[0], source)
+    return removeTree(edits, node, source.node)
+
+# x + 0, 0 + x, x - 0, x * 1, 1 * x, x / 1, pow(x, 1)
+IDENTITIES = {'ADD': ((0, 1, 0), (1, 0, 0)), 'SUBTRACT': ((0, 1, 0),), \
+    'MULTIPLY': ((0, 1, 1), (1, 0, 1)), 'DIVIDE': ((0, 1, 1),), \
+        'POWER': ((0, 1, 1),)} # (operand, constant input, identity value)
+
+def removeIdentity(edits, node):
+    if(node in edits.protected): return 0
+    for operand, constIdx, value in IDENTITIES.get(node.operation, ()):
+        if(getConstInput(edits, node.inputs[constIdx]) == value):
+            return bypassNode(edits, node, node.inputs[operand])
+
+# x * 0, 0 * x: consumers get 0 directly. IEEE semantics are deliberately
+# relaxed: inf * 0 and nan * 0 (nan in Cycles) become 0 as well.
+# Group Output sockets are skipped, their value is not used by Blender
+def removeAnnihilator(edits, node):
+    if(node.operation != 'MULTIPLY' or node in edits.protected or \
+        not any(getConstInput(edits, ip) == 0 for ip in node.inputs[:2])):
+        return 0
+    consumers = [link.to_socket for link in node.outputs[0].links]
+    if(any(not hasattr(s, 'default_value') or \
+        s.node.bl_idname == GROUP_OUTPUT for s in consumers)): return 0
+    for socket in consumers:
+        for link in list(socket.links): node.id_data.links.remove(link)
+        if(hasattr(socket.default_value, '__len__')): # Vector / color
+            socket.default_value = [0] * len(socket.default_value)
+        else: socket.default_value = 0
+    return removeTree(edits, node)
+
+# pow(x, 2) -> x * x, pow(x, 0.5) -> sqrt(x)
+def reducePower(edits, node):
+    if(node.operation != 'POWER'): return 0
+    exponent = getConstInput(edits, node.inputs[1])
+    base = getLinkedOutput(node.inputs[0])
+    if(base == None or exponent not in {2, 0.5}): return 0
+    expSource = getLinkedOutput(node.inputs[1])
+    nodeTree = node.id_data
+    if(exponent == 2):
+        setOperation(node, 'MULTIPLY')
+        nodeTree.links.new(base, node.inputs[1])
+    else:
+        setOperation(node, 'SQRT')
+        if(expSource != None): nodeTree.links.remove(node.inputs[1].links[0])
+    if(expSource != None):
+        edits.removeNode(expSource.node)
+        return 1
+    return 0
+
+# x / c -> x * (1 / c)
+def reduceDivision(edits, node):
+    if(node.operation != 'DIVIDE'): return 0
+    divisor = getConstInput(edits, node.inputs[1])
+    if(divisor == None or divisor == 0): return 0
+    source = getLinkedOutput(node.inputs[1])
+    setOperation(node, 'MULTIPLY')
+    if(source != None):
+        node.id_data.links.remove(node.inputs[1].links[0])
+        edits.removeNode(source.node)
+    node.inputs[1].default_value = 1 / divisor
+    return 1 if source != None else 0
+
+# a * b + c -> multiply add(a, b, c)
+def fuseMultiplyAdd(edits, node):
+    if(node.operation != 'ADD'): return 0
+    for mulIdx in (0, 1):
+        op = getLinkedOutput(node.inputs[mulIdx])
+        if(op == None or not isPlainMath(edits, op.node, 'MULTIPLY') or \
+            op.node in edits.protected or getConsumerCnt(op.node) != 1):
+            continue
+        mulNode = op.node
+        addend = getInputSource(node.inputs[1 - mulIdx])
+        factors = [getInputSource(ip) for ip in mulNode.inputs[:2]]
+        nodeTree = node.id_data
+        setOperation(node, 'MULTIPLY_ADD')
+        copyInput(nodeTree, addend, node.inputs[2])
+        copyInput(nodeTree, factors[0], node.inputs[0])
+        copyInput(nodeTree, factors[1], node.inputs[1])
+        edits.removeNode(mulNode, node)
+        return 1
+    return 0
+
+addPeepholeRule('Identity', removeIdentity)
+addPeepholeRule('Annihilator', removeAnnihilator)
+addPeepholeRule('Power', reducePower)
+addPeepholeRule('Division', reduceDivision)
+addPeepholeRule('Multiply add', fuseMultiplyAdd)
+
+def applyPeepholeRules(edits):
+    changed = True
+    while(changed):
+        changed = False
+        for node in list(edits.nodes):
+            for name, ruleFn in peepholeRules:
+                if(not isPlainMath(edits, node)): break
+                operation = node.operation
+                saved = ruleFn(edits, node)
+                if(saved): edits.addSaved(name, saved)
+                if(saved or not isPlainMath(edits, node) or \
+                    node.operation != operation):
+                    changed = True
+
+# nodes: generated nodes (only these are changed)
+# protected: nodes that must not be removed (e.g. bound to variables)
+def optimizeGraph(nodes, protected):
+    edits = GraphEdits(nodes, protected)
+    collapseComponentMath(edits)
+    applyPeepholeRules(edits)
+    return edits
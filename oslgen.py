@@ -0,0 +1,415 @@
+#
+# OSL code generation for the math subset. Connected Math and Vector Math
+# nodes are compiled into the source of one OSL shader, which is set on a
+# Script node that replaces them: it has an input for each value coming from
+# other nodes and an output for each value used by other nodes (numbers
+# become constants of the source). The expressions follow the semantics of
+# the operations in Cycles (same as numeval), e.g. division by zero is 0.
+# The regions are split where the values go out to other nodes and come
+# back, so that the Script node never feeds itself.
+# Done only if asked for (CompileOptions.osl), for the whole script or for
+# the groups with the given names. Cycles creates the sockets of the Script
+# node when it compiles the shader; if it can't, the nodes are kept
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import re, hashlib
+try:
+    import bpy
+except ImportError: # Outside Blender, only in-memory trees
+    bpy = None
+
+from .lookups import SHADER_MATH, SHADER_VMATH, SHADER_VALUE, SHADER_SCRIPT
+from .nodemodel import getShaderParams
+from .optimizer import GraphEdits
+
+OSL_ALL = '*' # CompileOptions.osl for the whole script, else group names
+OSL_SOURCE_PROP = 'xn_osl' # Shader source of the generated Script nodes
+TEXT_PREFIX = 'xn_osl_'
+SHADER_NAME = 'xn_math'
+SCRIPT_LABEL = 'OSL Math'
+MIN_REGION = 2 # Single nodes are left as they are
+COMBINE_XYZ = 'ShaderNodeCombineXYZ' # Of vector literals e.g. (1, 2, 3)
+
+# Math operation: expression of the inputs (all float)
+MATH_EXPRS = {'ADD': '{0} + {1}', 'SUBTRACT': '{0} - {1}', \
+    'MULTIPLY': '{0} * {1}', 'DIVIDE': 'xn_div({0}, {1})', \
+    'MULTIPLY_ADD': '{0} * {1} + {2}', 'POWER': 'xn_pow({0}, {1})', \
+    'LOGARITHM': 'xn_log({0}, {1})', 'SQRT': 'xn_sqrt({0})', \
+    'INVERSE_SQRT': 'xn_invsqrt({0})', 'ABSOLUTE': 'abs({0})', \
+    'EXPONENT': 'exp({0})', 'MINIMUM': 'min({0}, {1})', \
+    'MAXIMUM': 'max({0}, {1})', 'LESS_THAN': 'xn_lt({0}, {1})', \
+    'GREATER_THAN': 'xn_gt({0}, {1})', 'SIGN': 'sign({0})', \
+    'COMPARE': 'xn_cmp({0}, {1}, {2})', \
+    'SMOOTH_MIN': 'xn_smin({0}, {1}, {2})', \
+    'SMOOTH_MAX': 'xn_smax({0}, {1}, {2})', 'ROUND': 'floor({0} + 0.5)', \
+    'FLOOR': 'floor({0})', 'CEIL': 'ceil({0})', 'TRUNC': 'trunc({0})', \
+    'FRACT': 'xn_fract({0})', 'MODULO': 'xn_mod({0}, {1})', \
+    'WRAP': 'xn_wrap({0}, {1}, {2})', 'SNAP': 'xn_snap({0}, {1})', \
+    'PINGPONG': 'xn_pingpong({0}, {1})', 'SINE': 'sin({0})', \
+    'COSINE': 'cos({0})', 'TANGENT': 'tan({0})', 'ARCSINE': 'xn_asin({0})', \
+    'ARCCOSINE': 'xn_acos({0})', 'ARCTANGENT': 'atan({0})', \
+    'ARCTAN2': 'atan2({0}, {1})', 'SINH': 'sinh({0})', 'COSH': 'cosh({0})', \
+    'TANH': 'tanh({0})', 'RADIANS': 'radians({0})', 'DEGREES': 'degrees({0})'}
+
+# Vector Math operation: expression of the inputs (vectors, {3} is Scale)
+VMATH_EXPRS = {'ADD': '{0} + {1}', 'SUBTRACT': '{0} - {1}', \
+    'MULTIPLY': '{0} * {1}', 'DIVIDE': 'xn_div({0}, {1})', \
+    'CROSS_PRODUCT': 'cross({0}, {1})', 'PROJECT': 'xn_project({0}, {1})', \
+    'REFLECT': 'xn_reflect({0}, {1})', 'DOT_PRODUCT': 'dot({0}, {1})', \
+    'DISTANCE': 'distance({0}, {1})', 'LENGTH': 'length({0})', \
+    'SCALE': '{0} * {3}', 'NORMALIZE': 'xn_normalize({0})', \
+    'ABSOLUTE': 'abs({0})', 'MINIMUM': 'min({0}, {1})', \
+    'MAXIMUM': 'max({0}, {1})', 'FLOOR': 'floor({0})', 'CEIL': 'ceil({0})', \
+    'FRACTION': 'xn_fract({0})', 'MODULO': 'xn_mod({0}, {1})', \
+    'WRAP': 'xn_wrap({0}, {1}, {2})', 'SNAP': 'xn_snap({0}, {1})', \
+    'SINE': 'sin({0})', 'COSINE': 'cos({0})', 'TANGENT': 'tan({0})'}
+
+# Vector Math operations with Value output
+VMATH_VALUE_OPS = {'DOT_PRODUCT', 'DISTANCE', 'LENGTH'}
+
+# (name, source) of the functions for the edge cases of Cycles, each after
+# the ones it uses; only the ones used by the shader are added to its source
+OSL_HELPERS = [
+('xn_div', '''float xn_div(float a, float b)
+{
+    return (b != 0.0) ? a / b : 0.0;
+}
+vector xn_div(vector a, vector b)
+{
+    return vector(xn_div(a[0], b[0]), xn_div(a[1], b[1]), xn_div(a[2], b[2]));
+}'''),
+('xn_fract', '''float xn_fract(float a) { return a - floor(a); }
+vector xn_fract(vector a) { return a - floor(a); }'''),
+('xn_mod', '''float xn_mod(float a, float b)
+{
+    return (b != 0.0) ? fmod(a, b) : 0.0;
+}
+vector xn_mod(vector a, vector b)
+{
+    return vector(xn_mod(a[0], b[0]), xn_mod(a[1], b[1]), xn_mod(a[2], b[2]));
+}'''),
+('xn_pow', '''float xn_pow(float a, float b)
+{
+    return (a < 0.0 && b != trunc(b)) ? 0.0 : pow(a, b);
+}'''),
+('xn_log', '''float xn_log(float a, float b)
+{
+    return (a > 0.0 && b > 0.0) ? xn_div(log(a), log(b)) : 0.0;
+}'''),
+('xn_sqrt', 'float xn_sqrt(float a) { return sqrt(max(a, 0.0)); }'),
+('xn_invsqrt', \
+    'float xn_invsqrt(float a) { return (a > 0.0) ? 1.0 / sqrt(a) : 0.0; }'),
+('xn_lt', 'float xn_lt(float a, float b) { return (a < b) ? 1.0 : 0.0; }'),
+('xn_gt', 'float xn_gt(float a, float b) { return (a > b) ? 1.0 : 0.0; }'),
+('xn_cmp', '''float xn_cmp(float a, float b, float c)
+{
+    return (abs(a - b) <= max(c, 1e-5)) ? 1.0 : 0.0;
+}'''),
+('xn_smin', '''float xn_smin(float a, float b, float c)
+{
+    if(c == 0.0) return min(a, b);
+    float h = max(c - abs(a - b), 0.0) / c;
+    return min(a, b) - h * h * h * c / 6.0;
+}'''),
+('xn_smax', \
+    'float xn_smax(float a, float b, float c) { return -xn_smin(-a, -b, c); }'),
+('xn_wrap', '''float xn_wrap(float v, float mx, float mn)
+{
+    float r = mx - mn;
+    return (r != 0.0) ? v - r * floor(xn_div(v - mn, r)) : mn;
+}
+vector xn_wrap(vector v, vector mx, vector mn)
+{
+    return vector(xn_wrap(v[0], mx[0], mn[0]), xn_wrap(v[1], mx[1], mn[1]),
+        xn_wrap(v[2], mx[2], mn[2]));
+}'''),
+('xn_snap', '''float xn_snap(float a, float b)
+{
+    return floor(xn_div(a, b)) * b;
+}
+vector xn_snap(vector a, vector b)
+{
+    return floor(xn_div(a, b)) * b;
+}'''),
+('xn_pingpong', '''float xn_pingpong(float a, float b)
+{
+    return (b != 0.0) ? abs(xn_fract(xn_div(a - b, b * 2.0)) * b * 2.0 - b)
+        : 0.0;
+}'''),
+('xn_asin', 'float xn_asin(float a) { return asin(clamp(a, -1.0, 1.0)); }'),
+('xn_acos', 'float xn_acos(float a) { return acos(clamp(a, -1.0, 1.0)); }'),
+('xn_avg', 'float xn_avg(vector a) { return (a[0] + a[1] + a[2]) / 3.0; }'),
+('xn_project', '''vector xn_project(vector a, vector b)
+{
+    return xn_div(dot(a, b), dot(b, b)) * b;
+}'''),
+('xn_normalize', '''vector xn_normalize(vector a)
+{
+    float l = length(a);
+    return (l != 0.0) ? a / l : vector(0.0);
+}'''),
+('xn_reflect', '''vector xn_reflect(vector a, vector b)
+{
+    vector n = xn_normalize(b);
+    return a - 2.0 * dot(n, a) * n;
+}'''),
+]
+
+HELPER_PATTERN = re.compile(r'\bxn_\w+(?=\()')
+OP_PATTERN = re.compile(r'^    \w+ t\d+ = ', re.M) # Statement of a node
+PARAM_DEFAULTS = {'float': '0.0', 'vector': 'vector(0.0)'}
+
+def getBaseName(name):
+    return re.sub(r'\.\d{3}$', '', name)
+
+# CompileOptions.osl from comma separated group names (blank: whole script)
+def parseSelection(text):
+    names = set(name.strip() for name in text.split(',') if name.strip())
+    return names if len(names) > 0 and OSL_ALL not in names else OSL_ALL
+
+# Source of the helpers used by the code, in the order of OSL_HELPERS
+def getHelperSource(code):
+    helpers = dict(OSL_HELPERS)
+    used = set()
+    pending = set(HELPER_PATTERN.findall(code))
+    while(len(pending) > 0):
+        name = pending.pop()
+        if(name in used or name not in helpers): continue
+        used.add(name)
+        pending.update(HELPER_PATTERN.findall(helpers[name]))
+    return '\n'.join(source for name, source in OSL_HELPERS if name in used)
+
+# Number of the nodes compiled into the source
+def getOpCount(source):
+    return len(OP_PATTERN.findall(source))
+
+def getLiteral(value, oslType):
+    if(isinstance(value, (list, tuple))):
+        if(oslType == 'float'): # Implicit conversion, as in Cycles
+            return repr(float(sum(value[:3]) / 3))
+        return 'vector(' + ', '.join(repr(float(v)) for v in value[:3]) + ')'
+    return repr(float(value)) if oslType == 'float' \
+        else 'vector(' + repr(float(value)) + ')'
+
+def convert(var, fromType, toType):
+    if(fromType == toType): return var
+    return 'vector(' + var + ')' if toType == 'vector' \
+        else 'xn_avg(' + var + ')'
+
+def getSourceNodes(node):
+    return [link.from_node for ip in node.inputs for link in ip.links]
+
+# Nodes of the tree, each after its sources
+def getNodeOrder(nodes):
+    order = []
+    visited = set()
+    for root in nodes:
+        stack = [(root, False)]
+        while(len(stack) > 0):
+            node, isDone = stack.pop()
+            if(isDone):
+                order.append(node)
+            elif(node not in visited):
+                visited.add(node)
+                stack.append((node, True))
+                stack += [(n, False) for n in getSourceNodes(node) \
+                    if n not in visited]
+    return order
+
+def canCompile(edits, node):
+    if(node.bl_idname == SHADER_MATH): exprs = MATH_EXPRS
+    elif(node.bl_idname == SHADER_VMATH): exprs = VMATH_EXPRS
+    else: return False
+    return edits.isCandidate(node) and node.operation in exprs and \
+        not getattr(node, 'mute', False) and \
+            all(op.enabled for op in node.outputs if len(op.links) > 0)
+
+def getInputType(node, idx):
+    return 'vector' if node.bl_idname == SHADER_VMATH and idx < 3 else 'float'
+
+def getResult(node):
+    if(node.bl_idname == SHADER_MATH): return node.outputs[0], 'float'
+    if(node.operation in VMATH_VALUE_OPS): return node.outputs[1], 'float'
+    return node.outputs[0], 'vector'
+
+# Connected compilable nodes (each list in the order of evaluation). The
+# level of a node is the number of times the values go out of the
+# compilable nodes on the way to it, the nodes of a region have the same
+# level, so that no path leaves the region and comes back
+def getRegions(nodeTree, compilable):
+    levels = {}
+    parents = {}
+    def getRoot(node):
+        while(parents[node] != node): node = parents[node]
+        return node
+    order = getNodeOrder(nodeTree.nodes)
+    for node in order:
+        isCompiled = node in compilable
+        level = 0
+        for srcNode in getSourceNodes(node):
+            srcLevel = levels[srcNode]
+            if(srcNode in compilable and not isCompiled): srcLevel += 1
+            level = max(level, srcLevel)
+        levels[node] = level
+        if(isCompiled):
+            parents[node] = node
+            for srcNode in getSourceNodes(node):
+                if(srcNode in compilable and levels[srcNode] == level):
+                    parents[getRoot(srcNode)] = getRoot(node)
+    regions = {}
+    for node in order:
+        if(node in compilable):
+            regions.setdefault(getRoot(node), []).append(node)
+    return [r for r in regions.values() if len(r) >= MIN_REGION]
+
+class ShaderSource:
+    def __init__(self, edits, nodes):
+        self.edits = edits
+        self.nodes = set(nodes)
+        self.inputs = {} # (output socket, OSL type): parameter name
+        self.outputs = [] # (output socket, parameter name)
+        self.folded = set() # Literal nodes that became constants
+        self.results = {} # Output socket of a node: (variable, OSL type)
+        self.code = []
+        for node in nodes: self.addNode(node)
+
+    # Value of the number or vector literal node used only by the region,
+    # None if it's not one
+    def getConstant(self, socket):
+        node = socket.node
+        if(not self.edits.isCandidate(node) or node in self.edits.protected \
+            or any(link.to_node not in self.nodes \
+                for op in node.outputs for link in op.links)):
+            return None
+        if(node.bl_idname == SHADER_VALUE): return socket.default_value
+        if(node.bl_idname == COMBINE_XYZ and \
+            all(len(ip.links) == 0 for ip in node.inputs)):
+            return [ip.default_value for ip in node.inputs]
+        return None
+
+    def getArg(self, socket, oslType):
+        if(len(socket.links) == 0):
+            return getLiteral(socket.default_value, oslType)
+        srcSocket = socket.links[0].from_socket
+        if(srcSocket.node in self.nodes):
+            var, varType = self.results[srcSocket]
+            return convert(var, varType, oslType)
+        value = self.getConstant(srcSocket)
+        if(value != None):
+            self.folded.add(srcSocket.node)
+            return getLiteral(value, oslType)
+        key = (srcSocket, oslType)
+        if(key not in self.inputs):
+            self.inputs[key] = 'In' + str(len(self.inputs))
+        return self.inputs[key]
+
+    def addNode(self, node):
+        exprs = MATH_EXPRS if node.bl_idname == SHADER_MATH else VMATH_EXPRS
+        template = exprs[node.operation]
+        args = [None] * len(node.inputs)
+        for idx in sorted(set(map(int, re.findall(r'\{(\d)\}', template)))):
+            args[idx] = self.getArg(node.inputs[idx], getInputType(node, idx))
+        expr = template.format(*args)
+        if(getattr(node, 'use_clamp', False)):
+            expr = 'clamp(' + expr + ', 0.0, 1.0)'
+        socket, oslType = getResult(node)
+        var = 't' + str(len(self.results))
+        self.results[socket] = (var, oslType)
+        self.code.append('    ' + oslType + ' ' + var + ' = ' + expr + ';')
+        # Values of the variables stay available on the Script node
+        if(node in self.edits.protected or \
+            any(link.to_node not in self.nodes for link in socket.links)):
+            name = 'Out' + str(len(self.outputs))
+            self.outputs.append((socket, name))
+            self.code.append('    ' + name + ' = ' + var + ';')
+
+    def getSource(self):
+        params = [oslType + ' ' + name + ' = ' + PARAM_DEFAULTS[oslType] \
+            for (socket, oslType), name in self.inputs.items()]
+        params += ['output ' + self.results[socket][1] + ' ' + name + ' = ' + \
+            PARAM_DEFAULTS[self.results[socket][1]] \
+                for socket, name in self.outputs]
+        code = '\n'.join(self.code)
+        helpers = getHelperSource(code)
+        return '// Generated by XNodify from ' + str(len(self.nodes)) + \
+            ' math nodes\n\n' + (helpers + '\n\n' if helpers != '' else '') + \
+                'shader ' + SHADER_NAME + '(\n    ' + ',\n    '.join(params) + \
+                    ')\n{\n' + code + '\n}\n'
+
+def getTexts(nodeTree):
+    nodeGroups = getattr(nodeTree, 'nodeGroups', None)
+    return nodeGroups.texts if nodeGroups != None else bpy.data.texts
+
+# Text with the source, the same text is used for the same source
+def getScriptText(nodeTree, source):
+    texts = getTexts(nodeTree)
+    name = TEXT_PREFIX + \
+        hashlib.sha1(source.encode('utf-8')).hexdigest()[:10] + '.osl'
+    text = texts.get(name)
+    if(text == None or text.as_string() != source):
+        text = texts.new(name)
+        text.write(source)
+    return text
+
+# Sets the source on the Script node, returns False if the sockets of the
+# shader are not created (i.e. Cycles could not compile it)
+def setScript(node, source):
+    node.mode = 'INTERNAL'
+    node.script = getScriptText(node.id_data, source)
+    node[OSL_SOURCE_PROP] = source
+    for isOutput, name, sockType in getShaderParams(source):
+        if((node.outputs if isOutput else node.inputs).get(name) == None):
+            return False
+    return True
+
+# Replaces the nodes of the region with a Script node, False if the script
+# could not be compiled
+def compileRegion(edits, nodes):
+    shader = ShaderSource(edits, nodes)
+    if(len(shader.outputs) == 0): return True # Not used
+    nodeTree = nodes[0].id_data
+    script = edits.addNode(nodeTree, SHADER_SCRIPT, SCRIPT_LABEL)
+    if(not setScript(script, shader.getSource())):
+        edits.nodes.discard(script)
+        nodeTree.nodes.remove(script)
+        return False
+    script.location = nodes[-1].location
+    script.hide = nodes[-1].hide
+    links = nodeTree.links
+    for (srcSocket, oslType), name in shader.inputs.items():
+        links.new(srcSocket, script.inputs[name])
+    for socket, name in shader.outputs:
+        for link in list(socket.links):
+            if(link.to_node not in shader.nodes):
+                links.new(script.outputs[name], link.to_socket)
+    outputIdxs = {socket.node: i for i, (socket, name) \
+        in enumerate(shader.outputs)}
+    for node in nodes + list(shader.folded):
+        if(node in outputIdxs): edits.replacedOutputs[node] = outputIdxs[node]
+        edits.removeNode(node, script)
+    edits.addSaved('OSL', len(nodes) + len(shader.folded) - 1)
+    return True
+
+# nodes: generated nodes (only these are changed), protected: nodes that
+# must not be removed other than by replacement (e.g. bound to variables),
+# osl: OSL_ALL or names of the groups whose nodes are compiled.
+# Returns the GraphEdits and the regions that could not be compiled
+def compileGraph(nodes, protected, matNodeTree, osl):
+    nodes = list(nodes) # Same order in each run (names of the new nodes)
+    edits = GraphEdits(nodes, protected)
+    trees = {}
+    for node in nodes:
+        tree = node.id_data
+        if(osl == OSL_ALL or (tree != matNodeTree and \
+            getBaseName(tree.name) in osl)):
+            trees.setdefault(tree, set())
+            if(canCompile(edits, node)): trees[tree].add(node)
+    failed = []
+    for tree, compilable in trees.items():
+        for region in getRegions(tree, compilable):
+            if(not compileRegion(edits, region)): failed.append(region)
+    return edits, failed
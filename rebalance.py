@@ -0,0 +1,107 @@
+#
+# Rebalancing of long chains of associative operators in the parsed lines.
+# a + b + c + d parses as ((a + b) + c) + d, i.e. a chain of nodes as deep
+# as the number of operands, which is also laid out one column per node.
+# The chains of +, * and of the functions add, mult, min, max (and their
+# vector versions) are rearranged as balanced trees of the same operands in
+# the same order, e.g. (a + b) + (c + d), so that the depth is logarithmic.
+# The result can differ in the last bits of floats (different rounding
+# order), so it's done only if asked for (CompileOptions.rebalance)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+from .lookups import MATH_ADD, MATH_MULT
+from .checker import getCustomName
+from .registry import getOperator
+from .typeinfer import getOperatorType
+
+CHAIN_OPERATORS = {'+', '*'}
+CHAIN_FUNCTIONS = {MATH_ADD, MATH_MULT, 'math_min', 'math_max', \
+    'vmath_vadd', 'vmath_vmult', 'vmath_vmin', 'vmath_vmax'}
+# Shorter chains are not made shallower by rebalancing
+MIN_CHAIN = 4
+
+# Operator or function of the chain the symbol can be part of, None if it
+# can't be (e.g. keyword or blank arguments)
+def getChainKey(data):
+    id = data.getMetaData().id
+    if(id in CHAIN_OPERATORS):
+        return id if data.operand1 != None else None # Not unary
+    if(id == '(' and data.operand0 != None and \
+        isinstance(data.operand1, list) and len(data.operand1) == 2 and \
+            all(arg != None and arg.argName == None \
+                for arg in data.operand1)):
+        customName = getCustomName(data.operand0.value)
+        return customName if customName in CHAIN_FUNCTIONS else None
+    return None
+
+def getOperands(data):
+    if(data.getMetaData().id == '('): return data.operand1
+    return [data.operand0, data.operand1]
+
+def getChildren(data):
+    children = []
+    for operand in (data.operand0, data.operand1):
+        children += operand if isinstance(operand, list) else [operand]
+    return [child for child in children if isinstance(child, type(data))]
+
+def setOperands(data, left, right):
+    if(data.getMetaData().id == '('):
+        data.operand1 = [left, right]
+    else:
+        data.operand0, data.operand1 = left, right
+        # Types of the operands may be different from before
+        data.sockType = getOperatorType(getOperator(data.getMetaData().id), \
+            left.sockType, right.sockType)
+
+# Operands (left to right) and the symbols of the chain with root at the end
+def getChain(root, key):
+    operands, links = [], []
+    stack = [(root, False)]
+    while(len(stack) > 0):
+        data, isDone = stack.pop()
+        if(isDone):
+            links.append(data)
+        elif(data is root or (data.sockIdx == None and \
+            getChainKey(data) == key)):
+            stack.append((data, True))
+            stack += [(operand, False) for operand in getOperands(data)[::-1]]
+        else:
+            operands.append(data)
+    return operands, links
+
+def rebalanceChain(root, key):
+    operands, links = getChain(root, key)
+    if(len(operands) < MIN_CHAIN): return operands
+    # The symbols are reused, root (popped first) stays the root
+    def build(lo, hi):
+        if(hi - lo == 1): return operands[lo]
+        data = links.pop()
+        mid = (lo + hi + 1) // 2
+        setOperands(data, build(lo, mid), build(mid, hi))
+        return data
+    build(0, len(operands))
+    return operands
+
+# Rebalances the chains of the parsed line in place
+def rebalanceTree(dataTree):
+    stack = [(dataTree, False)]
+    while(len(stack) > 0):
+        data, isFixed = stack.pop()
+        id = data.getMetaData().id
+        key = getChainKey(data) if not isFixed else None
+        if(key != None):
+            operands = rebalanceChain(data, key)
+        elif(id == '$'): # Defaults are set on the sockets of operand0
+            stack.append((data.operand0, True))
+            continue
+        else:
+            operands = getChildren(data)
+        stack += [(operand, False) for operand in operands]
+
+def rebalanceProgram(program):
+    for actLineCnt, expression, dataTree in program:
+        rebalanceTree(dataTree)
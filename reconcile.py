@@ -0,0 +1,237 @@
+#
+# Updates the nodes generated by an earlier run of a script in place.
+# The script is compiled into an in-memory template tree (see nodemodel),
+# whose nodes have stable ids (NODE_ID_PROP, see XNodifyContext.setNodeIds);
+# it's compared with the nodes having these ids in the target tree and only
+# the differences are applied: new nodes are added, stale ones removed,
+# links and socket values changed where needed. The nodes that are still
+# there are not touched otherwise, so their locations (e.g. moved by hand)
+# are kept. Nodes without ids (added by hand or by other runs) are left alone
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+from .lookups import SHADER_GROUP, SHADER_MATH, SHADER_VMATH, SHADER_SCRIPT
+from .nodemodel import NodeGroups
+from .main import XNodifyContext, NodeLayout, DisplayParams, NODE_ID_PROP
+from .main import getActiveMatTree
+from .evaluator import EvaluatorBase, BraceEvaluator, GROUP_HASH_PROP
+from .job import JobProgress
+from . import graphformat, oslgen
+
+FRAME_ID_PREFIX = 'frame:'
+
+def getSocketIdx(sockets, socket):
+    for i, s in enumerate(sockets):
+        if(s == socket): return i
+    return None
+
+# Node type, operation and the group body (hash) or the OSL source, nodes of
+# different kinds are replaced instead of updated
+def getNodeKind(node):
+    groupHash = None
+    if(node.bl_idname == SHADER_SCRIPT):
+        groupHash = node.get(oslgen.OSL_SOURCE_PROP)
+    elif(node.bl_idname == SHADER_GROUP):
+        groupHash = node.node_tree.get(GROUP_HASH_PROP) \
+            if node.node_tree != None else None
+        if(groupHash == None): return None # Unknown body, never the same
+    return (graphformat.getNodeKey(node), groupHash)
+
+# Ids of the template nodes; frames (created by layout) get the smallest id
+# of their nodes
+def getTemplateIds(template):
+    ids = {}
+    frameIds = {}
+    for node in template.nodes:
+        nodeId = node.get(NODE_ID_PROP)
+        if(nodeId != None):
+            ids[node] = nodeId
+            if(node.parent != None):
+                frameId = frameIds.get(node.parent)
+                if(frameId == None or nodeId < frameId):
+                    frameIds[node.parent] = nodeId
+    for frame, nodeId in frameIds.items():
+        ids[frame] = FRAME_ID_PREFIX + nodeId
+    return ids
+
+# Managed nodes of the tree by id, copies of a node (same id) are left alone
+def getManagedNodes(nodeTree):
+    managed = {}
+    for node in nodeTree.nodes:
+        nodeId = node.get(NODE_ID_PROP)
+        if(nodeId != None and nodeId not in managed):
+            managed[nodeId] = node
+    return managed
+
+def updateValues(templateNode, node, templateLinked):
+    cnt = 0
+    for key, tSockets, sockets in (('in', templateNode.inputs, node.inputs), \
+        ('out', templateNode.outputs, node.outputs)):
+        for i, tSocket in enumerate(tSockets):
+            if(i >= len(sockets) or (key == 'in' and \
+                (templateNode, i) in templateLinked)):
+                continue
+            value = graphformat.getSocketValue(tSocket)
+            if(value != None and \
+                graphformat.getSocketValue(sockets[i]) != value):
+                graphformat.setSocketValue(sockets[i], value)
+                cnt += 1
+    return cnt
+
+# Group tree for the template group node: existing tree with the same body
+# (hash) or loaded from the template graph
+class GroupLoader:
+    def __init__(self, template, nodeTree):
+        self.template = template
+        self.nodeGroups = EvaluatorBase.getNodeGroups(nodeTree)
+        self.graph = None
+        self.loadedGroups = None
+
+    def getTree(self, templateTree):
+        if(self.graph == None):
+            self.graph = graphformat.dumpGraph(self.template)
+            self.loadedGroups = {}
+            for name, treeData in self.graph['groups'].items():
+                groupHash = treeData.get('props', {}).get(GROUP_HASH_PROP)
+                gTree = BraceEvaluator.getHashedGroup(self.nodeGroups, \
+                    groupHash) if groupHash != None else None
+                if(gTree != None): self.loadedGroups[name] = gTree
+        return graphformat.getGroupTree(templateTree.name, self.graph, \
+            self.nodeGroups, self.loadedGroups)
+
+def newNode(templateNode, nodeTree, groupLoader):
+    node = nodeTree.nodes.new(templateNode.bl_idname)
+    if(templateNode.bl_idname in {SHADER_MATH, SHADER_VMATH}):
+        node.operation = templateNode.operation
+    node.name = templateNode.name
+    node.label = templateNode.label
+    node.hide = templateNode.hide
+    if(templateNode.bl_idname == SHADER_GROUP and \
+        templateNode.node_tree != None):
+        node.node_tree = groupLoader.getTree(templateNode.node_tree)
+    for key, value in graphformat.getProps(templateNode).items():
+        node[key] = value
+    if(templateNode.bl_idname == SHADER_SCRIPT and \
+        node.get(oslgen.OSL_SOURCE_PROP) != None):
+        oslgen.setScript(node, node[oslgen.OSL_SOURCE_PROP])
+    return node
+
+# Applies the template tree to nodeTree, new nodes are placed at their
+# template location + offset. Returns the counts of the changes
+def reconcileTree(template, nodeTree, offset):
+    stats = {'kept': 0, 'added': 0, 'removed': 0, 'relinked': 0, \
+        'values': 0}
+    templateIds = getTemplateIds(template)
+    managed = getManagedNodes(nodeTree)
+    groupLoader = GroupLoader(template, nodeTree)
+    templateLinked = set((link.to_node, getSocketIdx(link.to_node.inputs, \
+        link.to_socket)) for link in template.links)
+
+    nodeMap = {} # Template node: node in the tree
+    added = []
+    replaced = {} # Template node: (parent, location) of the replaced node
+    for templateNode in template.nodes:
+        nodeId = templateIds.get(templateNode)
+        node = managed.pop(nodeId, None) if nodeId != None else None
+        if(node != None and getNodeKind(node) != getNodeKind(templateNode)):
+            replaced[templateNode] = (node.parent, tuple(node.location))
+            nodeTree.nodes.remove(node)
+            stats['removed'] += 1
+            node = None
+        if(node == None):
+            node = newNode(templateNode, nodeTree, groupLoader)
+            if(nodeId != None): node[NODE_ID_PROP] = nodeId
+            added.append(templateNode)
+        else:
+            if(node.label != templateNode.label):
+                node.label = templateNode.label
+            if(node.hide != templateNode.hide):
+                node.hide = templateNode.hide
+            stats['values'] += updateValues(templateNode, node, \
+                templateLinked)
+            stats['kept'] += 1
+        nodeMap[templateNode] = node
+
+    # New nodes and the ones whose frame is removed are placed as in the
+    # template (child location is relative to the frame), replaced nodes
+    # take the place of the old ones
+    placed = set(added)
+    stale = set(managed.values())
+    for templateNode, node in nodeMap.items():
+        if(node.parent != None and node.parent in stale):
+            placed.add(templateNode)
+    for templateNode, (parent, loc) in replaced.items():
+        if(parent == None or parent not in stale):
+            placed.discard(templateNode)
+            node = nodeMap[templateNode]
+            node.parent = parent
+            node.location = loc
+
+    for node in stale: # Not generated anymore
+        nodeTree.nodes.remove(node)
+        stats['removed'] += 1
+
+    for templateNode, node in nodeMap.items():
+        if(templateNode in placed):
+            parent = nodeMap.get(templateNode.parent)
+            node.parent = parent
+            loc = templateNode.location
+            if(parent == None): loc = (loc[0] + offset[0], loc[1] + offset[1])
+            node.location = loc
+    for templateNode in added:
+        updateValues(templateNode, nodeMap[templateNode], templateLinked)
+    stats['added'] = len(added)
+
+    # Links between the managed nodes only
+    managedNodes = set(nodeMap.values())
+    desired = set()
+    for link in template.links:
+        fromNode, toNode = link.from_node, link.to_node
+        desired.add((nodeMap[fromNode], getSocketIdx(fromNode.outputs, \
+            link.from_socket), nodeMap[toNode], \
+                getSocketIdx(toNode.inputs, link.to_socket)))
+    for link in list(nodeTree.links):
+        fromNode, toNode = link.from_node, link.to_node
+        if(fromNode not in managedNodes or toNode not in managedNodes):
+            continue
+        key = (fromNode, getSocketIdx(fromNode.outputs, link.from_socket), \
+            toNode, getSocketIdx(toNode.inputs, link.to_socket))
+        if(key in desired):
+            desired.remove(key)
+        else:
+            nodeTree.links.remove(link)
+            stats['relinked'] += 1
+    for fromNode, fromIdx, toNode, toIdx in desired:
+        nodeTree.links.new(fromNode.outputs[fromIdx], toNode.inputs[toIdx])
+        stats['relinked'] += 1
+
+    BraceEvaluator.removeOrphanGroups(nodeTree)
+    return stats
+
+# Same as XNodifyContext.generateExpressions, but updates the nodes of the
+# earlier runs in matNodeTree (nothing is changed before the last step, so
+# cancelling needs no rollback). The returned DisplayParams has no nodes to
+# arrange (the template is already arranged) and has the reconcile stats
+def generateReconcile(lineFeeder, matNodeTree, location, scale, alignment, \
+    addFrame, minimized, frameTitle = None, options = None):
+    if(matNodeTree == None):
+        matNodeTree = getActiveMatTree()
+        if(matNodeTree == None):
+            raise SyntaxError('No active material')
+
+    template = NodeGroups().newRootTree('Template')
+    displayParams = yield from XNodifyContext().generateExpressions(\
+        lineFeeder, template, (0, 0), scale, alignment, addFrame, minimized, \
+            frameTitle, options)
+    NodeLayout.arrangeNodeLines(displayParams, testDimensions = False)
+    yield JobProgress('layout', 1, 1)
+    stats = reconcileTree(template, matNodeTree, location)
+
+    return DisplayParams([], {}, matNodeTree, location, scale, alignment, \
+        addFrame, frameTitle, displayParams.warnings, \
+            displayParams.optCounters, reconcileStats = stats, \
+                costReport = displayParams.costReport, \
+                    renderCost = displayParams.renderCost)
@@ -0,0 +1,125 @@
+#
+# Registry of the operators and node functions of the script language.
+# Each operator token is mapped to its parse behavior and binding power
+# (Parser symbol), the evaluator that creates its node and the math function
+# it stands for (used by checker and typeinfer), so that an operator is added
+# with one registerOperator call. Parser.getSymbolMeta and
+# EvaluatorBase.getEvaluator are lookups in the tables filled here.
+# Other add-ons can add their node types as script functions at runtime e.g.
+#   from xnodify import registry
+#   registry.registerFunction('mynode', 'ShaderNodeMyNode', 'My Node', 2, 1)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+from . import Parser
+from .Parser import InfixSymbol, PrefixInfixSymbol, EqualsSymbol
+from .Parser import DollarSymbol, ParenthesisSymbol, BracketSymbol
+from .Parser import BraceSymbol, DotSymbol, NameSymbol, NumberSymbol
+from .evaluator import EvaluatorBase, EqualsEvaluator, OperatorEvaluator
+from .evaluator import MinusEvaluator, CompareEvaluator, DollarEvaluator
+from .evaluator import ParenthesisEvaluator, BraceEvaluator
+from .evaluator import SwizzleEvaluator, VariableEvaluator, NumberEvaluator
+from .lookups import fnMap, mathFnMap, vmathFnMap, mathPrefix, vmathPrefix
+from .lookups import outputTypes, clearReverseLookup
+from .lookups import MATH_ADD, MATH_SUB, MATH_MULT, MATH_DIV
+
+DEFAULT_SIZE = (153.61, 150.0) # Node dimensions for layout
+DEFAULT_CATEGORY = '6' # Converter (see lookups.nodeGroups)
+
+class OperatorInfo:
+    def __init__(self, token, symbol, evaluator, customName, isVector, \
+        isShader, isUnary):
+        self.token = token
+        self.symbol = symbol # Parse behavior and binding power
+        self.evaluator = evaluator
+        # Key of mathFnMap of the node created for the operator, None for the
+        # tokens that are not operators (e.g. NAME, parentheses)
+        self.customName = customName
+        self.isVector = isVector # Vector math node for vector operands
+        self.isShader = isShader # Add shader node for shader operands
+        self.isUnary = isUnary # Can be used as prefix of expressions
+
+    def __repr__(self):
+        return '<OperatorInfo ' + self.token + '>'
+
+operators = {}
+
+def getOperator(token):
+    return operators.get(token)
+
+# bindingPower: higher binds tighter, tuple of infix and prefix binding
+# powers for PrefixInfixSymbol
+def registerOperator(token, bindingPower, evaluator, customName = None, \
+    symbolClass = InfixSymbol, isVector = False, isShader = False, \
+        isUnary = False):
+    if(token in operators or Parser.getSymbolMeta(token) != None):
+        raise ValueError('Already registered: ' + token)
+    powers = bindingPower if isinstance(bindingPower, tuple) \
+        else (bindingPower,)
+    symbol = symbolClass(token, *powers)
+    operators[token] = OperatorInfo(token, symbol, evaluator, customName, \
+        isVector, isShader, isUnary)
+    Parser.registerSymbol(symbol)
+    if(evaluator != None):
+        EvaluatorBase.registerEvaluator(token, evaluator)
+    return operators[token]
+
+def unregisterOperator(token):
+    if(operators.pop(token, None) != None):
+        Parser.unregisterSymbol(token)
+        EvaluatorBase.unregisterEvaluator(token)
+
+def isFunctionName(name):
+    return name in fnMap or (mathPrefix + name) in mathFnMap or \
+        (vmathPrefix + name) in vmathFnMap
+
+# Node type as function of the script e.g. mynode(a, b)[1]
+# inCnt / outCnt: number of inputs / outputs, outTypes: types of the outputs
+# as in lookups.outputTypes e.g. 'CF' (color, float), category: id of the
+# category in lookups.nodeGroups (for the node list of the panel)
+# Without schema (see schema module) the sockets are checked and created
+# headless from the counts and types
+def registerFunction(name, bl_idname, label, inCnt, outCnt, \
+    size = DEFAULT_SIZE, outTypes = None, category = DEFAULT_CATEGORY):
+    if(not name.isidentifier() or isFunctionName(name)):
+        raise ValueError('Invalid or existing function name: ' + name)
+    fnMap[name] = (category, bl_idname, label, inCnt, outCnt, tuple(size))
+    if(outTypes != None): outputTypes[name] = outTypes
+    clearReverseLookup(bl_idname)
+
+def unregisterFunction(name):
+    fnInfo = fnMap.pop(name, None)
+    if(fnInfo != None):
+        outputTypes.pop(name, None)
+        clearReverseLookup(fnInfo[1])
+
+# Operators of the script language
+registerOperator('=', 100, EqualsEvaluator(), symbolClass = EqualsSymbol)
+registerOperator('<', 105, OperatorEvaluator('LESS_THAN', 'Less Than'), \
+    'math_lt')
+registerOperator('>', 105, OperatorEvaluator('GREATER_THAN', \
+    'Greater Than'), 'math_gt')
+registerOperator('==', 105, CompareEvaluator('COMPARE', 'Compare'), \
+    'math_cmp')
+registerOperator('+', (110, 130), OperatorEvaluator('ADD', 'Add'), \
+    MATH_ADD, PrefixInfixSymbol, isVector = True, isShader = True)
+registerOperator('-', (110, 130), MinusEvaluator('SUBTRACT', 'Subtract'), \
+    MATH_SUB, PrefixInfixSymbol, isVector = True, isUnary = True)
+registerOperator('*', 120, OperatorEvaluator('MULTIPLY', 'Multiply'), \
+    MATH_MULT, isVector = True)
+registerOperator('/', 120, OperatorEvaluator('DIVIDE', 'Divide'), \
+    MATH_DIV, isVector = True)
+registerOperator('%', 120, OperatorEvaluator('MODULO', 'Modulo'), \
+    'math_mod', isVector = True)
+registerOperator('**', 140, OperatorEvaluator('POWER', 'Power'), 'math_pow')
+registerOperator('(', 150, ParenthesisEvaluator(), \
+    symbolClass = ParenthesisSymbol)
+registerOperator('[', 150, None, symbolClass = BracketSymbol) # In parser
+registerOperator('{', 150, BraceEvaluator(), symbolClass = BraceSymbol)
+registerOperator('.', 150, SwizzleEvaluator(), symbolClass = DotSymbol)
+registerOperator('$', 160, DollarEvaluator(), symbolClass = DollarSymbol)
+registerOperator('NAME', 0, VariableEvaluator(), symbolClass = NameSymbol)
+registerOperator('NUMBER', 0, NumberEvaluator(), symbolClass = NumberSymbol)
@@ -0,0 +1,198 @@
+#
+# Static estimate of the render cost of the generated material, so that
+# expensive node setups are noticed before rendering. Each node has a cost
+# in units of a simple math node, by its category in lookups.nodeGroups
+# (CATEGORY_COSTS) or by its script function name (NODE_COSTS), e.g.
+# textures, ray traced inputs and volume shaders cost much more than math.
+# A bump node also evaluates its height input two more times (for the
+# differentials) and group nodes cost their body plus an overhead for
+# each nesting level. Only the nodes that reach an output are counted.
+# The estimate has the total cost, the critical path depth (longest chain of
+# nodes, including the ones in groups) and the most expensive subgraphs
+# (script lines and groups)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+from .lookups import SHADER_GROUP, SHADER_SCRIPT, fnMap, mathFnMap, \
+    vmathFnMap, mathPrefix, vmathPrefix, reverseLookup
+from .graphformat import getNodeKey
+from .oslgen import getOpCount, OSL_SOURCE_PROP
+
+# Category id (see lookups.nodeGroups): cost
+CATEGORY_COSTS = {'0': 0.5, '1': 0, '2': 4, '3': 8, '4': 1.5, '5': 2, \
+    '6': 1, '7': 0, '100': 1, '200': 1.5}
+
+# Script function name: cost, overrides CATEGORY_COSTS
+NODE_COSTS = {'value': 0, 'shadrgb': 0, 'amboccl': 30, 'bevel': 30, \
+    'prnbsdf': 8, 'subsrfsct': 12, 'glasbsdf': 6, 'mixshad': 1, \
+        'addshad': 1, 'holdout': 1, 'prnvol': 24, 'volabs': 12, \
+            'volscat': 16, 'ptdnsty': 25, 'mustex': 14, 'vorntex': 12, \
+                'noisetex': 10, 'wavetex': 10, 'magictex': 8, 'brcktex': 6, \
+                    'imgtex': 6, 'envtex': 6, 'skytex': 4, 'iestex': 4, \
+                        'chctex': 3, 'gradtex': 2, 'whnsetex': 2, 'bump': 4, \
+                            'colramp': 1.5, 'rgbcrvs': 2, 'vctcrvs': 2}
+
+# Nodes that are not evaluated while rendering
+FREE_NODES = {'NodeFrame', 'NodeReroute', 'NodeGroupInput', 'NodeGroupOutput'}
+OUTPUT_NODES = {'ShaderNodeOutputMaterial', 'NodeGroupOutput'}
+
+UNKNOWN_COST = 1 # Nodes that are not script functions (e.g. other add-ons)
+OSL_OP_COST = 1 # Of each math node compiled into an OSL Script node
+BUMP_HEIGHT_EVALS = 2 # Extra evaluations of the height input of bump
+GROUP_COST = 0.5 # Of the group node itself
+GROUP_NESTING_FACTOR = 1.1 # Body cost multiplier for each nesting level
+MAX_SUBGRAPHS = 5
+
+def getCustomName(node):
+    return reverseLookup(getNodeKey(node))
+
+def getNodeCost(node):
+    if(node.bl_idname in FREE_NODES or getattr(node, 'mute', False)):
+        return 0
+    if(node.bl_idname == SHADER_SCRIPT): # Compiled math nodes (see oslgen)
+        return OSL_OP_COST * getOpCount(node.get(OSL_SOURCE_PROP, ''))
+    customName = getCustomName(node)
+    if(customName == None): return UNKNOWN_COST
+    if(customName in NODE_COSTS): return NODE_COSTS[customName]
+    if(customName.startswith(mathPrefix)): fnInfo = mathFnMap[customName]
+    elif(customName.startswith(vmathPrefix)): fnInfo = vmathFnMap[customName]
+    else: fnInfo = fnMap[customName]
+    return CATEGORY_COSTS.get(fnInfo[0], UNKNOWN_COST)
+
+def getSourceNodes(sockets):
+    return [link.from_node for socket in sockets for link in socket.links]
+
+# Nodes upstream of (and including) roots, each after its sources
+def getUpstreamNodes(roots):
+    order = []
+    visited = set()
+    stack = [(node, False) for node in roots]
+    while(len(stack) > 0):
+        node, isDone = stack.pop()
+        if(isDone):
+            order.append(node)
+        elif(node not in visited):
+            visited.add(node)
+            stack.append((node, True))
+            for srcNode in getSourceNodes(node.inputs):
+                if(srcNode not in visited): stack.append((srcNode, False))
+    return order
+
+# Nodes evaluated while rendering, all of them if there is no output
+def getRenderedNodes(nodeTree):
+    outputs = [node for node in nodeTree.nodes \
+        if node.bl_idname in OUTPUT_NODES and \
+            getattr(node, 'is_active_output', True)]
+    return getUpstreamNodes(outputs if len(outputs) > 0 else nodeTree.nodes)
+
+class TreeCost:
+    def __init__(self, nodeCosts, depth, criticalPath):
+        self.nodeCosts = nodeCosts # Rendered node: cost
+        self.total = sum(nodeCosts.values())
+        self.depth = depth
+        self.criticalPath = criticalPath # Nodes of the longest chain
+
+class RenderCost:
+    def __init__(self, treeCost, subgraphs, lineCosts):
+        self.total = treeCost.total
+        self.depth = treeCost.depth
+        self.criticalPath = [node.name for node in treeCost.criticalPath]
+        self.nodeCnt = sum(1 for cost in treeCost.nodeCosts.values() \
+            if cost > 0)
+        self.subgraphs = subgraphs # (label, cost), most expensive first
+        self.lineCosts = lineCosts # Line number: cost of its nodes
+
+    # Line with the most expensive nodes, None if no line has any
+    def getMaxLine(self):
+        if(len(self.lineCosts) == 0): return None
+        return max(self.lineCosts, key = lambda l: (self.lineCosts[l], -l))
+
+    def getDetails(self):
+        details = 'depth: %d' % self.depth
+        if(len(self.subgraphs) > 0):
+            details += ', most expensive: ' + ', '.join('%s (%.1f)' % \
+                (label, cost) for label, cost in self.subgraphs)
+        return details
+
+    def getSummary(self):
+        return 'Render cost: %.1f, %s' % (self.total, self.getDetails())
+
+    def toDict(self):
+        return {'total': round(self.total, 3), 'depth': self.depth, \
+            'nodes': self.nodeCnt, 'criticalPath': self.criticalPath, \
+                'subgraphs': [[label, round(cost, 3)] \
+                    for label, cost in self.subgraphs]}
+
+    def __repr__(self):
+        return '<RenderCost ' + str(self.total) + ' ' + str(self.depth) + '>'
+
+class RenderCostEstimator:
+    def __init__(self):
+        self.treeCosts = {} # Group tree: TreeCost of the body
+
+    def getTreeCost(self, nodeTree):
+        treeCost = self.treeCosts.get(nodeTree)
+        if(treeCost != None): return treeCost
+
+        nodeCosts = {}
+        depths = {}
+        prevNodes = {} # Node: source node on its longest chain
+        for node in getRenderedNodes(nodeTree):
+            cost, depth = getNodeCost(node), 0
+            if(node.bl_idname == SHADER_GROUP and node.node_tree != None):
+                bodyCost = self.getTreeCost(node.node_tree)
+                cost = GROUP_COST + bodyCost.total * GROUP_NESTING_FACTOR
+                depth = bodyCost.depth
+            elif(cost > 0):
+                depth = 1
+            if(cost > 0 and getCustomName(node) == 'bump'):
+                heightNodes = getUpstreamNodes(getSourceNodes(\
+                    [s for s in node.inputs if s.name == 'Height']))
+                cost += BUMP_HEIGHT_EVALS * sum(nodeCosts.get(n, 0) \
+                    for n in heightNodes)
+            srcNodes = [n for n in getSourceNodes(node.inputs) if n in depths]
+            if(len(srcNodes) > 0):
+                prevNode = max(srcNodes, key = lambda n: depths[n])
+                prevNodes[node] = prevNode
+                depth += depths[prevNode]
+            nodeCosts[node] = cost
+            depths[node] = depth
+
+        criticalPath = []
+        if(len(depths) > 0):
+            node = max(depths, key = lambda n: depths[n])
+            while(node != None):
+                if(nodeCosts[node] > 0): criticalPath.append(node)
+                node = prevNodes.get(node)
+        treeCost = TreeCost(nodeCosts, max(depths.values(), default = 0), \
+            criticalPath)
+        self.treeCosts[nodeTree] = treeCost
+        return treeCost
+
+    # lineNodes: {line number: nodes created by the line} (optional)
+    def estimate(self, nodeTree, lineNodes = None):
+        treeCost = self.getTreeCost(nodeTree)
+        nodeCosts = treeCost.nodeCosts
+        lineCosts = {}
+        if(lineNodes != None):
+            for lineNo, nodes in lineNodes.items():
+                cost = sum(nodeCosts.get(n, 0) for n in set(nodes))
+                if(cost > 0): lineCosts[lineNo] = cost
+
+        subgraphs = [('Line ' + str(lineNo), cost) \
+            for lineNo, cost in lineCosts.items()]
+        groupCosts = {}
+        for node, cost in nodeCosts.items():
+            if(node.bl_idname == SHADER_GROUP and node.node_tree != None):
+                name = node.node_tree.name
+                groupCosts[name] = groupCosts.get(name, 0) + cost
+        subgraphs += [('Group ' + name, cost) \
+            for name, cost in groupCosts.items()]
+        subgraphs = sorted(subgraphs, key = lambda s: -s[1])[:MAX_SUBGRAPHS]
+        return RenderCost(treeCost, subgraphs, lineCosts)
+
+def estimateCost(nodeTree, lineNodes = None):
+    return RenderCostEstimator().estimate(nodeTree, lineNodes)
@@ -0,0 +1,193 @@
+#
+# Socket schema registry for the nodes in lookups (fnMap, mathFnMap and
+# vmathFnMap): socket names, types, defaults, availability (enabled) by
+# operation and node sizes, so that scripts can be checked and compiled
+# without Blender.
+# The data is generated with extractschema.py, one file per Blender version
+# (schemas/blender_<major>_<minor>.json) and loaded on first use.
+#
+# File format (version 1), one node per line:
+#   nodes: {bl_idname: {'in' / 'out': [[name, type, default, enabled]],
+#       'size': [width, height], 'ops': {operation: {'in' / 'out': enabled
+#       socket indices, 'size': [width, height]}}}}
+#   type is one of the keys of socketTypes; default and enabled are
+#   optional (default of the type, enabled)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import json, os
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+from .lookups import fnMap, mathFnMap, vmathFnMap
+from .lookups import SHADER_MATH, SHADER_VMATH
+from .sockindex import normalizeName
+
+FORMAT_VERSION = 1
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+    'schemas')
+SCHEMA_PREFIX = 'blender_'
+SCHEMA_EXT = '.json'
+
+# Blender version for headless use e.g. 2.90 (default: latest available)
+VERSION_ENV = 'XNODIFY_BLENDER_VERSION'
+
+socketTypes = {'F': 'VALUE', 'I': 'INT', 'V': 'VECTOR', 'C': 'RGBA', \
+    'S': 'SHADER', 'T': 'STRING'}
+typeDefaults = {'F': 0.0, 'I': 0, 'V': [0.0, 0.0, 0.0], \
+    'C': [0.0, 0.0, 0.0, 1.0], 'T': ''}
+
+class SocketSchema:
+    def __init__(self, data, identifier):
+        self.name = data[0]
+        self.identifier = identifier
+        self.type = socketTypes[data[1]]
+        self.default = data[2] if len(data) > 2 else typeDefaults.get(data[1])
+        self.enabled = (len(data) < 4 or data[3] == 1)
+
+    def __repr__(self):
+        return '<SocketSchema ' + self.identifier + ' ' + self.type + '>'
+
+class NodeSchema:
+    @staticmethod
+    def createSockets(datas):
+        sockets = []
+        names = set()
+        for data in datas:
+            # Like bpy, identifiers of the same names are numbered
+            identifier = data[0]
+            i = 1
+            while(identifier in names):
+                identifier = data[0] + '_%03d' % i
+                i += 1
+            names.add(identifier)
+            sockets.append(SocketSchema(data, identifier))
+        return sockets
+
+    def __init__(self, bl_idname, data):
+        self.bl_idname = bl_idname
+        self.inputs = NodeSchema.createSockets(data['in'])
+        self.outputs = NodeSchema.createSockets(data['out'])
+        self.size = tuple(data['size'])
+        self.ops = data.get('ops', {})
+
+    def getSockets(self, isOutput):
+        return self.outputs if isOutput else self.inputs
+
+    # Indices of the available sockets for the operation (math nodes)
+    def getEnabled(self, isOutput, operation = None):
+        opData = self.ops.get(operation)
+        if(opData != None):
+            return opData['out' if isOutput else 'in']
+        return [i for i, s in enumerate(self.getSockets(isOutput)) \
+            if s.enabled]
+
+    def getSize(self, operation = None):
+        opData = self.ops.get(operation)
+        return tuple(opData['size']) if opData != None else self.size
+
+    # Available socket with the name or identifier (see sockindex) or None
+    def getSocket(self, name, isOutput, operation = None):
+        sockets = self.getSockets(isOutput)
+        enabled = [sockets[i] for i in self.getEnabled(isOutput, operation)]
+        name = normalizeName(name)
+        for attr in ('name', 'identifier'):
+            for socket in enabled:
+                if(normalizeName(getattr(socket, attr)) == name):
+                    return socket
+        return None
+
+    # Available socket at the position (as used in the script) or None
+    def getSocketAt(self, pos, isOutput, operation = None):
+        enabled = self.getEnabled(isOutput, operation)
+        if(0 <= pos < len(enabled)):
+            return self.getSockets(isOutput)[enabled[pos]]
+        return None
+
+def parseVersion(version):
+    if(isinstance(version, str)):
+        version = version.replace('_', '.').split('.')
+    return tuple(int(v) for v in version[:2])
+
+_versions = None
+
+# Sorted list of (major, minor) of the available schema files
+def getVersions():
+    global _versions
+    if(_versions == None):
+        versions = []
+        for fileName in os.listdir(SCHEMA_DIR):
+            if(fileName.startswith(SCHEMA_PREFIX) and \
+                fileName.endswith(SCHEMA_EXT)):
+                try: versions.append(parseVersion(\
+                    fileName[len(SCHEMA_PREFIX):-len(SCHEMA_EXT)]))
+                except ValueError: pass
+        _versions = sorted(versions)
+    return _versions
+
+# Latest schema not newer than the version (oldest if all are newer)
+def selectVersion(version = None):
+    versions = getVersions()
+    if(len(versions) == 0): return None
+    if(version == None): return versions[-1]
+    version = parseVersion(version)
+    older = [v for v in versions if v <= version]
+    return older[-1] if len(older) > 0 else versions[0]
+
+def getSchemaPath(version):
+    return os.path.join(SCHEMA_DIR, SCHEMA_PREFIX + \
+        '%d_%d' % version + SCHEMA_EXT)
+
+_activeVersion = None
+_schemas = {} # version: {bl_idname: node data / NodeSchema}
+
+# Version of the schema used when none is given
+# (default: VERSION_ENV, the running Blender or the latest available)
+def setVersion(version):
+    global _activeVersion
+    _activeVersion = selectVersion(version)
+
+def getActiveVersion():
+    if(_activeVersion == None):
+        version = os.environ.get(VERSION_ENV)
+        if(version == None and bpy != None): version = bpy.app.version
+        setVersion(version)
+    return _activeVersion
+
+def loadSchemas(version):
+    with open(getSchemaPath(version)) as f:
+        data = json.load(f)
+    if(data.get('format', 0) > FORMAT_VERSION):
+        raise ValueError('Unsupported schema format: ' + \
+            str(data.get('format')))
+    return data['nodes']
+
+# Returns NodeSchema for bl_idname or None if not in the schema
+def getNodeSchema(bl_idname, version = None):
+    version = getActiveVersion() if version == None else selectVersion(version)
+    if(version == None): return None
+    nodes = _schemas.get(version)
+    if(nodes == None):
+        nodes = loadSchemas(version)
+        _schemas[version] = nodes
+    nodeSchema = nodes.get(bl_idname)
+    if(isinstance(nodeSchema, dict)): # Parsed on first use
+        nodeSchema = NodeSchema(bl_idname, nodeSchema)
+        nodes[bl_idname] = nodeSchema
+    return nodeSchema
+
+# Returns (NodeSchema, operation) for the custom name (key of the lookup maps)
+def getFnSchema(customName, version = None):
+    if(customName in mathFnMap):
+        return getNodeSchema(SHADER_MATH, version), mathFnMap[customName][1]
+    if(customName in vmathFnMap):
+        return getNodeSchema(SHADER_VMATH, version), vmathFnMap[customName][1]
+    if(customName in fnMap):
+        return getNodeSchema(fnMap[customName][1], version), None
+    return None, None
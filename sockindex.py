@@ -0,0 +1,58 @@
+#
+# Cached index of the node sockets used to resolve arguments and
+# output indices ([] operator) by position as well as by name.
+# Available (enabled) sockets depend only on node type and operation for
+# freshly created nodes, so the index is built once per (type, operation)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+from .lookups import SHADER_GROUP, SHADER_SCRIPT
+
+# Names are matched ignoring case, spaces and underscores
+# e.g. Base Color, base_color and BaseColor are the same
+def normalizeName(name):
+    return name.replace(' ', '').replace('_', '').lower()
+
+class SocketIndex:
+    def __init__(self, sockets):
+        # Position (in the script): index in node.inputs / node.outputs
+        self.positions = [i for i, s in enumerate(sockets) \
+            if s.enabled == True and s.hide == False]
+        self.names = {}
+        for i in self.positions: # First socket wins for duplicate names
+            self.names.setdefault(normalizeName(sockets[i].name), i)
+        for i in self.positions: # Identifiers e.g. Shader_001
+            self.names.setdefault(normalizeName(sockets[i].identifier), i)
+
+    def getPosIdx(self, pos):
+        return self.positions[pos] if 0 <= pos < len(self.positions) else None
+
+    def getNameIdx(self, name):
+        return self.names.get(normalizeName(name))
+
+    # sockIdx: position (int or numeric string) or socket name
+    # Returns index in node.inputs / node.outputs or None
+    def getIdx(self, sockIdx):
+        if(isinstance(sockIdx, int)): return self.getPosIdx(sockIdx)
+        if(sockIdx.isdigit()): return self.getPosIdx(int(sockIdx))
+        return self.getNameIdx(sockIdx)
+
+_socketIndices = {}
+
+# Sockets of these change with the group interface or with the OSL shader
+# (Script node, see oslgen), so they are not cached
+INTERFACE_NODES = {SHADER_GROUP, 'NodeGroupInput', 'NodeGroupOutput', \
+    SHADER_SCRIPT}
+
+def getSocketIndex(node, out = True):
+    if(node.bl_idname in INTERFACE_NODES):
+        return SocketIndex(node.outputs if out else node.inputs)
+    key = (node.bl_idname, getattr(node, 'operation', None), out)
+    sockIndex = _socketIndices.get(key)
+    if(sockIndex == None):
+        sockIndex = SocketIndex(node.outputs if out else node.inputs)
+        _socketIndices[key] = sockIndex
+    return sockIndex
@@ -0,0 +1,9 @@
+#
+# Tests of the compiler modules, run outside Blender (in-memory node trees,
+# see nodemodel) from the parent directory of the add-on folder e.g.
+#   python -m unittest discover -s xnodify/tests -t .
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
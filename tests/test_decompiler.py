@@ -0,0 +1,54 @@
+#
+# Tests of the decompiler: scripts decompiled from the generated node trees
+# must generate the same nodes again
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import unittest
+
+from .. import decompiler
+from ..compiler import compileLines, getGraphStats
+from ..lookups import SHADER_GROUP, SHADER_VALUE
+
+def getGroupTree(nodeTree):
+    return [n for n in nodeTree.nodes if n.bl_idname == SHADER_GROUP][0] \
+        .node_tree
+
+class TestRoundTrip(unittest.TestCase):
+    def roundTrip(self, lines):
+        nodeTree, displayParams = compileLines(lines, addFrame = False)
+        script, warnings = decompiler.decompileTree(nodeTree)
+        self.assertEqual(warnings, [])
+        nodeTree2, displayParams = compileLines(script, addFrame = False)
+        self.assertEqual(getGraphStats(nodeTree2), getGraphStats(nodeTree))
+        return nodeTree, nodeTree2, script
+
+    def test_group_local_variables(self):
+        nodeTree, nodeTree2, script = \
+            self.roundTrip(['output(emission(grp{t = sin(x) * 2, t * t + t}))'])
+        self.assertEqual(script, ['output(emission(grp{multiply = ' + \
+            'mult(sin(x), 2), add(mult(multiply, multiply), multiply)}))'])
+        # The undeclared x stays a (local) Value node named x
+        names = [n.label for n in getGroupTree(nodeTree2).nodes \
+            if n.bl_idname == SHADER_VALUE]
+        self.assertIn('x', names)
+
+    def test_group_outputs(self):
+        nodeTree, nodeTree2, script = self.roundTrip(['g = grp{t = ' + \
+            'sepxyz(texco()[3]), u = t[0] * t[1], add(u), u * 4}', \
+                'output(emission(g[0] + g[1]))'])
+        for tree in (nodeTree, nodeTree2):
+            self.assertEqual(len(getGroupTree(tree).outputs), 9)
+
+    def test_input_names(self):
+        # x of the group body is local, the script's x gets another name
+        nodeTree, nodeTree2, script = self.roundTrip(['g = grp{x$[0.5], ' + \
+            't = sin(x), t * t}', 'x', 'output(emission(g + x))'])
+        self.assertEqual(script, ['x_1', 'output(emission(add(grp{x$[0.5], ' + \
+            'sine = sin(x), mult(sine, sine)}, x_1)))'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,502 @@
+#
+# Tests of the OSL code generation (oslgen): the shader generated for each
+# Math and Vector Math operation must compute what numeval computes for the
+# nodes it replaces (semantics of lookups.mathFnMap / vmathFnMap, including
+# the edge cases handled by OSL_HELPERS). The shaders are run by a small
+# interpreter of the OSL subset the generator uses (OSLProgram)
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+import itertools, math, re, unittest
+
+try:
+    import numpy as np
+except ImportError: # Optional, needed by numeval
+    np = None
+
+from .. import oslgen
+from ..lookups import mathFnMap, vmathFnMap, SHADER_MATH, SHADER_VMATH, \
+    SHADER_VALUE, SHADER_SCRIPT
+from ..nodemodel import NodeGroups
+
+# Operands of the samples, with the edge cases of the helpers: zero divisor,
+# negative operands (sign of modulo, power), equal operands (compare, wrap
+# with empty range, snap and ping-pong by 0) and integer exponents
+SAMPLE_VALUES = [-2.5, -1.0, 0.0, 0.3, 1.0, 2.5]
+RTOL, ATOL = 1e-9, 1e-9
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+)|' + \
+    r'([A-Za-z_]\w*)|(&&|\|\||==|!=|<=|>=|[-+*/<>?:(),\[\]!=;{}]))')
+BINARY_PRECEDENCE = [('||',), ('&&',), ('==', '!='), ('<', '>', '<=', '>='), \
+    ('+', '-'), ('*', '/')]
+TYPES = {'float', 'vector'}
+
+class Vector(tuple):
+    pass
+
+def isVector(value):
+    return isinstance(value, Vector)
+
+def toVector(value):
+    return value if isVector(value) else Vector((value,) * 3)
+
+# Function applied to each component of the vector arguments
+def componentWise(fn):
+    def apply(*args):
+        if(not any(isVector(a) for a in args)): return fn(*args)
+        args = [toVector(a) for a in args]
+        return Vector(fn(*[a[i] for a in args]) for i in range(3))
+    return apply
+
+def divide(a, b):
+    return a / b if b != 0 else 0.0 # OSL division by zero is 0
+
+def power(a, b):
+    try: return a ** b
+    except ZeroDivisionError: return math.inf
+
+BINARY_OPS = {'+': componentWise(lambda a, b: a + b), \
+    '-': componentWise(lambda a, b: a - b), \
+        '*': componentWise(lambda a, b: a * b), '/': componentWise(divide), \
+            '<': lambda a, b: a < b, '>': lambda a, b: a > b, \
+                '<=': lambda a, b: a <= b, '>=': lambda a, b: a >= b, \
+                    '==': lambda a, b: a == b, '!=': lambda a, b: a != b}
+
+def dot(a, b):
+    return sum(a[i] * b[i] for i in range(3))
+
+BUILTINS = {'floor': componentWise(lambda a: float(math.floor(a))), \
+    'ceil': componentWise(lambda a: float(math.ceil(a))), \
+    'trunc': componentWise(lambda a: float(math.trunc(a))), \
+    'abs': componentWise(abs), 'sign': componentWise(lambda a: \
+        float(a > 0) - float(a < 0)), \
+    'min': componentWise(min), 'max': componentWise(max), \
+    'clamp': componentWise(lambda a, lo, hi: min(max(a, lo), hi)), \
+    'fmod': componentWise(math.fmod), 'pow': componentWise(power), \
+    'exp': componentWise(math.exp), 'log': componentWise(math.log), \
+    'sqrt': componentWise(math.sqrt), 'sin': componentWise(math.sin), \
+    'cos': componentWise(math.cos), 'tan': componentWise(math.tan), \
+    'asin': componentWise(math.asin), 'acos': componentWise(math.acos), \
+    'atan': componentWise(math.atan), 'atan2': componentWise(math.atan2), \
+    'sinh': componentWise(math.sinh), 'cosh': componentWise(math.cosh), \
+    'tanh': componentWise(math.tanh), \
+    'radians': componentWise(math.radians), \
+    'degrees': componentWise(math.degrees), \
+    'vector': lambda *a: toVector(a[0]) if len(a) == 1 else Vector(a), \
+    'dot': dot, 'length': lambda a: math.sqrt(dot(a, a)), \
+    'distance': lambda a, b: math.sqrt(dot(BINARY_OPS['-'](a, b), \
+        BINARY_OPS['-'](a, b))), \
+    'cross': lambda a, b: Vector((a[1] * b[2] - a[2] * b[1], \
+        a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]))}
+
+class ReturnValue(Exception):
+    def __init__(self, value):
+        self.value = value
+
+# Functions (overloaded by the parameter types) and the shader of the
+# generated source, parsed into tuples
+class OSLProgram:
+    def __init__(self, source):
+        source = re.sub(r'//[^\n]*', '', source)
+        self.tokens = []
+        pos = 0
+        while(source[pos:].strip() != ''):
+            match = TOKEN_PATTERN.match(source, pos)
+            if(match == None):
+                raise SyntaxError('Unexpected OSL: ' + source[pos:pos + 20])
+            number, name, op = match.groups()
+            self.tokens.append(('num', float(number)) if number != None \
+                else ('name', name) if name != None else ('op', op))
+            pos = match.end()
+        self.pos = 0
+        self.functions = {} # Name: [(types, parameter names, body)]
+        self.shader = None # (parameters, body)
+        while(self.pos < len(self.tokens)): self.parseDefinition()
+
+    def peek(self):
+        return self.tokens[self.pos][1] if self.pos < len(self.tokens) \
+            else None
+
+    def next(self, expected = None):
+        token = self.tokens[self.pos][1]
+        if(expected != None and token != expected):
+            raise SyntaxError('Expected ' + expected + ', got ' + str(token))
+        self.pos += 1
+        return token
+
+    def parseDefinition(self):
+        isShader = self.next() == 'shader' # Else return type
+        name = self.next()
+        self.next('(')
+        params = []
+        while(self.peek() != ')'):
+            isOutput = self.peek() == 'output'
+            if(isOutput): self.next()
+            params.append((isOutput, self.next(), self.next()))
+            if(self.peek() == '='): # Default of shader parameter
+                self.next()
+                self.parseExpr()
+            if(self.peek() == ','): self.next()
+        self.next(')')
+        body = self.parseBlock()
+        if(isShader): self.shader = (params, body)
+        else:
+            self.functions.setdefault(name, []).append(([p[1] for p in \
+                params], [p[2] for p in params], body))
+
+    def parseBlock(self):
+        self.next('{')
+        statements = []
+        while(self.peek() != '}'): statements.append(self.parseStatement())
+        self.next('}')
+        return statements
+
+    def parseStatement(self):
+        token = self.next()
+        if(token == 'return'):
+            statement = ('return', self.parseExpr())
+        elif(token == 'if'):
+            self.next('(')
+            condition = self.parseExpr()
+            self.next(')')
+            return ('if', condition, self.parseStatement())
+        elif(token in TYPES):
+            name = self.next()
+            self.next('=')
+            statement = ('declare', token, name, self.parseExpr())
+        else:
+            self.next('=')
+            statement = ('assign', token, self.parseExpr())
+        self.next(';')
+        return statement
+
+    def parseExpr(self):
+        condition = self.parseBinary(0)
+        if(self.peek() != '?'): return condition
+        self.next()
+        value = self.parseExpr()
+        self.next(':')
+        return ('?', condition, value, self.parseExpr())
+
+    def parseBinary(self, level):
+        if(level == len(BINARY_PRECEDENCE)): return self.parseUnary()
+        expr = self.parseBinary(level + 1)
+        while(self.peek() in BINARY_PRECEDENCE[level] and \
+            self.tokens[self.pos][0] == 'op'):
+            op = self.next()
+            expr = (op, expr, self.parseBinary(level + 1))
+        return expr
+
+    def parseUnary(self):
+        if(self.peek() in {'-', '!'} and self.tokens[self.pos][0] == 'op'):
+            op = self.next()
+            return ('neg' if op == '-' else '!', self.parseUnary())
+        kind, token = self.tokens[self.pos]
+        self.pos += 1
+        if(kind == 'num'): expr = ('num', token)
+        elif(token == '('):
+            expr = self.parseExpr()
+            self.next(')')
+        elif(self.peek() == '('):
+            self.next()
+            args = []
+            while(self.peek() != ')'):
+                args.append(self.parseExpr())
+                if(self.peek() == ','): self.next()
+            self.next(')')
+            expr = ('call', token, args)
+        else: expr = ('var', token)
+        while(self.peek() == '['):
+            self.next()
+            expr = ('[', expr, self.parseExpr())
+            self.next(']')
+        return expr
+
+    def evaluate(self, expr, env):
+        kind = expr[0]
+        if(kind == 'num'): return expr[1]
+        if(kind == 'var'): return env[expr[1]]
+        if(kind == 'neg'): return BINARY_OPS['*'](-1.0, \
+            self.evaluate(expr[1], env))
+        if(kind == '!'): return not self.evaluate(expr[1], env)
+        if(kind == '['): return self.evaluate(expr[1], env)[\
+            int(self.evaluate(expr[2], env))]
+        if(kind == '?'):
+            return self.evaluate(expr[2] if self.evaluate(expr[1], env) \
+                else expr[3], env)
+        if(kind == '&&'):
+            return self.evaluate(expr[1], env) and self.evaluate(expr[2], env)
+        if(kind == '||'):
+            return self.evaluate(expr[1], env) or self.evaluate(expr[2], env)
+        if(kind == 'call'):
+            return self.call(expr[1], [self.evaluate(a, env) \
+                for a in expr[2]])
+        return BINARY_OPS[kind](self.evaluate(expr[1], env), \
+            self.evaluate(expr[2], env))
+
+    # Overload with the same argument types, else the one taking vectors
+    # (floats are promoted)
+    def call(self, name, args):
+        overloads = self.functions.get(name)
+        if(overloads == None): return BUILTINS[name](*args)
+        argTypes = ['vector' if isVector(a) else 'float' for a in args]
+        matches = [o for o in overloads if o[0] == argTypes] + \
+            [o for o in overloads if all(t == 'vector' or a == 'float' \
+                for t, a in zip(o[0], argTypes))]
+        types, names, body = matches[0]
+        env = {n: toVector(a) if t == 'vector' else a \
+            for t, n, a in zip(types, names, args)}
+        try: self.execute(body, env)
+        except ReturnValue as ret: return ret.value
+        raise SyntaxError('No return in ' + name)
+
+    def execute(self, statements, env):
+        for statement in statements:
+            kind = statement[0]
+            if(kind == 'return'):
+                raise ReturnValue(self.evaluate(statement[1], env))
+            if(kind == 'if'):
+                if(self.evaluate(statement[1], env)):
+                    self.execute([statement[2]], env)
+            elif(kind == 'declare'):
+                value = self.evaluate(statement[3], env)
+                env[statement[2]] = toVector(value) \
+                    if statement[1] == 'vector' else value
+            else:
+                env[statement[1]] = self.evaluate(statement[2], env)
+
+    # Values of the output parameters for the values of the inputs
+    def runShader(self, inputs):
+        params, body = self.shader
+        env = dict(inputs)
+        self.execute(body, env)
+        return {name: env[name] for isOutput, oslType, name in params \
+            if isOutput}
+
+def newValueNode(nodeTree, name):
+    node = nodeTree.nodes.new(SHADER_VALUE)
+    node.name = name
+    return node
+
+def newCombineNode(nodeTree, sources):
+    node = nodeTree.nodes.new('ShaderNodeCombineXYZ')
+    for i, src in enumerate(sources):
+        nodeTree.links.new(src.outputs[0], node.inputs[i])
+    return node
+
+def getSamples():
+    samples = list(itertools.product(SAMPLE_VALUES, repeat = 3))
+    return {name: np.array([s[i] for s in samples], dtype = np.float64) \
+        for i, name in enumerate('xyz')}
+
+# Tree with the operation applied to x, y, z (vectors (x, y, z), (y, z, x),
+# (z, x, y) and scale x for vector math) and followed by an addition of 0,
+# so that the region has two nodes. Returns the tree, the nodes of the
+# region and the input socket (of a node that is not compiled) fed by it
+def getOperationTree(bl_idname, operation, useClamp = False):
+    nodeTree = NodeGroups().newRootTree('Material')
+    x, y, z = [newValueNode(nodeTree, name) for name in 'xyz']
+    node = nodeTree.nodes.new(bl_idname)
+    node.operation = operation
+    node.use_clamp = useClamp
+    if(bl_idname == SHADER_MATH):
+        sources = [x, y, z]
+    else:
+        sources = [newCombineNode(nodeTree, s) \
+            for s in ([x, y, z], [y, z, x], [z, x, y])] + [x]
+    for i, src in enumerate(sources):
+        nodeTree.links.new(src.outputs[0], node.inputs[i])
+    result = oslgen.getResult(node)[0]
+    isVectorResult = result.type == 'VECTOR'
+    addNode = nodeTree.nodes.new(SHADER_VMATH if isVectorResult \
+        else SHADER_MATH)
+    addNode.operation = 'ADD'
+    nodeTree.links.new(result, addNode.inputs[0])
+    addNode.inputs[1].default_value = (0.0, 0.0, 0.0) if isVectorResult \
+        else 0.0
+    consumer = nodeTree.nodes.new('ShaderNodeSeparateXYZ' if isVectorResult \
+        else 'ShaderNodeCombineXYZ')
+    nodeTree.links.new(addNode.outputs[0], consumer.inputs[0])
+    return nodeTree, [node, addNode], consumer.inputs[0]
+
+# Values computed by the Script node for the samples, for its output that
+# feeds the socket
+def runScript(nodeTree, socket, samples):
+    from .. import numeval
+    script = socket.links[0].from_node
+    program = OSLProgram(script[oslgen.OSL_SOURCE_PROP])
+    interpreter = numeval.GraphInterpreter(samples, dtype = np.float64)
+    inputs = {}
+    for ip in script.inputs:
+        link = ip.links[0]
+        inputs[ip.name] = numeval.convertValue(interpreter.getSocketValue(\
+            link.from_socket), link.from_socket.type, ip.type)
+    count = len(samples['x'])
+    results = []
+    for i in range(count):
+        values = {name: Vector(v[i]) if np.ndim(v) == 2 else float(v[i]) \
+            for name, v in inputs.items()}
+        results.append(program.runShader(values)[\
+            socket.links[0].from_socket.name])
+    return np.array(results, dtype = np.float64)
+
+@unittest.skipIf(np == None, 'NumPy is needed by numeval')
+class TestOperations(unittest.TestCase):
+    def checkOperation(self, bl_idname, operation, useClamp = False):
+        from .. import numeval
+        samples = getSamples()
+        nodeTree, nodes, socket = getOperationTree(bl_idname, operation, \
+            useClamp)
+        interpreter = numeval.GraphInterpreter(samples, dtype = np.float64)
+        expected = np.array(interpreter.getSocketValue(\
+            socket.links[0].from_socket))
+
+        variables = [n for n in nodeTree.nodes if n.bl_idname == SHADER_VALUE]
+        edits, failed = oslgen.compileGraph(list(nodeTree.nodes), variables, \
+            nodeTree, oslgen.OSL_ALL)
+        self.assertEqual(failed, [])
+        self.assertEqual(socket.links[0].from_node.bl_idname, SHADER_SCRIPT)
+        self.assertTrue(all(n in edits.removed for n in nodes))
+        actual = runScript(nodeTree, socket, samples)
+        np.testing.assert_allclose(actual, expected, rtol = RTOL, \
+            atol = ATOL, err_msg = operation + '\n' + \
+                socket.links[0].from_node[oslgen.OSL_SOURCE_PROP])
+
+    def test_math_operations(self):
+        operations = sorted(set(fnInfo[1] for fnInfo in mathFnMap.values()))
+        self.assertEqual(set(operations) - set(oslgen.MATH_EXPRS), set())
+        for operation in operations:
+            with self.subTest(operation = operation):
+                self.checkOperation(SHADER_MATH, operation)
+
+    def test_vector_math_operations(self):
+        operations = sorted(set(fnInfo[1] for fnInfo in vmathFnMap.values()))
+        self.assertEqual(set(operations) - set(oslgen.VMATH_EXPRS), set())
+        for operation in operations:
+            with self.subTest(operation = operation):
+                self.checkOperation(SHADER_VMATH, operation)
+
+    def test_clamp(self):
+        for operation in ('MULTIPLY_ADD', 'DIVIDE', 'POWER'):
+            with self.subTest(operation = operation):
+                self.checkOperation(SHADER_MATH, operation, useClamp = True)
+
+class TestHelpers(unittest.TestCase):
+    def call(self, name, *args):
+        return OSLProgram(oslgen.getHelperSource(name + '(')).call(name, \
+            list(args))
+
+    def test_edge_cases(self):
+        self.assertEqual(self.call('xn_div', 1.0, 0.0), 0.0)
+        self.assertEqual(self.call('xn_div', Vector((1.0, 2.0, 3.0)), \
+            Vector((2.0, 0.0, -1.0))), (0.5, 0.0, -3.0))
+        self.assertEqual(self.call('xn_mod', -2.5, 1.0), -0.5) # Sign of a
+        self.assertEqual(self.call('xn_mod', 2.5, -1.0), 0.5)
+        self.assertEqual(self.call('xn_mod', 2.5, 0.0), 0.0)
+        self.assertEqual(self.call('xn_cmp', 1.0, 1.000001, 0.0), 1.0)
+        self.assertEqual(self.call('xn_cmp', 1.0, 1.1, 0.0), 0.0)
+        self.assertEqual(self.call('xn_wrap', 2.5, 1.0, 0.0), 0.5)
+        self.assertEqual(self.call('xn_wrap', -0.25, 1.0, 0.0), 0.75)
+        self.assertEqual(self.call('xn_wrap', 2.5, 1.0, 1.0), 1.0)
+        self.assertEqual(self.call('xn_snap', 2.5, 1.0), 2.0)
+        self.assertEqual(self.call('xn_snap', -2.5, 1.0), -3.0)
+        self.assertEqual(self.call('xn_snap', 2.5, 0.0), 0.0)
+        self.assertEqual(self.call('xn_pingpong', 2.5, 1.0), 0.5)
+        self.assertEqual(self.call('xn_pingpong', -0.25, 1.0), 0.25)
+        self.assertEqual(self.call('xn_pingpong', 2.5, 0.0), 0.0)
+        self.assertEqual(self.call('xn_pow', -2.0, 0.5), 0.0)
+        self.assertEqual(self.call('xn_pow', -2.0, 3.0), -8.0)
+        self.assertEqual(self.call('xn_sqrt', -4.0), 0.0)
+        self.assertEqual(self.call('xn_log', -1.0, 2.0), 0.0)
+        self.assertEqual(self.call('xn_normalize', Vector((0.0,) * 3)), \
+            (0.0, 0.0, 0.0))
+
+    # Each helper comes after the ones it uses
+    def test_helper_order(self):
+        names = [name for name, source in oslgen.OSL_HELPERS]
+        for i, (name, source) in enumerate(oslgen.OSL_HELPERS):
+            used = set(oslgen.HELPER_PATTERN.findall(source)) - {name}
+            self.assertTrue(used <= set(names[:i]), name)
+
+class TestRegions(unittest.TestCase):
+    # a = x * 2 + 1, b = clamp(a), c = a * b + 1: a and c can't be one
+    # region, the Script node would feed itself through the Clamp node
+    def test_no_cycles(self):
+        nodeTree = NodeGroups().newRootTree('Material')
+        x = newValueNode(nodeTree, 'x')
+        links = nodeTree.links
+        def newMath(operation, src0, src1 = None):
+            node = nodeTree.nodes.new(SHADER_MATH)
+            node.operation = operation
+            for i, src in enumerate((src0, src1)):
+                if(src != None): links.new(src.outputs[0], node.inputs[i])
+            return node
+        a = newMath('ADD', newMath('MULTIPLY', x))
+        b = nodeTree.nodes.new('ShaderNodeClamp')
+        links.new(a.outputs[0], b.inputs[0])
+        c = newMath('ADD', newMath('MULTIPLY', a, b))
+        consumer = nodeTree.nodes.new('ShaderNodeCombineXYZ')
+        links.new(c.outputs[0], consumer.inputs[0])
+
+        oslgen.compileGraph(list(nodeTree.nodes), [x], nodeTree, \
+            oslgen.OSL_ALL)
+        scripts = [n for n in nodeTree.nodes if n.bl_idname == SHADER_SCRIPT]
+        self.assertEqual(len(scripts), 2)
+        # Default names as in Blender (Script, Script.001)
+        self.assertEqual(sorted(n.name for n in scripts), \
+            ['Script', 'Script.001'])
+        for script in scripts:
+            upstream = set()
+            stack = [l.from_node for ip in script.inputs for l in ip.links]
+            while(len(stack) > 0):
+                node = stack.pop()
+                if(node in upstream): continue
+                upstream.add(node)
+                stack += [l.from_node for ip in node.inputs for l in ip.links]
+            self.assertNotIn(script, upstream)
+
+    def test_group_selection(self):
+        from ..compiler import compileLines
+        from ..main import CompileOptions
+        lines = ['a = g1(x){sin(x) * 2 + 1}', 'b = g2(x){cos(x) * 3 - 1}', \
+            'c = x * 4 + a', 'output(emission(comxyz(a, b, c)))']
+        matNodeTree, displayParams = compileLines(lines, addFrame = False, \
+            options = CompileOptions(osl = oslgen.parseSelection('g1')))
+        groupTrees = {n.node_tree.name: n.node_tree \
+            for n in matNodeTree.nodes if n.node_tree != None}
+        hasScript = lambda tree: any(n.bl_idname == SHADER_SCRIPT \
+            for n in tree.nodes)
+        self.assertTrue(hasScript(groupTrees['g1']))
+        self.assertFalse(hasScript(groupTrees['g2']))
+        self.assertFalse(hasScript(matNodeTree))
+
+    def test_layout_cache(self):
+        # Same layout structure, Script nodes with 2 and 3 outputs: the
+        # texture coordinate node below the Script node moves down
+        from ..compiler import compileLines
+        from ..main import CompileOptions, NodeLayout
+        def getLocations(lines):
+            matNodeTree, displayParams = compileLines(lines, addFrame = \
+                False, options = CompileOptions(osl = oslgen.OSL_ALL))
+            return {n.bl_idname: tuple(n.location) for n in matNodeTree.nodes}
+        lines = ['a = sin(x) * 2 + 1', 'b = a * 3', \
+            'output(emission(mixrgb(b, a, noisetex(texco()))))']
+        lines2 = lines[:2] + \
+            ['output(emission(mixrgb(b, a + b, noisetex(texco()))))']
+        NodeLayout.clearLayoutCache()
+        locations = getLocations(lines)
+        locations2 = getLocations(lines2)
+        NodeLayout.clearLayoutCache()
+        self.assertEqual(locations2, getLocations(lines2))
+        self.assertNotEqual(locations, locations2)
+
+    def test_parse_selection(self):
+        self.assertEqual(oslgen.parseSelection(''), oslgen.OSL_ALL)
+        self.assertEqual(oslgen.parseSelection('*'), oslgen.OSL_ALL)
+        self.assertEqual(oslgen.parseSelection(' g1, g2 ,'), {'g1', 'g2'})
+
+if __name__ == '__main__':
+    unittest.main()
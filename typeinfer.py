@@ -0,0 +1,129 @@
+#
+# Socket type inference for parsed XNodify scripts.
+# Annotates each symbol with the type of the output it evaluates to
+# (VALUE, VECTOR, RGBA or SHADER; None if not known e.g. groups), which is
+# used to select math, vector math or shader nodes for the operators
+#
+# Copyright (C) 2020  Shrinivas Kulkarni
+#
+# License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
+#
+
+from .lookups import getOutputType
+from .checker import getCustomName, getSwizzleFn, VECTOR_FN
+from .schema import getFnSchema
+from .registry import getOperator
+from .evaluator import BraceEvaluator
+
+# type1 is the same as type0 for prefix operators
+def getOperatorType(opInfo, type0, type1):
+    types = {type0, type1}
+    if('SHADER' in types):
+        if(opInfo.isShader and types == {'SHADER'}): return 'SHADER'
+        raise SyntaxError('Operator ' + opInfo.token + \
+            ' not supported for shaders' + \
+                (' (use addshad or mixshad)' if opInfo.isShader else ''))
+    if(opInfo.isVector and ('VECTOR' in types or 'RGBA' in types)):
+        return 'VECTOR'
+    return 'VALUE'
+
+class TypeInferer:
+    def __init__(self):
+        self.errors = []
+        # Variable name: (custom name of node, bound output index, type)
+        self.varTypes = {}
+
+    def inferProgram(self, program):
+        for lineNo, dataTree in program:
+            try: self.inferType(dataTree)
+            except SyntaxError as e: self.errors.append((lineNo, str(e)))
+        return self.errors
+
+    def getIndexedType(self, customName, sockIdx, default):
+        if(customName == None): return default
+        try: idx = 0 if sockIdx == None else int(sockIdx)
+        except ValueError: # Socket name
+            nodeSchema, operation = getFnSchema(customName)
+            if(nodeSchema == None): return None
+            socket = nodeSchema.getSocket(sockIdx, True, operation)
+            return socket.type if socket != None else None
+        return getOutputType(customName, idx)
+
+    def inferType(self, data):
+        id = data.getMetaData().id
+        opInfo = getOperator(id)
+        customName = None
+        if(id == 'NUMBER'):
+            sockType = 'VALUE'
+        elif(id == 'NAME'):
+            customName = getCustomName(data.value)
+            if(customName != None or data.isGroup):
+                sockType = self.getIndexedType(customName, data.sockIdx, None)
+            else:
+                varName, boundIdx, sockType = \
+                    self.varTypes.get(data.value, (None, None, 'VALUE'))
+                if(boundIdx == None):
+                    sockType = self.getIndexedType(varName, data.sockIdx, \
+                        sockType)
+        elif(id == '('):
+            types = set(self.inferType(op) for op in data.operand1 \
+                if op != None)
+            if(data.operand0 == None): # Vector e.g. (1, x, 0)
+                if('SHADER' in types):
+                    raise SyntaxError('Vector components cannot be shaders')
+                customName = VECTOR_FN
+            else:
+                customName = getCustomName(data.operand0.value)
+            sockType = self.getIndexedType(customName, data.sockIdx, None)
+        elif(id == '.'): # Swizzle e.g. v.x
+            if(self.inferType(data.operand0) == 'SHADER'):
+                raise SyntaxError('Shaders have no components (.' + \
+                    data.value + ')')
+            sockType = 'VALUE'
+        elif(opInfo != None and opInfo.customName != None):
+            type0 = self.inferType(data.operand0)
+            type1 = self.inferType(data.operand1) \
+                if data.operand1 != None else type0
+            sockType = getOperatorType(opInfo, type0, type1)
+        elif(id == '$'):
+            sockType = self.inferType(data.operand0)
+        elif(id == '{'): # Body has its own variables (see checker)
+            paramTypes = {BraceEvaluator.getParamName(param): \
+                (None, None, self.inferType(param)) \
+                    for param in BraceEvaluator.getParams(data)}
+            outerTypes = self.varTypes
+            self.varTypes = paramTypes
+            try:
+                for op in data.operand1:
+                    if(op != None): self.inferType(op)
+            finally:
+                self.varTypes = outerTypes
+            sockType = None
+        elif(id == '='):
+            rhs = data.operand1
+            sockType = self.inferType(rhs)
+            rhsId = rhs.getMetaData().id
+            varType = None
+            if(rhsId == '(' and rhs.operand0 == None):
+                varType = (VECTOR_FN, rhs.sockIdx)
+            elif(rhsId == '('):
+                varType = (getCustomName(rhs.operand0.value), rhs.sockIdx)
+            elif(rhsId == '.'):
+                varType = getSwizzleFn(rhs.value)
+            elif(rhsId == 'NAME'):
+                varType = self.varTypes.get(rhs.value)
+                if(varType == None or getCustomName(rhs.value) != None):
+                    varType = (getCustomName(rhs.value), rhs.sockIdx)
+                elif(varType[1] == None): # Alias of a variable
+                    varType = (varType[0], rhs.sockIdx)
+            if(varType == None): varType = (None, rhs.sockIdx)
+            self.varTypes[data.operand0.value] = \
+                (varType[0], varType[1], sockType)
+        else:
+            sockType = None
+        data.sockType = sockType
+        return sockType
+
+# Returns list of (line no, error message)
+def inferTypes(program):
+    return TypeInferer().inferProgram(program)
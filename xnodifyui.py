@@ -7,19 +7,56 @@
 # License: GPL (https://github.com/Shriinivas/xnodify/blob/master/LICENSE)
 #
 
-import bpy, traceback
+import bpy, traceback, importlib, os, sys
 from bpy.props import StringProperty, FloatProperty, EnumProperty, BoolProperty
 from bpy.types import PropertyGroup, Operator, Panel
+from bpy_extras.io_utils import ExportHelper
 
 from .lookups import nodeGroups, getCombinedMap, mathPrefix, vmathPrefix
-from . main import procStringExpression, procScript, procFile, NodeLayout
 
-# For debugging
-from . import main
-from . import lookups
-import importlib
-importlib.reload(main)
-importlib.reload(lookups)
+# Compiler modules (main, compiler etc.) are imported on first use of the
+# operators and not at registration, to keep Blender startup fast.
+# With XNODIFY_DEBUG_RELOAD=1 they are reloaded on every call instead
+# (to pick up the changes during development without restarting Blender)
+DEBUG_RELOAD_ENV = 'XNODIFY_DEBUG_RELOAD'
+
+# In the order of their dependencies (all the compiler modules, checked by
+# benchimport)
+COMPILER_MODULES = ['lookups', 'sockindex', 'schema', 'Parser', 'evaluator', \
+    'registry', 'nodemodel', 'checker', 'loops', 'importer', 'typeinfer', \
+        'rebalance', 'optimizer', 'oslgen', 'graphformat', 'decompiler', \
+            'costreport', 'rendercost', 'job', 'main', 'reconcile', \
+                'compiler', 'numeval']
+
+# Same as graphformat.GRAPH_EXT (needed at registration)
+GRAPH_EXT = '.xng.json'
+
+# Same as costreport.SORT_KEYS (needed at registration)
+COST_SORT_KEYS = (('line', 'Line', 'Line number'), \
+    ('nodes', 'Nodes', 'Nodes created by the line'), \
+    ('links', 'Links', 'Links to the nodes created by the line'), \
+    ('parse', 'Parse Time', 'Time to parse the line'), \
+    ('evaluate', 'Evaluate Time', 'Time to create the nodes'), \
+    ('layout', 'Layout Time', 'Time to arrange the nodes'), \
+    ('total', 'Total Time', 'Parse, evaluate and layout time'), \
+    ('uses', 'Uses', 'Uses of the variable in the later lines'))
+MAX_COST_ROWS = 20 # Lines shown in the panel (all are exported)
+
+# Cost report (see costreport) of the last generation
+lastCostReport = None
+
+def isDebugReload():
+    return os.environ.get(DEBUG_RELOAD_ENV, '0') not in ('', '0')
+
+def reloadModules():
+    for name in COMPILER_MODULES:
+        module = sys.modules.get(__package__ + '.' + name)
+        if(module != None): importlib.reload(module)
+
+# Returns the modules with the names (reloaded once in debug mode)
+def loadModules(*names):
+    if(isDebugReload()): reloadModules()
+    return [importlib.import_module('.' + name, __package__) for name in names]
 
 class XNodifyParams(PropertyGroup):
 
@@ -123,6 +160,49 @@ class XNodifyParams(PropertyGroup):
     minimized : BoolProperty(name='Show Minimized', default = False, \
         description='Display nodes in minimized form')
 
+    optimize : BoolProperty(name='Optimize Graph', default = False, \
+        description='Use vector math for component wise math, fuse ' + \
+            'multiply and add, remove identities (e.g. x * 1)')
+
+    reconcile : BoolProperty(name='Update in Place', default = False, \
+        description='Update the nodes created by earlier runs (with this ' + \
+            'option) instead of adding new ones, keeps moved nodes in place')
+
+    inline : BoolProperty(name='Inline Numbers', default = False, \
+        description='Set the numbers given to operators and functions ' + \
+            'as input values instead of creating Value nodes')
+
+    rebalance : BoolProperty(name='Balance Chains', default = False, \
+        description='Arrange long chains of +, *, min, max as balanced ' + \
+            'trees (less deep and narrower layout, float results can ' + \
+                'differ slightly)')
+
+    osl : BoolProperty(name='Compile Math to OSL', default = False, \
+        description='Compile connected math nodes to OSL Script nodes ' + \
+            '(needs Cycles with Open Shading Language)')
+
+    oslGroups : StringProperty(name='OSL Groups', default = '', \
+        description='Comma separated names of the groups whose math is ' + \
+            'compiled to OSL (blank: the whole script)')
+
+    estimateCost : BoolProperty(name='Estimate Render Cost', \
+        default = False, description='Report the estimated render cost ' + \
+            'of the material, its node chain depth and the most ' + \
+                'expensive lines and groups')
+
+    costBudget : FloatProperty(name='Cost Budget', default = 0, min = 0, \
+        description='Warn if the estimated render cost is more than ' + \
+            'this (0: no budget), one unit is about one math node')
+
+    costExpanded : BoolProperty(name='Line Costs', default = False, \
+        description='Nodes, links and time of each line of the last run')
+
+    costSortKey : EnumProperty(name='Sort By', items = COST_SORT_KEYS, \
+        default = 'total', description='Column to sort the line costs by')
+
+    costDescending : BoolProperty(name='Descending', default = True, \
+        description='Highest costs first')
+
     nodeGroup : EnumProperty(name='Node Category', \
         items = getNodeGroups, description='Select node category')
 
@@ -131,11 +211,30 @@ class XNodifyParams(PropertyGroup):
         update = insertNodeDetails)
 
 
+def getCompileOptions(main, params):
+    osl = main.oslgen.parseSelection(params.oslGroups) if params.osl else None
+    return main.CompileOptions(optimize = params.optimize, \
+        reconcile = params.reconcile, inline = params.inline, \
+            rebalance = params.rebalance, osl = osl, \
+                estimateCost = params.estimateCost, \
+                    costBudget = params.costBudget \
+                        if params.costBudget > 0 else None)
+
+def reportOptCounters(op, optCounters):
+    if(len(optCounters) > 0):
+        op.report({'INFO'}, 'Nodes saved: ' + ', '.join(name + ': ' + \
+            str(optCounters[name]) for name in sorted(optCounters)))
+
+# Nodes are generated by a job (see job module) that runs in steps on timer
+# events, so that Blender stays responsive; Esc cancels it and removes the
+# nodes created so far. After that, the nodes are arranged.
 class XNodifyBaseOp(Operator):
     def modal (self, context, event):
         MAX_TRIES = 100
+        if(self.job != None):
+            return self.modalGenerate(context, event)
         if(event.type == 'TIMER'):
-            done = NodeLayout.arrangeNodeLines(self.displayParams, \
+            done = self.main.NodeLayout.arrangeNodeLines(self.displayParams, \
                 testDimensions = self.tryCnt < MAX_TRIES)
             if(done):
                 context.window_manager.event_timer_remove(self._timer)
@@ -143,30 +242,78 @@ class XNodifyBaseOp(Operator):
             self.tryCnt += 1
         return {"PASS_THROUGH"}
 
+    def modalGenerate(self, context, event):
+        wm = context.window_manager
+        if(event.type == 'ESC'):
+            self.job.cancel()
+            self.report({'WARNING'}, 'Generation cancelled')
+        elif(event.type == 'TIMER'):
+            try:
+                self.job.step()
+            except Exception as e:
+                traceback.print_exc()
+                self.report({'ERROR'}, str(e))
+        if(not self.job.isFinished()):
+            wm.progress_update(self.job.progress.getFraction())
+            context.workspace.status_text_set('XNodify: ' + \
+                str(self.job.progress) + ' (Esc to cancel)')
+            return {'RUNNING_MODAL'} # No other input while generating
+
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        job, self.job = self.job, None
+        if(job.state != job.DONE):
+            wm.event_timer_remove(self._timer)
+            return {'CANCELLED'}
+        self.afterGeneration(job.result)
+        return {'RUNNING_MODAL'}
+
+    def afterGeneration(self, displayParams):
+        global lastCostReport
+        self.displayParams = displayParams
+        lastCostReport = displayParams.costReport
+        for lineNo in displayParams.warnings.keys():
+            warningLines = '; '.join(displayParams.warnings[lineNo])
+            self.report({'WARNING'}, 'LINE: ' + str(lineNo) + \
+                ' ' + warningLines)
+        reportOptCounters(self, displayParams.optCounters)
+        stats = displayParams.reconcileStats
+        if(stats != None):
+            self.report({'INFO'}, 'Nodes kept: %d, added: %d, removed: %d, ' \
+                'links changed: %d, values changed: %d' % (stats['kept'], \
+                    stats['added'], stats['removed'], stats['relinked'], \
+                        stats['values']))
+        if(displayParams.renderCost != None):
+            self.report({'INFO'}, displayParams.renderCost.getSummary())
+
+    # Returns GenerationJob
     def _execute(self, context):
         raise NotImplementedError('Call to abstract method')
 
     def execute(self, context):
         self.tryCnt = 0
+        self.job = None
+        wm = context.window_manager
         try:
-            self.displayParams = self._execute(context)
-
-            for lineNo in self.displayParams.warnings.keys():
-                warningLines = '; '.join(self.displayParams.warnings[lineNo])
-                self.report({'WARNING'}, 'LINE: ' + str(lineNo) + \
-                    ' ' + warningLines)
-
-            # Actual arranging is deferred
-            # as dimensions are not available right now
-            wm = context.window_manager
-            self._timer = wm.event_timer_add(time_step = 0.01, \
-                window = context.window)
-            wm.modal_handler_add(self)
-            return {'RUNNING_MODAL'}
+            self.main = loadModules('main')[0]
+            job = self._execute(context)
+            # Small scripts are done in the first step
+            if(job.step()):
+                self.afterGeneration(job.result)
+            else:
+                self.job = job
+                wm.progress_begin(0, 1)
         except Exception as e:
             traceback.print_exc()
             self.report({'ERROR'}, str(e))
-        return {'FINISHED'}
+            return {'FINISHED'}
+
+        # Actual arranging is deferred
+        # as dimensions are not available right now
+        self._timer = wm.event_timer_add(time_step = 0.01, \
+            window = context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
 
 class XNodifyOp(XNodifyBaseOp):
     bl_idname = 'object.xnodify'
@@ -174,24 +321,156 @@ class XNodifyOp(XNodifyBaseOp):
     bl_options = {'REGISTER', 'UNDO'}
 
     def _execute(self, context):
+        main = self.main
         params = context.window_manager.XNodifyParams
         if(params.singleMulti == 'SINGLE'):
             expression = context.window_manager.XNodifyParams.expression
             return main.procStringExpression(expression,\
                 (params.xLocation, params.yLocation), \
                     (params.xScale, params.yScale), params.alignment, \
-                        params.addFrame == 'ALWAYS', params.minimized)
+                        params.addFrame == 'ALWAYS', params.minimized, \
+                            getCompileOptions(main, params), asJob = True)
         elif(params.internalExternal == 'INTERNAL'):
             return main.procScript(params.scriptName,\
                 (params.xLocation, params.yLocation), \
                     (params.xScale, params.yScale), params.alignment, \
-                        params.addFrame != 'NEVER', params.minimized)
+                        params.addFrame != 'NEVER', params.minimized, \
+                            getCompileOptions(main, params), asJob = True)
         else:
             filePath = bpy.path.abspath(params.filePath)
             return main.procFile(filePath,\
                 (params.xLocation, params.yLocation), \
                     (params.xScale, params.yScale), params.alignment, \
-                        params.addFrame != 'NEVER', params.minimized)
+                        params.addFrame != 'NEVER', params.minimized, \
+                            getCompileOptions(main, params), asJob = True)
+
+# Compiles the script once and applies it to materials of all selected objects
+# Per material overrides of $ defaults can be given in the custom property
+# xn_overrides of the material (see compiler.applyOverrides for the format)
+class XNodifyBatchOp(Operator):
+    bl_idname = 'object.xnodify_batch'
+    bl_label = 'Generate for Selected'
+    bl_description = 'Generate nodes in active materials of all the ' + \
+        'selected objects (script is compiled only once)'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def getLines(self, params):
+        if(params.singleMulti == 'SINGLE'):
+            return [params.expression]
+        elif(params.internalExternal == 'INTERNAL'):
+            return [line.body for line in bpy.data.texts[params.scriptName].lines]
+        else:
+            with open(bpy.path.abspath(params.filePath)) as f:
+                return f.readlines()
+
+    def execute(self, context):
+        params = context.window_manager.XNodifyParams
+        main, compiler = loadModules('main', 'compiler')
+        mats = {mat.node_tree: mat for mat in main.getSelectedMaterials()}
+        if(len(mats) == 0):
+            self.report({'ERROR'}, 'No materials in selected objects')
+            return {'CANCELLED'}
+        def getOverrides(nodeTree):
+            overrides = mats[nodeTree].get('xn_overrides')
+            return overrides.to_dict() if overrides != None else None
+        try:
+            addFrame = (params.addFrame == 'ALWAYS') or \
+                (params.singleMulti == 'MULTI' and params.addFrame != 'NEVER')
+            stats = compiler.applyToTrees(self.getLines(params), list(mats), \
+                (params.xLocation, params.yLocation), \
+                    (params.xScale, params.yScale), params.alignment, \
+                        addFrame, params.minimized, getOverrides, \
+                            getCompileOptions(main, params))
+        except Exception as e:
+            traceback.print_exc()
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        for lineNo in stats['warnings'].keys():
+            self.report({'WARNING'}, 'LINE: ' + str(lineNo) + ' ' + \
+                '; '.join(stats['warnings'][lineNo]))
+        self.report({'INFO'}, ('%d materials in %.3fs (compiled once in ' + \
+            '%.3fs), per material compilation: ~%.3fs') % (stats['trees'], \
+                stats['totalTime'], stats['compileTime'], stats['baselineTime']))
+        reportOptCounters(self, stats['optCounters'])
+        return {'FINISHED'}
+
+class XNodifyExportOp(Operator, ExportHelper):
+    bl_idname = 'object.xnodify_export'
+    bl_label = 'Export Node Graph'
+    bl_description = 'Save node tree of the active material as ' + \
+        'compiled node graph (can be loaded as External file)'
+
+    filename_ext = GRAPH_EXT
+    filter_glob : StringProperty(default = '*' + GRAPH_EXT, \
+        options = {'HIDDEN'})
+
+    def execute(self, context):
+        main, graphformat = loadModules('main', 'graphformat')
+        nodeTree = main.getActiveMatTree()
+        if(nodeTree == None):
+            self.report({'ERROR'}, 'No active material')
+            return {'CANCELLED'}
+        with open(self.filepath, 'w') as f:
+            f.write(graphformat.dumps(nodeTree))
+        return {'FINISHED'}
+
+class XNodifyExportCostsOp(Operator, ExportHelper):
+    bl_idname = 'object.xnodify_export_costs'
+    bl_label = 'Export Line Costs'
+    bl_description = 'Save the costs of the lines of the last run ' + \
+        'as CSV or JSON (by the extension)'
+
+    filename_ext = '.csv'
+    check_extension = None # Both .csv and .json
+    filter_glob : StringProperty(default = '*.csv;*.json', \
+        options = {'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return lastCostReport != None
+
+    def execute(self, context):
+        params = context.window_manager.XNodifyParams
+        filePath = self.filepath
+        if(os.path.splitext(filePath)[1].lower() not in {'.csv', '.json'}):
+            filePath += self.filename_ext
+        lastCostReport.write(filePath, params.costSortKey, \
+            params.costDescending)
+        self.report({'INFO'}, '%d lines written to %s' % \
+            (len(lastCostReport.lineCosts), filePath))
+        return {'FINISHED'}
+
+# The script is created as text (Internal script), warnings for what can't
+# be expressed in the script are added at the top as comments
+class XNodifyDecompileOp(Operator):
+    bl_idname = 'object.xnodify_decompile'
+    bl_label = 'Decompile to Script'
+    bl_description = 'Create script from the node tree being edited ' + \
+        '(material or group)'
+
+    def execute(self, context):
+        main, decompiler = loadModules('main', 'decompiler')
+        nodeTree = getattr(context.space_data, 'edit_tree', None)
+        if(nodeTree == None): nodeTree = main.getActiveMatTree()
+        if(nodeTree == None):
+            self.report({'ERROR'}, 'No active material')
+            return {'CANCELLED'}
+        try:
+            lines, warnings = decompiler.decompileTree(nodeTree)
+        except Exception as e:
+            traceback.print_exc()
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        text = bpy.data.texts.new(nodeTree.name + '.edf')
+        text.write(decompiler.getScript(lines, warnings))
+        params = context.window_manager.XNodifyParams
+        params.singleMulti = 'MULTI'
+        params.internalExternal = 'INTERNAL'
+        params.scriptName = text.name
+        self.report({'WARNING'} if len(warnings) > 0 else {'INFO'}, \
+            '%d lines written to %s (%d warnings)' % (len(lines), text.name, \
+                len(warnings)))
+        return {'FINISHED'}
 
 class XNodifyPanel(Panel):
     bl_label = 'XNodify'
@@ -200,6 +479,29 @@ class XNodifyPanel(Panel):
     bl_region_type = 'UI'
     bl_category = 'Edit'
 
+    def drawCostReport(self, col, params):
+        if(lastCostReport == None):
+            col.label(text = 'No costs yet (generate nodes first)')
+            return
+        row = col.row()
+        row.prop(params, 'costSortKey', text = '')
+        row.prop(params, 'costDescending', text = '', icon = 'SORT_DESC' \
+            if params.costDescending else 'SORT_ASC')
+        box = col.box()
+        rows = [('Line', 'Nodes', 'Links', 'ms', 'Uses')]
+        for lineCost in lastCostReport.getSorted(params.costSortKey, \
+            params.costDescending)[:MAX_COST_ROWS]:
+            rows.append((str(lineCost.lineNo), str(lineCost.nodes), \
+                str(lineCost.links), '%.2f' % (lineCost.getTotalTime() * 1000), \
+                    str(lineCost.uses) if lineCost.variable != None else ''))
+        for values in rows:
+            row = box.row()
+            for value in values: row.label(text = value)
+        if(len(lastCostReport.lineCosts) > MAX_COST_ROWS):
+            box.label(text = '%d more lines (see export)' % \
+                (len(lastCostReport.lineCosts) - MAX_COST_ROWS))
+        col.operator('object.xnodify_export_costs')
+
     def draw(self, context):
         params = context.window_manager.XNodifyParams
         layout = self.layout
@@ -238,6 +540,15 @@ class XNodifyPanel(Panel):
             col.prop(params, 'alignment', text = 'Alignment')
             col.prop(params, 'addFrame', text = 'Add Frame')
             col.prop(params, 'minimized', text = 'Show Minimized')
+            col.prop(params, 'optimize', text = 'Optimize Graph')
+            col.prop(params, 'reconcile', text = 'Update in Place')
+            col.prop(params, 'inline', text = 'Inline Numbers')
+            col.prop(params, 'rebalance', text = 'Balance Chains')
+            col.prop(params, 'osl', text = 'Compile Math to OSL')
+            if(params.osl):
+                col.prop(params, 'oslGroups', text = 'Groups')
+            col.prop(params, 'estimateCost', text = 'Estimate Render Cost')
+            col.prop(params, 'costBudget', text = 'Cost Budget')
 
         row = col.row()
         row.prop(params, 'lookupExpanded',
@@ -251,11 +562,27 @@ class XNodifyPanel(Panel):
             row = col.row()
             row.prop(params, 'nodeName', text = 'Node')
 
+        row = col.row()
+        row.prop(params, 'costExpanded',
+            icon='TRIA_DOWN' if params.costExpanded else 'TRIA_RIGHT',
+            icon_only=True, emboss=False
+        )
+        row.label(text='Line Costs')
+        if params.costExpanded:
+            self.drawCostReport(col, params)
+
         col.operator('object.xnodify')
+        col.operator('object.xnodify_batch')
+        col.operator('object.xnodify_export')
+        col.operator('object.xnodify_decompile')
 
 def register():
     bpy.utils.register_class(XNodifyPanel)
     bpy.utils.register_class(XNodifyOp)
+    bpy.utils.register_class(XNodifyBatchOp)
+    bpy.utils.register_class(XNodifyExportOp)
+    bpy.utils.register_class(XNodifyDecompileOp)
+    bpy.utils.register_class(XNodifyExportCostsOp)
 
     bpy.utils.register_class(XNodifyParams)
     bpy.types.WindowManager.XNodifyParams = \
@@ -265,5 +592,9 @@ def unregister():
     del bpy.types.WindowManager.XNodifyParams
     bpy.utils.unregister_class(XNodifyParams)
 
+    bpy.utils.unregister_class(XNodifyExportCostsOp)
+    bpy.utils.unregister_class(XNodifyDecompileOp)
+    bpy.utils.unregister_class(XNodifyExportOp)
+    bpy.utils.unregister_class(XNodifyBatchOp)
     bpy.utils.unregister_class(XNodifyOp)
     bpy.utils.unregister_class(XNodifyPanel)